@@ -1 +1,2 @@
 from .sychronize import *
+from .tensor_augment import TensorSequentialWrapper
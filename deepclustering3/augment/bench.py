@@ -0,0 +1,150 @@
+# this file benchmarks the augmentation pipelines on synthetic ACDC-sized slices.
+#   python -m deepclustering3.augment.bench --num-samples 256 --output augment_bench.json
+import argparse
+import json
+import time
+from typing import Dict, List, Tuple, Callable, Any
+
+import numpy as np
+import torch
+from PIL import Image
+
+from . import pil_augment
+from .sychronize import SequentialWrapper, get_transform
+from .tensor_augment import TensorCompose, TensorRandomRotation, TensorRandomCrop, TensorRandomHorizontalFlip, \
+    TensorCutout, TensorResize, TensorSequentialWrapper
+from ..utils.control import fix_all_seed_within_context
+
+__all__ = ["make_synthetic_samples", "default_pil_transform", "default_tensor_transform", "profile_transforms",
+           "profile_seed_context", "run_benchmark", "main"]
+
+
+def make_synthetic_samples(num_samples: int, size: Tuple[int, int] = (256, 256), num_classes=4, seed=0) \
+    -> Tuple[List[Image.Image], List[Image.Image]]:
+    """grey images and label maps of `size` (h, w), as the slices of ACDC"""
+    rng = np.random.default_rng(seed)
+    images = [Image.fromarray(rng.integers(0, 256, size=size, dtype=np.uint8)) for _ in range(num_samples)]
+    targets = [Image.fromarray(rng.integers(0, num_classes, size=size, dtype=np.uint8)) for _ in range(num_samples)]
+    return images, targets
+
+
+def default_pil_transform(crop_size=224, output_size=192):
+    return pil_augment.Compose([
+        pil_augment.RandomRotation(45), pil_augment.RandomCrop(crop_size), pil_augment.RandomHorizontalFlip(),
+        pil_augment.PILCutout(8, 32), pil_augment.Resize((output_size, output_size)),
+    ])
+
+
+def default_tensor_transform(crop_size=224, output_size=192):
+    return TensorCompose([
+        TensorRandomRotation(45), TensorRandomCrop(crop_size), TensorRandomHorizontalFlip(), TensorCutout(8, 32),
+        TensorResize((output_size, output_size)),
+    ])
+
+
+def _timeit(function: Callable[[], Any], repeats: int) -> float:
+    """best wall time of `repeats` runs, in seconds"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def profile_transforms(transform, images: List[Image.Image], repeats=3) -> List[Dict[str, Any]]:
+    """
+    time each transform yielded by `get_transform(transform)`, fed with the outputs of the previous ones.
+    :return: one record per transform with its mean time per image in µs
+    """
+    records = []
+    for t in get_transform(transform):
+        outputs = [t(x) for x in images]  # the input of the next transform
+        seconds = _timeit(lambda: [t(x) for x in images], repeats)
+        records.append({"transform": repr(t), "us_per_image": seconds / len(images) * 1e6})
+        images = outputs
+    return records
+
+
+def profile_seed_context(num_calls=1000, repeats=3) -> float:
+    """µs spent per `fix_all_seed_within_context` enter/exit, paid per image and per transform by the seeded path"""
+
+    def run():
+        for i in range(num_calls):
+            with fix_all_seed_within_context(i):
+                pass
+
+    return _timeit(run, repeats) / num_calls * 1e6
+
+
+def _engine_record(seconds: float, num_samples: int) -> Dict[str, float]:
+    return {"us_per_sample": seconds / num_samples * 1e6, "samples_per_second": num_samples / seconds}
+
+
+def run_benchmark(num_samples=64, batch_size=16, size: Tuple[int, int] = (256, 256), repeats=3, seed=0) \
+    -> Dict[str, Any]:
+    """
+    profile the default chain transform by transform and compare the engines end to end:
+        - pil: `SequentialWrapper` sample by sample, explicit parameters
+        - pil_seeded: the same chain through `fix_all_seed_within_context`, as for transforms without explicit params
+        - pil_fused: `SequentialWrapper(fuse_geometric=True)`
+        - tensor: `TensorSequentialWrapper` on collated batches of `batch_size`, including the conversion to tensors
+    """
+    images, targets = make_synthetic_samples(num_samples, size=size, seed=seed)
+    crop_size = min(224, *size)
+    pil_transform = default_pil_transform(crop_size=crop_size)
+    results: Dict[str, Any] = {
+        "config": {"num_samples": num_samples, "batch_size": batch_size, "size": list(size), "repeats": repeats,
+                   "torch_threads": torch.get_num_threads()},
+        "per_transform": profile_transforms(pil_transform, images, repeats=repeats),
+        "seed_context_us": profile_seed_context(repeats=repeats),
+        "engines": {},
+    }
+
+    wrappers = {
+        "pil": SequentialWrapper(pil_transform),
+        "pil_fused": SequentialWrapper(pil_transform, fuse_geometric=True),
+        "pil_seeded": SequentialWrapper(pil_transform, explicit_params=False),
+    }
+    for name, wrapper in wrappers.items():
+        seconds = _timeit(lambda: [wrapper([x], [y], com_seed=i) for i, (x, y) in enumerate(zip(images, targets))],
+                          repeats)
+        results["engines"][name] = _engine_record(seconds, num_samples)
+
+    to_tensor, to_label = pil_augment.ToTensor(), pil_augment.ToLabel()
+    tensor_wrapper = TensorSequentialWrapper(default_tensor_transform(crop_size=crop_size))
+    generator = torch.Generator().manual_seed(seed)
+
+    def run_tensor():
+        for start in range(0, num_samples, batch_size):
+            image_batch = torch.stack([to_tensor(x) for x in images[start:start + batch_size]])
+            target_batch = torch.stack([to_label(x) for x in targets[start:start + batch_size]])
+            tensor_wrapper(image_batch, target_batch, generator=generator)
+
+    results["engines"]["tensor"] = _engine_record(_timeit(run_tensor, repeats), num_samples)
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Augmentation pipeline benchmark")
+    parser.add_argument("--num-samples", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--size", type=int, nargs=2, default=[256, 256], metavar=("H", "W"))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--output", type=str, default=None, help="json file, printed if not given")
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    results = run_benchmark(num_samples=args.num_samples, batch_size=args.batch_size, size=tuple(args.size),
+                            repeats=args.repeats)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import math
 import numbers
 import random
 # from typing import *
@@ -13,13 +14,63 @@ from torchvision.transforms import Compose
 from deepclustering3.types import Iterable
 
 __all__ = ["Compose", "PILCutout", "RandomCrop", "RandomHorizontalFlip", "Resize", "CenterCrop",
-           "ToTensor", "ToLabel", "SobelProcess", ]
+           "ToTensor", "ToLabel", "SobelProcess", "has_params_protocol", "affine_warp"]
 
 _pil_interpolation_to_str = {Image.NEAREST: "PIL.Image.NEAREST", Image.BILINEAR: "PIL.Image.BILINEAR",
                              Image.BICUBIC: "PIL.Image.BICUBIC", Image.LANCZOS: "PIL.Image.LANCZOS",
                              Image.HAMMING: "PIL.Image.HAMMING", Image.BOX: "PIL.Image.BOX", }
 
 
+def _flatten(transform) -> List[Callable]:
+    if isinstance(transform, Compose):
+        return [y for x in transform.transforms for y in _flatten(x)]
+    return [transform]
+
+
+def has_params_protocol(transform) -> bool:
+    """
+    whether all transforms of `transform` support the explicit parameter protocol:
+        params = t.sample_params(img.size, rng)  # rng being a `numpy.random.Generator`
+        img = t.apply(img, params, interpolation=None)
+    so that parameters can be drawn once and applied to several images without touching the global random states.
+    """
+    for t in _flatten(transform):
+        if not (callable(getattr(t, "sample_params", None)) and callable(getattr(t, "apply", None))):
+            return False
+        if isinstance(t, RandomTransforms) and not all(has_params_protocol(x) for x in t.transforms):
+            return False
+    return True
+
+
+def _translation(tx: float, ty: float) -> np.ndarray:
+    return np.array([[1, 0, tx], [0, 1, ty], [0, 0, 1]], dtype=np.float64)
+
+
+def _scaling(sx: float, sy: float) -> np.ndarray:
+    return np.array([[sx, 0, 0], [0, sy, 0], [0, 0, 1]], dtype=np.float64)
+
+
+def affine_warp(img: Image.Image, matrix: np.ndarray, size: Tuple[int, int], resample=Image.BILINEAR,
+                fill=0) -> Image.Image:
+    """
+    resample `img` once with the forward (output-from-input) 3x3 `matrix`, in the continuous pixel coordinates used
+    by PIL, into an image of `size` (w, h). Pixels from outside the input are filled with `fill`.
+    """
+    inverse = np.linalg.inv(matrix)
+    return img.transform(size, Image.AFFINE, tuple(inverse[:2].reshape(-1).tolist()), resample=resample,
+                         fillcolor=fill)
+
+
+class _DeterministicTransform(object):
+    """explicit parameter protocol of transforms without randomness"""
+
+    def sample_params(self, size: Tuple[int, int], rng: np.random.Generator) -> None:
+        return None
+
+    def apply(self, img, params=None, interpolation=None):
+        return self(img)
+
+
 def is_np_img_grey(img: np.ndarray):
     return len(img.shape) == 2
 
@@ -28,10 +79,13 @@ def is_np_img_color(img: np.ndarray, color_dim=2):
     return len(img.shape) == 3 and img.shape[color_dim] == 3
 
 
-class Identity(object):
+class Identity(_DeterministicTransform):
     def __call__(self, m: Any) -> Any:
         return m
 
+    def affine(self, size: Tuple[int, int], params=None):
+        return np.eye(3), size
+
     def __repr__(self):
         return "Identify"
 
@@ -68,6 +122,18 @@ class PILCutout(object):
         r_img.paste(self.pad_value, box=box)
         return r_img
 
+    def sample_params(self, size: Tuple[int, int], rng: np.random.Generator) -> Tuple[int, int, int, int]:
+        w, h = size
+        half_box_sz = int(rng.integers(self.min_box, self.max_box + 1)) // 2
+        x_c = int(rng.integers(half_box_sz, w - half_box_sz))
+        y_c = int(rng.integers(half_box_sz, h - half_box_sz))
+        return x_c - half_box_sz, y_c - half_box_sz, x_c + half_box_sz, y_c + half_box_sz
+
+    def apply(self, img: Image.Image, params: Tuple[int, int, int, int], interpolation=None) -> Image.Image:
+        r_img = img.copy()
+        r_img.paste(self.pad_value, box=params)
+        return r_img
+
 
 class RandomCrop(object):
     """Crop the given PIL Image at a random location.
@@ -142,14 +208,7 @@ class RandomCrop(object):
         j = random.randint(0, w - tw)
         return i, j, th, tw
 
-    def __call__(self, img: Image.Image) -> Image.Image:
-        """
-        Args:
-            img (PIL Image): Image to be cropped.
-
-        Returns:
-            PIL Image: Cropped image.
-        """
+    def _pad(self, img: Image.Image) -> Image.Image:
         if self.padding is not None:
             img = tf.pad(img, self.padding, self.fill, self.padding_mode)
 
@@ -163,11 +222,59 @@ class RandomCrop(object):
             img = tf.pad(
                 img, (0, self.size[0] - img.size[1]), self.fill, self.padding_mode
             )
+        return img
+
+    def _padding_geometry(self, size: Tuple[int, int]) -> Tuple[int, int, int, int]:
+        """left and top offsets of the image after `_pad`, with the padded size (w, h)"""
+        w, h = size
+        left, top = 0, 0
+        if self.padding is not None:
+            padding = [self.padding] * 4 if isinstance(self.padding, numbers.Number) else list(self.padding)
+            if len(padding) == 2:
+                padding = padding * 2
+            left, top = padding[0], padding[1]
+            w, h = w + padding[0] + padding[2], h + padding[1] + padding[3]
+        if self.pad_if_needed and w < self.size[1]:
+            left += self.size[1] - w
+            w += 2 * (self.size[1] - w)
+        if self.pad_if_needed and h < self.size[0]:
+            top += self.size[0] - h
+            h += 2 * (self.size[0] - h)
+        return left, top, w, h
+
+    def __call__(self, img: Image.Image) -> Image.Image:
+        """
+        Args:
+            img (PIL Image): Image to be cropped.
+
+        Returns:
+            PIL Image: Cropped image.
+        """
+        img = self._pad(img)
 
         i, j, h, w = self.get_params(img, self.size)
 
         return tf.crop(img, i, j, h, w)
 
+    def sample_params(self, size: Tuple[int, int], rng: np.random.Generator) -> Tuple[int, int, int, int]:
+        """params (i, j, h, w) of the crop, for an image of `size` (w, h) before padding"""
+        _, _, w, h = self._padding_geometry(size)
+        th, tw = self.size
+        if w == tw and h == th:
+            return 0, 0, h, w
+        return int(rng.integers(0, h - th + 1)), int(rng.integers(0, w - tw + 1)), th, tw
+
+    def apply(self, img: Image.Image, params: Tuple[int, int, int, int], interpolation=None) -> Image.Image:
+        return tf.crop(self._pad(img), *params)
+
+    def affine(self, size: Tuple[int, int], params: Tuple[int, int, int, int]):
+        """forward matrix and output size (w, h) of `apply`, None if the padding cannot be expressed as a warp"""
+        if self.padding_mode != "constant" or self.fill != 0:
+            return None
+        left, top, _, _ = self._padding_geometry(size)
+        i, j, th, tw = params
+        return _translation(left - j, top - i), (tw, th)
+
     def __repr__(self) -> str:
         return self.__class__.__name__ + "(size={0}, padding={1})".format(
             self.size, self.padding
@@ -209,6 +316,26 @@ class Resize(object):
         """
         return tf.resize(img, self.size, self.interpolation)
 
+    def sample_params(self, size: Tuple[int, int], rng: np.random.Generator) -> None:
+        return None
+
+    def apply(self, img: Image.Image, params=None, interpolation=None) -> Image.Image:
+        return tf.resize(img, self.size, self.interpolation if interpolation is None else interpolation)
+
+    def affine(self, size: Tuple[int, int], params=None):
+        w, h = size
+        if isinstance(self.size, int):
+            # the smaller edge is matched to `size`, as `tf.resize`
+            if (w <= h and w == self.size) or (h <= w and h == self.size):
+                return np.eye(3), (w, h)
+            if w < h:
+                ow, oh = self.size, int(self.size * h / w)
+            else:
+                oh, ow = self.size, int(self.size * w / h)
+        else:
+            oh, ow = self.size
+        return _scaling(ow / w, oh / h), (ow, oh)
+
     def __repr__(self) -> str:
         interpolate_str = _pil_interpolation_to_str[self.interpolation]
         return self.__class__.__name__ + "(size={0}, " "interpolation={1})".format(
@@ -216,7 +343,7 @@ class Resize(object):
         )
 
 
-class CenterCrop(object):
+class CenterCrop(_DeterministicTransform):
     """Crops the given Tensor Image at the center.
 
     Args:
@@ -240,6 +367,12 @@ class CenterCrop(object):
         """
         return tf.center_crop(img, self.size)
 
+    def affine(self, size: Tuple[int, int], params=None):
+        w, h = size
+        th, tw = self.size
+        top, left = int(round((h - th) / 2.0)), int(round((w - tw) / 2.0))
+        return _translation(-left, -top), (tw, th)
+
     def __repr__(self) -> str:
         return self.__class__.__name__ + "(size={0})".format(self.size)
 
@@ -311,6 +444,24 @@ class RandomRotation(object):
 
         return tf.rotate(img, angle, self.resample, self.expand, self.center)
 
+    def sample_params(self, size: Tuple[int, int], rng: np.random.Generator) -> float:
+        return float(rng.uniform(self.degrees[0], self.degrees[1]))
+
+    def apply(self, img, params: float, interpolation=None):
+        return tf.rotate(img, params, self.resample if interpolation is None else interpolation, self.expand,
+                         self.center)
+
+    def affine(self, size: Tuple[int, int], params: float):
+        """counter-clockwise rotation around the center, as `PIL.Image.rotate`; None with `expand`"""
+        if self.expand:
+            return None
+        w, h = size
+        cx, cy = self.center if self.center is not None else (w / 2.0, h / 2.0)
+        radian = math.radians(params)
+        cos, sin = math.cos(radian), math.sin(radian)
+        rotation = np.array([[cos, sin, 0], [-sin, cos, 0], [0, 0, 1]], dtype=np.float64)
+        return _translation(cx, cy) @ rotation @ _translation(-cx, -cy), (w, h)
+
     def __repr__(self):
         format_string = self.__class__.__name__ + "(degrees={0}".format(self.degrees)
         format_string += ", resample={0}".format(self.resample)
@@ -343,6 +494,16 @@ class RandomHorizontalFlip(object):
             return tf.hflip(img)
         return img
 
+    def sample_params(self, size: Tuple[int, int], rng: np.random.Generator) -> bool:
+        return bool(rng.random() < self.p)
+
+    def apply(self, img, params: bool, interpolation=None):
+        return tf.hflip(img) if params else img
+
+    def affine(self, size: Tuple[int, int], params: bool):
+        w, h = size
+        return (_translation(w, 0) @ _scaling(-1, 1) if params else np.eye(3)), (w, h)
+
     def __repr__(self):
         return self.__class__.__name__ + "(p={})".format(self.p)
 
@@ -369,6 +530,16 @@ class RandomVerticalFlip(object):
             return tf.vflip(img)
         return img
 
+    def sample_params(self, size: Tuple[int, int], rng: np.random.Generator) -> bool:
+        return bool(rng.random() < self.p)
+
+    def apply(self, img, params: bool, interpolation=None):
+        return tf.vflip(img) if params else img
+
+    def affine(self, size: Tuple[int, int], params: bool):
+        w, h = size
+        return (_translation(0, h) @ _scaling(1, -1) if params else np.eye(3)), (w, h)
+
     def __repr__(self):
         return self.__class__.__name__ + "(p={})".format(self.p)
 
@@ -446,6 +617,12 @@ class RandomTransforms(object):
     def __call__(self, *args, **kwargs) -> Any:
         raise NotImplementedError()
 
+    @staticmethod
+    def _apply_sub(transform, img, rng: np.random.Generator, interpolation=None):
+        for t in _flatten(transform):
+            img = t.apply(img, t.sample_params(img.size, rng), interpolation=interpolation)
+        return img
+
     def __repr__(self):
         format_string = self.__class__.__name__ + "("
         for t in self.transforms:
@@ -476,6 +653,20 @@ class RandomApply(RandomTransforms):
             img = t(img)
         return img
 
+    def sample_params(self, size: Tuple[int, int], rng: np.random.Generator) -> Tuple[bool, int]:
+        # the parameters of the sub-transforms depend on intermediate sizes, they are drawn in `apply` from a
+        # child seed, identical for all images sharing these params.
+        return bool(rng.random() <= self.p), int(rng.integers(0, 2 ** 31))
+
+    def apply(self, img: Image.Image, params: Tuple[bool, int], interpolation=None) -> Image.Image:
+        applied, seed = params
+        if not applied:
+            return img
+        rng = np.random.default_rng(seed)
+        for t in self.transforms:
+            img = self._apply_sub(t, img, rng, interpolation)
+        return img
+
     def __repr__(self):
         format_string = self.__class__.__name__ + "("
         format_string += "\n    p={}".format(self.p)
@@ -494,8 +685,15 @@ class RandomChoice(RandomTransforms):
         t = random.choice(self.transforms)
         return t(img)
 
+    def sample_params(self, size: Tuple[int, int], rng: np.random.Generator) -> Tuple[int, int]:
+        return int(rng.integers(0, len(self.transforms))), int(rng.integers(0, 2 ** 31))
+
+    def apply(self, img, params: Tuple[int, int], interpolation=None):
+        choice, seed = params
+        return self._apply_sub(self.transforms[choice], img, np.random.default_rng(seed), interpolation)
 
-class ToTensor(object):
+
+class ToTensor(_DeterministicTransform):
     """Convert a ``PIL Image`` or ``numpy.ndarray`` to tensor.
 
     Converts a PIL Image or numpy.ndarray (H x W x C) in the range
@@ -504,7 +702,11 @@ class ToTensor(object):
     or if the numpy.ndarray has dtype = np.uint8
 
     In the other cases, tensors are returned without scaling.
+
+    8-bit images of modes L, P, RGB and RGBA and uint8 arrays are read from their buffer and converted to float in
+    one pass, the other inputs go through `torchvision.transforms.functional.to_tensor`.
     """
+    _fast_modes = ("L", "P", "RGB", "RGBA")
 
     def __call__(self, pic) -> torch.Tensor:
         """
@@ -516,13 +718,25 @@ class ToTensor(object):
         """
         if isinstance(pic, torch.Tensor):
             return pic
-        return tf.to_tensor(pic)
+        if isinstance(pic, Image.Image) and pic.mode in self._fast_modes:
+            array = np.asarray(pic)
+        elif isinstance(pic, np.ndarray) and pic.dtype == np.uint8 and pic.ndim in (2, 3):
+            array = pic
+        else:
+            return tf.to_tensor(pic)
+        if array.ndim == 2:
+            array = array[None, ...]
+        else:
+            array = array.transpose((2, 0, 1))
+        # transpose and conversion in a single copy, the (read-only) buffer of the image is not copied before.
+        tensor = torch.from_numpy(np.ascontiguousarray(array, dtype=np.float32))
+        return tensor.div_(255)
 
     def __repr__(self):
         return self.__class__.__name__ + "()"
 
 
-class ToLabel(object):
+class ToLabel(_DeterministicTransform):
     """
     PIL image to Label (long) with mapping (dict)
     """
@@ -532,11 +746,23 @@ class ToLabel(object):
         :param mapping: Optional dictionary containing the mapping.
         """
         super().__init__()
-        self.mapping_call = np.vectorize(lambda x: mapping[x]) if mapping else None
+        self.mapping = mapping
+        self._lut, self._valid = None, None
+        if mapping:
+            # the mapping is applied as a lookup table, keys being the label values.
+            keys = np.asarray(list(mapping.keys()), dtype=np.int64)
+            if keys.min() < 0:
+                raise ValueError(f"mapping keys should be non-negative, given {sorted(mapping)}.")
+            self._lut = np.zeros(keys.max() + 1, dtype=np.int64)
+            self._lut[keys] = np.asarray(list(mapping.values()), dtype=np.int64)
+            self._valid = np.zeros(keys.max() + 1, dtype=np.bool_)
+            self._valid[keys] = True
 
     def __call__(self, img: Image.Image):
-        np_img = np.array(img)[None, ...].astype(np.float32)  # type: ignore
-        if self.mapping_call:
-            np_img = self.mapping_call(np_img)
-        t_img = torch.from_numpy(np_img)
-        return t_img.long()
+        np_img = np.asarray(img, dtype=np.int64)[None, ...]  # type: ignore
+        if self._lut is not None:
+            if np_img.min() < 0 or np_img.max() >= len(self._lut) or not self._valid[np_img].all():
+                raise KeyError(f"label values {sorted(set(np.unique(np_img).tolist()) - set(self.mapping))} "
+                               f"are not in the mapping.")
+            np_img = self._lut[np_img]
+        return torch.from_numpy(np_img)
@@ -1,8 +1,9 @@
 import random
 from collections import OrderedDict
 from contextlib import contextmanager
-from typing import Callable, List, Tuple, TypeVar, Iterable
+from typing import Callable, List, Tuple, TypeVar, Iterable, Optional, Dict
 
+import numpy as np
 from PIL import Image
 from torch import Tensor
 from torchvision.transforms import Compose
@@ -10,7 +11,7 @@ from torchvision.transforms import Compose
 from . import pil_augment
 from ..utils.control import fix_all_seed_within_context
 
-__all__ = ["SequentialWrapper", "SequentialWrapperTwice"]
+__all__ = ["SequentialWrapper", "SequentialWrapperTwice", "SequentialWrapperNViews"]
 
 _pil2pil_transform_type = Callable[[Image.Image], Image.Image]
 _pil2tensor_transform_type = Callable[[Image.Image], Tensor]
@@ -54,31 +55,156 @@ def transform_(image, transform, seed):
         return transform(image)
 
 
+def _image_size(image) -> Tuple[int, int]:
+    if isinstance(image, Image.Image):
+        return image.size
+    return image.shape[-1], image.shape[-2]
+
+
+def apply_with_params(image_list: List[T], transform: Callable[[T], T], rng: np.random.Generator,
+                      interpolation=None) -> List[T]:
+    """
+    apply `transform`, supporting the explicit parameter protocol of `pil_augment`, to all images of `image_list`.
+    The parameters of each transform are drawn once from `rng` and shared by all images, the global random states
+    are untouched.
+    :param interpolation: filter passed to the transforms, or a function of the transform returning it, e.g.
+                          `image_filter`. None keeps the filter of each transform.
+    """
+    if not image_list:
+        return image_list
+    for t in get_transform(transform):
+        params = t.sample_params(_image_size(image_list[0]), rng)
+        t_interpolation = interpolation(t) if callable(interpolation) else interpolation
+        image_list = [t.apply(image, params, interpolation=t_interpolation) for image in image_list]
+    return image_list
+
+
+def _resampling_filter(transform) -> Optional[int]:
+    # the filter set on a transform, None for the transforms without one or with the default `resample=False`.
+    resample = getattr(transform, "interpolation", getattr(transform, "resample", None))
+    return None if resample is None or resample is False else resample
+
+
+def image_filter(transform) -> int:
+    """filter of the images resampled by `transform` in the wrappers: its own one, bilinear if it has none"""
+    resample = _resampling_filter(transform)
+    return Image.BILINEAR if resample is None else resample
+
+
+def _is_downsampling(matrix: np.ndarray) -> bool:
+    # PIL resizes with an antialiasing filter when shrinking, which a single affine warp does not have.
+    return bool(np.linalg.svd(matrix[:2, :2], compute_uv=False).min() < 1 - 1e-6)
+
+
+def apply_fused_with_params(image_list: _pil_list, target_list: _pil_list, transform, rng: np.random.Generator,
+                            interpolation=None) -> Tuple[_pil_list, _pil_list]:
+    """
+    as `apply_with_params` for images and targets (nearest) at once, composing each run of consecutive transforms
+    having an `affine` method into one matrix, so that the run costs a single resampling pass per image.
+    Images are resampled with `interpolation` if given, else with `image_filter` of the transforms, the same rule
+    as the unfused path of `SequentialWrapper`: a transform whose filter differs from the one of the current run
+    starts a new run. Transforms shrinking the image are applied on their own, keeping the antialiasing of PIL.
+    """
+    reference = (image_list or target_list or [None])[0]
+    if reference is None:
+        return image_list, target_list
+    size = _image_size(reference)
+    matrix, matrix_size, run_filter = None, size, None
+
+    def flush(images, targets):
+        if matrix is None:
+            return images, targets
+        resample = interpolation if interpolation is not None else run_filter or Image.BILINEAR
+        return [pil_augment.affine_warp(x, matrix, matrix_size, resample) for x in images], \
+               [pil_augment.affine_warp(x, matrix, matrix_size, Image.NEAREST) for x in targets]
+
+    for t in get_transform(transform):
+        params = t.sample_params(matrix_size, rng)
+        affine = t.affine(matrix_size, params) if callable(getattr(t, "affine", None)) else None
+        if affine is not None and not _is_downsampling(affine[0]):
+            # crops and flips move whole pixels and join any run, resampling transforms use `image_filter`
+            resamples = hasattr(t, "interpolation") or hasattr(t, "resample")
+            t_filter = image_filter(t) if resamples and interpolation is None else None
+            if t_filter is not None and run_filter is not None and t_filter != run_filter:
+                image_list, target_list = flush(image_list, target_list)
+                matrix, run_filter = None, None
+            forward, matrix_size = affine
+            matrix = forward if matrix is None else forward @ matrix
+            run_filter = run_filter if t_filter is None else t_filter
+            continue
+        image_list, target_list = flush(image_list, target_list)
+        matrix, run_filter = None, None
+        t_filter = image_filter(t) if interpolation is None else interpolation
+        image_list = [t.apply(x, params, interpolation=t_filter) for x in image_list]
+        target_list = [t.apply(x, params, interpolation=Image.NEAREST) for x in target_list]
+        matrix_size = _image_size((image_list or target_list)[0])
+    return flush(image_list, target_list)
+
+
 class SequentialWrapper:
 
     def __init__(self, com_transform: _pil2pil_transform_type = None,
                  image_transform: _pil2tensor_transform_type = pil_augment.ToTensor(),
-                 target_transform: _pil2tensor_transform_type = pil_augment.ToLabel()) -> None:
+                 target_transform: _pil2tensor_transform_type = pil_augment.ToLabel(),
+                 fuse_geometric=False, explicit_params=True) -> None:
         """
         image -> comm_transform -> img_transform -> Tensor
         target -> comm_transform -> target_transform -> Tensor
         :param com_transform: common geo-transformation
         :param image_transform: transformation only applied for images
         :param target_transform: transformation only applied for targets
+        :param fuse_geometric: compose consecutive crops, flips, rotations and upscaling resizes of `com_transform`
+                               into one affine warp. Either way, images are resampled with the filter of each
+                               transform (bilinear if none is set) and targets with nearest; transforms with
+                               different filters are not fused. Only used when `com_transform` supports explicit
+                               parameters.
+        :param explicit_params: run the transforms supporting `sample_params`/`apply` with a local generator. If
+                                False, all transforms are run under global seeds, as the transforms without
+                                explicit parameters.
         """
         self._com_transform = com_transform
         self._image_transform = image_transform
         self._target_transform = target_transform
+        # transforms supporting `sample_params`/`apply` are run with a local generator instead of global seeds.
+        self._explicit_com = explicit_params and com_transform is not None and \
+                             pil_augment.has_params_protocol(com_transform)
+        self._explicit_image = explicit_params and pil_augment.has_params_protocol(image_transform)
+        self._explicit_target = explicit_params and pil_augment.has_params_protocol(target_transform)
+        self._fuse_geometric = fuse_geometric
 
     def __call__(self, images: _pil_list, targets: _pil_list = None, com_seed: int = None,
                  img_seed: int = None, target_seed: int = None) -> Tuple[List[Tensor], List[Tensor]]:
-        com_seed = com_seed or random_int()
-        img_seed = img_seed or random_int()
-        target_seed = target_seed or random_int()
+        com_seed = random_int() if com_seed is None else com_seed
+        img_seed = random_int() if img_seed is None else img_seed
+        target_seed = random_int() if target_seed is None else target_seed
 
+        image_list_after_transform, target_list_after_transform = self._apply_com(images, targets, com_seed)
+        image_list_after_transform = self._apply_image(image_list_after_transform, img_seed)
+        if targets is not None:
+            target_list_after_transform = self._apply_target(target_list_after_transform, target_seed)
+        return image_list_after_transform, target_list_after_transform
+
+    def _apply_com(self, images: _pil_list, targets: Optional[_pil_list], com_seed: int) \
+        -> Tuple[_pil_list, _pil_list]:
         image_list_after_transform, target_list_after_transform = images, targets or []
 
-        if self._com_transform:
+        if self._com_transform and self._explicit_com and self._fuse_geometric:
+            image_list_after_transform, target_list_after_transform = apply_fused_with_params(
+                image_list_after_transform, target_list_after_transform, self._com_transform,
+                np.random.default_rng(com_seed)
+            )
+        elif self._com_transform and self._explicit_com:
+            # the same generator state for images and targets gives the same parameters
+            image_list_after_transform = apply_with_params(
+                image_list_after_transform, self._com_transform, np.random.default_rng(com_seed),
+                interpolation=image_filter
+            )
+            if targets is not None:
+                target_list_after_transform = apply_with_params(
+                    target_list_after_transform, self._com_transform, np.random.default_rng(com_seed),
+                    interpolation=Image.NEAREST
+                )
+        elif self._com_transform:
             # comm is the optional
             with switch_interpolation(self._com_transform, interp="bilinear"):
                 image_list_after_transform = [transform_(image, self._com_transform, com_seed) for image in
@@ -87,14 +213,17 @@ class SequentialWrapper:
                 with switch_interpolation(self._com_transform, interp="nearest"):
                     target_list_after_transform = [transform_(target, self._com_transform, com_seed) for target in
                                                    target_list_after_transform]
+        return image_list_after_transform, target_list_after_transform
 
-        image_list_after_transform = [transform_(image, self._image_transform, img_seed) for image in
-                                      image_list_after_transform]
-        if targets is not None:
-            target_list_after_transform = [transform_(target, self._target_transform, target_seed) for target in
-                                           target_list_after_transform]
+    def _apply_image(self, images: _pil_list, img_seed: int) -> List[Tensor]:
+        if self._explicit_image:
+            return apply_with_params(images, self._image_transform, np.random.default_rng(img_seed))
+        return [transform_(image, self._image_transform, img_seed) for image in images]
 
-        return image_list_after_transform, target_list_after_transform
+    def _apply_target(self, targets: _pil_list, target_seed: int) -> List[Tensor]:
+        if self._explicit_target:
+            return apply_with_params(targets, self._target_transform, np.random.default_rng(target_seed))
+        return [transform_(target, self._target_transform, target_seed) for target in targets]
 
     def __repr__(self):
         return (
@@ -104,41 +233,65 @@ class SequentialWrapper:
         )
 
 
-class SequentialWrapperTwice(SequentialWrapper):
+class SequentialWrapperNViews(SequentialWrapper):
 
-    def __init__(self, com_transform: _pil2pil_transform_type = None,
+    def __init__(self, n_views: int, com_transform: _pil2pil_transform_type = None,
                  image_transform: _pil2tensor_transform_type = pil_augment.ToTensor(),
                  target_transform: _pil2tensor_transform_type = pil_augment.ToLabel(),
-                 total_freedom=True) -> None:
+                 total_freedom=True, fuse_geometric=False, explicit_params=True) -> None:
         """
-        :param total_freedom: if True, the two-time generated images are using different seeds for all aspect,
-                              otherwise, the images are used different random seed only for img_seed
+        generate `n_views` views of the same sample.
+        Views sharing the same common seed share the output of `com_transform`, and the same target output, so that
+        only `image_transform` is computed for each view. The shared target tensors are the same objects.
+        :param n_views: number of views
+        :param total_freedom: if True, the views are using different seeds for all aspect,
+                              otherwise, the views are using different random seed only for img_seed
         """
-        super().__init__(com_transform, image_transform, target_transform)
+        if n_views <= 0:
+            raise ValueError(f"n_views should be a positive integer, given {n_views}.")
+        super().__init__(com_transform, image_transform, target_transform, fuse_geometric=fuse_geometric,
+                         explicit_params=explicit_params)
+        self._n_views = n_views
         self._total_freedom = total_freedom
 
     def __call__(self, image_list: _pil_list, target_list: _pil_list = None, seed: int = None, **kwargs) -> \
         Tuple[List[Tensor], List[Tensor]]:
-        seed = seed or random_int()
-
-        with fix_all_seed_within_context(seed):
-            comm_seed1, comm_seed2 = random_int(), random_int()
-            img_seed1, img_seed2 = random_int(), random_int()
-            target_seed1, target_seed2 = random_int(), random_int()
-
-            if self._total_freedom:
-                image_list1, target_list1 = super(SequentialWrapperTwice, self).__call__(image_list, target_list,
-                                                                                         comm_seed1, img_seed1,
-                                                                                         target_seed1)
-                image_list2, target_list2 = super(SequentialWrapperTwice, self).__call__(image_list, target_list,
-                                                                                         comm_seed2, img_seed2,
-                                                                                         target_seed2)
-                return [*image_list1, *image_list2], [*target_list1, *target_list2]
-
-            image_list1, target_list1 = super(SequentialWrapperTwice, self).__call__(image_list, target_list,
-                                                                                     comm_seed1, img_seed1,
-                                                                                     target_seed1)
-            image_list2, target_list2 = super(SequentialWrapperTwice, self).__call__(image_list, target_list,
-                                                                                     comm_seed1, img_seed2,
-                                                                                     target_seed1)
-            return [*image_list1, *image_list2], [*target_list1, *target_list2]
+        seed = random_int() if seed is None else seed
+        n = self._n_views
+
+        # the seeds of all views are drawn from a local generator, the global random states are untouched.
+        seeds = np.random.default_rng(seed).integers(0, int(1e5) + 1, size=3 * n).tolist()
+        com_seeds, img_seeds, target_seeds = seeds[:n], seeds[n:2 * n], seeds[2 * n:]
+        if not self._total_freedom:
+            com_seeds, target_seeds = [com_seeds[0]] * n, [target_seeds[0]] * n
+
+        com_outputs: Dict[int, Tuple[_pil_list, _pil_list]] = {}
+        target_outputs: Dict[Tuple[int, int], List[Tensor]] = {}
+        image_views, target_views = [], []
+        for com_seed, img_seed, target_seed in zip(com_seeds, img_seeds, target_seeds):
+            if com_seed not in com_outputs:
+                com_outputs[com_seed] = self._apply_com(image_list, target_list, com_seed)
+            images, targets = com_outputs[com_seed]
+            image_views.extend(self._apply_image(images, img_seed))
+            if target_list is not None:
+                if (com_seed, target_seed) not in target_outputs:
+                    target_outputs[(com_seed, target_seed)] = self._apply_target(targets, target_seed)
+                target_views.extend(target_outputs[(com_seed, target_seed)])
+        return image_views, target_views
+
+    def __repr__(self):
+        return f"n_views: {self._n_views}\n" + super().__repr__()
+
+
+class SequentialWrapperTwice(SequentialWrapperNViews):
+
+    def __init__(self, com_transform: _pil2pil_transform_type = None,
+                 image_transform: _pil2tensor_transform_type = pil_augment.ToTensor(),
+                 target_transform: _pil2tensor_transform_type = pil_augment.ToLabel(),
+                 total_freedom=True, fuse_geometric=False, explicit_params=True) -> None:
+        """
+        :param total_freedom: if True, the two-time generated images are using different seeds for all aspect,
+                              otherwise, the images are used different random seed only for img_seed
+        """
+        super().__init__(2, com_transform, image_transform, target_transform, total_freedom=total_freedom,
+                         fuse_geometric=fuse_geometric, explicit_params=explicit_params)
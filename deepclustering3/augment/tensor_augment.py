@@ -0,0 +1,298 @@
+# this file provides geometric transforms applied to whole (B, C, H, W) tensor batches, with explicit per-sample
+# parameters drawn from a `torch.Generator` instead of the global random states.
+import math
+import numbers
+from typing import Dict, Tuple, Union, List, Sequence, Optional
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+__all__ = ["TensorRandomCrop", "TensorCenterCrop", "TensorRandomHorizontalFlip", "TensorRandomVerticalFlip",
+           "TensorRandomRotation", "TensorResize", "TensorCutout", "TensorCompose", "TensorSequentialWrapper"]
+
+_params_type = Dict[str, Tensor]
+
+
+def _pair(size: Union[int, Sequence[int]]) -> Tuple[int, int]:
+    if isinstance(size, numbers.Number):
+        return int(size), int(size)
+    assert len(size) == 2, size
+    return int(size[0]), int(size[1])
+
+
+def _uniform(low: float, high: float, batch_size: int, generator: torch.Generator = None) -> Tensor:
+    return torch.rand(batch_size, generator=generator, dtype=torch.float64) * (high - low) + low
+
+
+def _randint(low: int, high: int, batch_size: int, generator: torch.Generator = None) -> Tensor:
+    """uniform integers in [low, high]"""
+    return torch.randint(low, high + 1, (batch_size,), generator=generator)
+
+
+class _TensorTransform:
+    """
+    base of the batched transforms.
+    `get_params` draws the parameters of all samples of a batch at once, on cpu, and `apply` applies them to any
+    (B, C, H, W) float tensor, so that images and targets share the same parameters.
+    """
+
+    def get_params(self, batch_size: int, height: int, width: int, generator: torch.Generator = None) \
+        -> _params_type:
+        return {}
+
+    def apply(self, x: Tensor, params: _params_type, interpolation: str = "bilinear") -> Tensor:
+        raise NotImplementedError
+
+    def output_size(self, height: int, width: int) -> Tuple[int, int]:
+        return height, width
+
+    def __call__(self, x: Tensor, generator: torch.Generator = None) -> Tensor:
+        b, _, h, w = x.shape
+        return self.apply(x, self.get_params(b, h, w, generator=generator))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}()"
+
+
+class TensorRandomCrop(_TensorTransform):
+    """crop each sample at its own random location, with one advanced indexing over the batch"""
+
+    def __init__(self, size: Union[int, Tuple[int, int]]) -> None:
+        self.size = _pair(size)
+
+    def get_params(self, batch_size, height, width, generator=None):
+        th, tw = self.size
+        if th > height or tw > width:
+            raise ValueError(f"crop size {self.size} is larger than the input size {(height, width)}.")
+        return {"top": _randint(0, height - th, batch_size, generator),
+                "left": _randint(0, width - tw, batch_size, generator)}
+
+    def apply(self, x, params, interpolation="bilinear"):
+        th, tw = self.size
+        top, left = params["top"].to(x.device), params["left"].to(x.device)
+        rows = top[:, None] + torch.arange(th, device=x.device)  # (B, th)
+        cols = left[:, None] + torch.arange(tw, device=x.device)  # (B, tw)
+        batch = torch.arange(x.shape[0], device=x.device)[:, None, None]
+        return x.permute(0, 2, 3, 1)[batch, rows[:, :, None], cols[:, None, :]].permute(0, 3, 1, 2).contiguous()
+
+    def output_size(self, height, width):
+        return self.size
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(size={self.size})"
+
+
+class TensorCenterCrop(_TensorTransform):
+
+    def __init__(self, size: Union[int, Tuple[int, int]]) -> None:
+        self.size = _pair(size)
+
+    def apply(self, x, params, interpolation="bilinear"):
+        th, tw = self.size
+        h, w = x.shape[-2:]
+        top, left = int(round((h - th) / 2.0)), int(round((w - tw) / 2.0))
+        return x[..., top:top + th, left:left + tw]
+
+    def output_size(self, height, width):
+        return self.size
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(size={self.size})"
+
+
+class _TensorRandomFlip(_TensorTransform):
+    _dim: int
+
+    def __init__(self, p=0.5) -> None:
+        self.p = p
+
+    def get_params(self, batch_size, height, width, generator=None):
+        return {"flip": torch.rand(batch_size, generator=generator) < self.p}
+
+    def apply(self, x, params, interpolation="bilinear"):
+        flip = params["flip"].to(x.device)
+        return torch.where(flip[:, None, None, None], x.flip(self._dim), x)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(p={self.p})"
+
+
+class TensorRandomHorizontalFlip(_TensorRandomFlip):
+    _dim = -1
+
+
+class TensorRandomVerticalFlip(_TensorRandomFlip):
+    _dim = -2
+
+
+class TensorRandomRotation(_TensorTransform):
+    """
+    rotate each sample by its own angle around the image center, counter-clockwise for positive angles as
+    `PIL.Image.rotate`. Pixels coming from outside the image are filled with 0.
+    """
+
+    def __init__(self, degrees: Union[float, Tuple[float, float]]) -> None:
+        if isinstance(degrees, numbers.Number):
+            if degrees < 0:
+                raise ValueError("If degrees is a single number, it must be positive.")
+            degrees = (-degrees, degrees)
+        if len(degrees) != 2:
+            raise ValueError("If degrees is a sequence, it must be of len 2.")
+        self.degrees = (float(degrees[0]), float(degrees[1]))
+
+    def get_params(self, batch_size, height, width, generator=None):
+        return {"angle": _uniform(*self.degrees, batch_size, generator)}
+
+    @staticmethod
+    def _theta(angle: Tensor, height: int, width: int) -> Tensor:
+        # input-from-output matrix in the normalized coordinates of `affine_grid`, corrected for the aspect ratio.
+        radian = angle * math.pi / 180
+        cos, sin = torch.cos(radian), torch.sin(radian)
+        zero = torch.zeros_like(cos)
+        theta = torch.stack([
+            torch.stack([cos, -sin * height / width, zero], dim=1),
+            torch.stack([sin * width / height, cos, zero], dim=1),
+        ], dim=1)
+        return theta
+
+    def apply(self, x, params, interpolation="bilinear"):
+        b, c, h, w = x.shape
+        theta = self._theta(params["angle"], h, w).to(device=x.device, dtype=x.dtype)
+        grid = F.affine_grid(theta, [b, c, h, w], align_corners=False)
+        return F.grid_sample(x, grid, mode=interpolation, padding_mode="zeros", align_corners=False)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(degrees={self.degrees})"
+
+
+class TensorResize(_TensorTransform):
+
+    def __init__(self, size: Union[int, Tuple[int, int]]) -> None:
+        self.size = _pair(size)
+
+    def apply(self, x, params, interpolation="bilinear"):
+        if interpolation == "nearest":
+            return F.interpolate(x, size=self.size, mode="nearest")
+        return F.interpolate(x, size=self.size, mode=interpolation, align_corners=False)
+
+    def output_size(self, height, width):
+        return self.size
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(size={self.size})"
+
+
+class TensorCutout(_TensorTransform):
+    """batched `PILCutout`: fill a random square box of each sample with `pad_value`"""
+
+    def __init__(self, min_box: int, max_box: int, pad_value: int = 0) -> None:
+        self.min_box = int(min_box)
+        self.max_box = int(max_box)
+        self.pad_value = int(pad_value)
+
+    def get_params(self, batch_size, height, width, generator=None):
+        half = _randint(self.min_box, self.max_box, batch_size, generator) // 2
+        # same ranges as `PILCutout`, centers in [half, size - half).
+        x_c = half + (torch.rand(batch_size, generator=generator) * (width - 2 * half).clamp_min(1)).long()
+        y_c = half + (torch.rand(batch_size, generator=generator) * (height - 2 * half).clamp_min(1)).long()
+        return {"left": x_c - half, "top": y_c - half, "right": x_c + half, "bottom": y_c + half}
+
+    def apply(self, x, params, interpolation="bilinear"):
+        h, w = x.shape[-2:]
+        rows = torch.arange(h, device=x.device)[None, :]
+        cols = torch.arange(w, device=x.device)[None, :]
+        p = {k: v.to(x.device)[:, None] for k, v in params.items()}
+        row_mask = (rows >= p["top"]) & (rows < p["bottom"])  # (B, H)
+        col_mask = (cols >= p["left"]) & (cols < p["right"])  # (B, W)
+        mask = (row_mask[:, :, None] & col_mask[:, None, :])[:, None]
+        return x.masked_fill(mask, self.pad_value)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(min_box={self.min_box}, max_box={self.max_box})"
+
+
+class TensorCompose(_TensorTransform):
+    def __init__(self, transforms: List[_TensorTransform]) -> None:
+        self.transforms = list(transforms)
+
+    def __iter__(self):
+        return iter(self.transforms)
+
+    def sample_params(self, batch_size: int, height: int, width: int, generator: torch.Generator = None) \
+        -> List[_params_type]:
+        """parameters of all transforms, following the size of the intermediate outputs"""
+        params = []
+        for t in self.transforms:
+            params.append(t.get_params(batch_size, height, width, generator=generator))
+            height, width = t.output_size(height, width)
+        return params
+
+    def apply_all(self, x: Tensor, params: List[_params_type], interpolation="bilinear") -> Tensor:
+        for t, p in zip(self.transforms, params):
+            x = t.apply(x, p, interpolation=interpolation)
+        return x
+
+    def __call__(self, x: Tensor, generator: torch.Generator = None) -> Tensor:
+        b, _, h, w = x.shape
+        return self.apply_all(x, self.sample_params(b, h, w, generator=generator))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.transforms})"
+
+
+class TensorSequentialWrapper:
+    """
+    batched counterpart of `SequentialWrapper`, applied after collation in the main process.
+
+    images (B, C, H, W) float -> com_transform (bilinear) -> image_transform -> Tensor
+    targets (B, H, W) or (B, 1, H, W) long -> com_transform (nearest) -> target_transform -> Tensor
+
+    The parameters of `com_transform` are drawn once per sample and shared by the image and the target.
+    """
+
+    def __init__(self, com_transform: Union[TensorCompose, List[_TensorTransform]] = None,
+                 image_transform=None, target_transform=None) -> None:
+        if com_transform is not None and not isinstance(com_transform, TensorCompose):
+            com_transform = TensorCompose(com_transform)
+        self._com_transform: Optional[TensorCompose] = com_transform
+        self._image_transform = image_transform
+        self._target_transform = target_transform
+
+    def __call__(self, images: Tensor, targets: Tensor = None, generator: torch.Generator = None) \
+        -> Tuple[Tensor, Optional[Tensor]]:
+        """
+        :param images: batch of images (B, C, H, W)
+        :param targets: optional batch of label maps (B, H, W) or (B, C, H, W)
+        :param generator: generator of the random parameters, the global torch generator if None
+        """
+        if not images.is_floating_point():
+            raise TypeError(f"images should be a float tensor, given {images.dtype}.")
+        squeeze = targets is not None and targets.dim() == 3
+        if squeeze:
+            targets = targets[:, None]
+
+        if self._com_transform is not None:
+            b, _, h, w = images.shape
+            params = self._com_transform.sample_params(b, h, w, generator=generator)
+            images = self._com_transform.apply_all(images, params, interpolation="bilinear")
+            if targets is not None:
+                target_dtype = targets.dtype
+                targets = self._com_transform.apply_all(targets.float(), params, interpolation="nearest")
+                targets = targets.round().to(target_dtype)
+
+        if self._image_transform is not None:
+            images = self._image_transform(images)
+        if targets is not None:
+            if squeeze:
+                targets = targets[:, 0]
+            if self._target_transform is not None:
+                targets = self._target_transform(targets)
+        return images, targets
+
+    def __repr__(self):
+        return (
+            f"comm_transform:{self._com_transform}\n"
+            f"img_transform:{self._image_transform}.\n"
+            f"target_transform: {self._target_transform}"
+        )
@@ -4,7 +4,7 @@ import torch
 import torch.nn as nn
 from torch import Tensor
 
-from ..utils import simplex, assert_list
+from ..utils import simplex, assert_list, validate
 
 
 def _check_reduction_params(reduction):
@@ -32,7 +32,7 @@ class Entropy(nn.Module):
     def forward(self, input: Tensor) -> Tensor:
         assert input.shape.__len__() >= 2
         b, _, *s = input.shape
-        assert simplex(input), f"Entropy input should be a simplex"
+        validate(simplex, input)  # Entropy input should be a simplex
         e = input * (input + self._eps).log()
         e = -1.0 * e.sum(1)
         assert e.shape == torch.Size([b, *s])
@@ -0,0 +1,80 @@
+# this file provides a collate function writing each field of a batch into one preallocated tensor.
+import collections.abc
+from typing import Tuple, Sequence, Any
+
+import numpy as np
+import torch
+from PIL import Image
+from torch import Tensor
+from torch.utils.data import get_worker_info
+from torch.utils.data._utils.collate import default_collate  # noqa
+
+__all__ = ["fast_collate"]
+
+
+# unsigned types without a torch counterpart, widened to the next signed type, e.g. for `I;16` images.
+_widened_dtypes = {np.dtype(np.uint16): torch.int32, np.dtype(np.uint32): torch.int64}
+
+
+def _empty(shape: Tuple[int, ...], dtype: torch.dtype) -> Tensor:
+    out = torch.empty(shape, dtype=dtype)
+    if get_worker_info() is not None:
+        # inside a worker, the batch is put in shared memory, so that it is not copied again to the main process.
+        out.share_memory_()
+    return out
+
+
+def _torch_dtype(dtype: np.dtype) -> torch.dtype:
+    dtype = dtype.newbyteorder("=")
+    if dtype in _widened_dtypes:
+        return _widened_dtypes[dtype]
+    return torch.from_numpy(np.empty(0, dtype=dtype)).dtype
+
+
+def _collate_arrays(batch: Sequence[np.ndarray]) -> Tensor:
+    """stack (H, W) or (H, W, C) arrays into one (B, C, H, W) tensor of the same dtype, or a wider one for uint16"""
+    first = batch[0]
+    if first.ndim == 2:
+        shape = (len(batch), 1, *first.shape)
+    else:
+        shape = (len(batch), first.shape[2], *first.shape[:2])
+    out = _empty(shape, _torch_dtype(first.dtype))
+    out_array = out.numpy()
+    for i, array in enumerate(batch):
+        if array.shape != first.shape:
+            raise RuntimeError(f"arrays of a batch should share the same shape, given {first.shape} and "
+                               f"{array.shape}.")
+        out_array[i] = array[None] if array.ndim == 2 else array.transpose((2, 0, 1))
+    return out
+
+
+def fast_collate(batch: Sequence[Any]) -> Any:
+    """
+    collate function of `DataLoader` allocating each field of the batch once.
+
+    PIL images and numpy arrays are read from their buffer and written into one (B, C, H, W) tensor keeping their
+    dtype, e.g. uint8 for 8-bit images, so that the conversion to float can be done once on the device. uint16,
+    e.g. of `I;16` images, which torch does not support, is widened to int32:
+        >>> image = image.to(device, non_blocking=True).float().div_(255)  # noqa
+    Tensors are stacked into one preallocated tensor, nested tuples, lists and dicts are collated field by field,
+    other types are delegated to `default_collate`.
+    """
+    elem = batch[0]
+    if isinstance(elem, Image.Image):
+        return _collate_arrays([np.asarray(x) for x in batch])
+    if isinstance(elem, np.ndarray) and elem.ndim in (2, 3) and elem.dtype.kind in "biuf" and \
+        elem.dtype.newbyteorder("=") != np.uint64:
+        return _collate_arrays(batch)
+    if isinstance(elem, Tensor):
+        if elem.device.type != "cpu":
+            return torch.stack(batch, 0)
+        return torch.stack(batch, 0, out=_empty((len(batch), *elem.shape), elem.dtype))
+    if isinstance(elem, tuple) and hasattr(elem, "_fields"):  # namedtuple
+        return type(elem)(*(fast_collate(samples) for samples in zip(*batch)))
+    if isinstance(elem, collections.abc.Sequence) and not isinstance(elem, (str, bytes)):
+        if any(len(x) != len(elem) for x in batch):
+            raise RuntimeError("each element in list of batch should be of equal size")
+        return [fast_collate(samples) for samples in zip(*batch)]
+    if isinstance(elem, collections.abc.Mapping):
+        return {key: fast_collate([d[key] for d in batch]) for key in elem}
+    return default_collate(batch)
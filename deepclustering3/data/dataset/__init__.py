@@ -1 +1,2 @@
-from .base import *
\ No newline at end of file
+from .base import *
+from .volume import *
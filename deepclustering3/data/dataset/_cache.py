@@ -0,0 +1,129 @@
+# this file provides a per-process byte-bounded LRU cache for decoded images.
+import multiprocessing as mp
+from collections import OrderedDict
+from typing import Hashable, Optional, Dict
+
+import numpy as np
+
+__all__ = ["LRUArrayCache"]
+
+_HIT, _MISS, _EVICTION = 0, 1, 2
+
+
+class LRUArrayCache:
+    """
+    Byte-bounded LRU cache of decoded numpy arrays, keyed by (sub_folder, index), held by each process.
+
+    This is a per-worker cache: every DataLoader worker owns a copy of the cache, bounded by `max_bytes` on its
+    own, so that the total memory is up to `max_bytes` times the number of workers. The entries inserted before
+    the workers start (see `DatasetBase.warm_cache`) are inherited by all workers, shared copy-on-write with the
+    `fork` start method since the array buffers are never written after insertion, and pickled into each worker
+    with `spawn`/`forkserver`. The entries decoded inside a worker are private to that worker.
+
+    With `shared_counters=True`, the hit/miss/eviction counters live in shared memory and are updated under its
+    lock, so that the statistics of forked workers are visible from the main process. The shared counters cannot
+    be pickled: a pickled cache, e.g. in a spawned worker, counts on its own from a copy of the counters.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, shared_counters=False) -> None:
+        """
+        :param max_bytes: budget of the cache in bytes per process, None means unbounded
+        :param shared_counters: put the counters in shared memory, for forked workers only
+        """
+        if max_bytes is not None and max_bytes <= 0:
+            raise ValueError(f"max_bytes should be a positive integer or None, given {max_bytes}.")
+        self._max_bytes = max_bytes
+        self._shared_counters = shared_counters
+        self._storage: "OrderedDict[Hashable, np.ndarray]" = OrderedDict()
+        self._nbytes = 0
+        self._counters = mp.Array("q", 3) if shared_counters else [0, 0, 0]
+
+    @property
+    def max_bytes(self) -> Optional[int]:
+        return self._max_bytes
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    @property
+    def hits(self) -> int:
+        return self._counters[_HIT]
+
+    @property
+    def misses(self) -> int:
+        return self._counters[_MISS]
+
+    @property
+    def evictions(self) -> int:
+        return self._counters[_EVICTION]
+
+    def _increase(self, counter: int) -> None:
+        if self._shared_counters:
+            # `+=` on shared memory is a read then a write, racing between workers without the lock.
+            with self._counters.get_lock():
+                self._counters[counter] += 1
+        else:
+            self._counters[counter] += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self),
+                "nbytes": self.nbytes}
+
+    def __len__(self) -> int:
+        return len(self._storage)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._storage
+
+    def is_full(self, extra_bytes=0) -> bool:
+        return self._max_bytes is not None and self._nbytes + extra_bytes > self._max_bytes
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        array = self._storage.get(key)
+        if array is None:
+            self._increase(_MISS)
+            return None
+        self._storage.move_to_end(key)
+        self._increase(_HIT)
+        return array
+
+    def peek(self, key: Hashable) -> Optional[np.ndarray]:
+        """get an entry without touching its recency nor the counters"""
+        return self._storage.get(key)
+
+    def put(self, key: Hashable, array: np.ndarray) -> None:
+        if key in self._storage:
+            self._nbytes -= self._storage.pop(key).nbytes
+        if self._max_bytes is not None and array.nbytes > self._max_bytes:
+            return
+        while self.is_full(array.nbytes):
+            _, evicted = self._storage.popitem(last=False)
+            self._nbytes -= evicted.nbytes
+            self._increase(_EVICTION)
+        array.setflags(write=False)
+        self._storage[key] = array
+        self._nbytes += array.nbytes
+
+    def clear(self) -> None:
+        self._storage = OrderedDict()
+        self._nbytes = 0
+        if self._shared_counters:
+            with self._counters.get_lock():
+                self._counters[:] = [0, 0, 0]
+        else:
+            self._counters[:] = [0, 0, 0]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._shared_counters:
+            # a synchronized array is only shared by inheritance, the copy counts locally.
+            state["_shared_counters"], state["_counters"] = False, list(self._counters)
+        return state
+
+    def __deepcopy__(self, memo):
+        # a copied dataset starts with an empty cache of the same budget.
+        return type(self)(max_bytes=self._max_bytes, shared_counters=self._shared_counters)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(max_bytes={self._max_bytes}, {self.stats()})"
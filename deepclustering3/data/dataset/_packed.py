@@ -0,0 +1,190 @@
+# this file packs the slices of a dataset into one memory-mapped file per sub-folder, so that samples can be served
+# as zero-copy views instead of being decoded from png for each access.
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from deepclustering3.logger import logger
+from deepclustering3.mytqdm import tqdm
+
+__all__ = ["PackedSliceStore", "pack_sub_folder", "pack_memory_dictionary"]
+
+_mode2dtype = {"L": np.uint8, "P": np.uint8, "RGB": np.uint8, "RGBA": np.uint8, "I;16": np.uint16}
+
+
+def _data_path(pack_dir: str, sub_folder: str) -> str:
+    return os.path.join(pack_dir, f"{sub_folder}.bin")
+
+
+def _index_path(pack_dir: str, sub_folder: str) -> str:
+    return os.path.join(pack_dir, f"{sub_folder}.index.npz")
+
+
+def _palette(img: Image.Image) -> Optional[np.ndarray]:
+    # 256 rgb entries, padded as PIL may return a shorter palette
+    if img.mode != "P":
+        return None
+    palette = np.zeros(768, dtype=np.uint8)
+    raw = img.getpalette() or []
+    palette[:len(raw)] = raw[:768]
+    return palette
+
+
+def _file_stat(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def pack_sub_folder(path_list: List[str], pack_dir: str, sub_folder: str) -> "PackedSliceStore":
+    """
+    decode all images of `path_list` once and write them into `pack_dir/sub_folder.bin`, with an offset/shape index
+    saved as `pack_dir/sub_folder.index.npz`. The index also keeps the mtime and the size of each file, to detect
+    the files modified after packing, and the palette of `P` images.
+    All images of one sub-folder must share the same PIL mode.
+    """
+    # first pass only reads the headers to build the index.
+    shapes, modes, stats, palettes = [], set(), [], []
+    for path in path_list:
+        stats.append(_file_stat(path))
+        with Image.open(path) as img:
+            w, h = img.size
+            channel = len(img.getbands())
+            shapes.append((h, w, channel))
+            modes.add(img.mode)
+            palettes.append(_palette(img))
+    if len(modes) != 1:
+        raise ValueError(f"images of {sub_folder} should share the same mode to be packed, given {sorted(modes)}.")
+    mode = modes.pop()
+    if mode not in _mode2dtype:
+        raise ValueError(f"mode {mode} of {sub_folder} is not supported, only {', '.join(_mode2dtype)} are.")
+    dtype = np.dtype(_mode2dtype[mode])
+
+    shapes_ = np.asarray(shapes, dtype=np.int64).reshape(-1, 3)
+    sizes = shapes_.prod(axis=1)
+    offsets = np.zeros(len(path_list), dtype=np.int64)
+    offsets[1:] = np.cumsum(sizes)[:-1]
+    total = int(sizes.sum())
+
+    Path(pack_dir).mkdir(parents=True, exist_ok=True)
+    array = np.memmap(_data_path(pack_dir, sub_folder), dtype=dtype, mode="w+", shape=(max(total, 1),))
+    # second pass decodes each image exactly once.
+    for path, offset, size in tqdm(zip(path_list, offsets, sizes), total=len(path_list)):
+        with Image.open(path) as img:
+            array[offset:offset + size] = np.asarray(img, dtype=dtype).reshape(-1)
+    array.flush()
+    del array
+
+    index = dict(offsets=offsets, shapes=shapes_, paths=np.asarray(path_list), mode=np.asarray(mode),
+                 dtype=np.asarray(dtype.str), stats=np.asarray(stats, dtype=np.int64).reshape(-1, 2))
+    if mode == "P":
+        index["palettes"] = np.stack(palettes) if palettes else np.zeros((0, 768), dtype=np.uint8)
+    np.savez(_index_path(pack_dir, sub_folder), **index)
+    return PackedSliceStore(pack_dir, sub_folder)
+
+
+def pack_memory_dictionary(memory: Dict[str, List[str]], pack_dir: str, overwrite=False) \
+    -> Dict[str, "PackedSliceStore"]:
+    """
+    pack each sub-folder of a memory dictionary built by `make_memory_dictionary`.
+    Existing packs are reused if they contain all the required paths unmodified, unless `overwrite` is set.
+    """
+    stores = {}
+    for sub_folder, path_list in memory.items():
+        store: Optional[PackedSliceStore] = None
+        if not overwrite and Path(_index_path(pack_dir, sub_folder)).exists():
+            store = PackedSliceStore(pack_dir, sub_folder)
+            if not store.contains(path_list):
+                store = None
+        if store is None:
+            logger.opt(depth=1).trace(f"packing {len(path_list)} images of {sub_folder} into {pack_dir}")
+            store = pack_sub_folder(path_list, pack_dir, sub_folder)
+        stores[sub_folder] = store
+    return stores
+
+
+class PackedSliceStore:
+    """
+    Read-only access to a packed sub-folder.
+    The memory map is opened lazily in each process, so that forked or spawned DataLoader workers share the same
+    page cache instead of holding their own decoded copies.
+    With `check_files`, the mtime and size of a file are compared to the packed ones at each access, and a file
+    modified after packing is read from the disk instead of being served stale.
+    """
+
+    def __init__(self, pack_dir: str, sub_folder: str, check_files=True) -> None:
+        self._pack_dir = str(pack_dir)
+        self._sub_folder = sub_folder
+        index = np.load(_index_path(self._pack_dir, sub_folder))
+        self._offsets: np.ndarray = index["offsets"]
+        self._shapes: np.ndarray = index["shapes"]
+        self._mode: str = str(index["mode"])
+        self._dtype = np.dtype(str(index["dtype"]))
+        self._path2slot: Dict[str, int] = {str(p): i for i, p in enumerate(index["paths"])}
+        # packs written before the stats were recorded are never considered fresh
+        self._stats: Optional[np.ndarray] = index["stats"] if "stats" in index else None
+        self._palettes: Optional[np.ndarray] = index["palettes"] if "palettes" in index else None
+        self._check_files = check_files
+        self._array: Optional[np.memmap] = None
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def is_fresh(self, path: str) -> bool:
+        """whether `path` is packed and unmodified since"""
+        slot = self._path2slot.get(path)
+        if slot is None or self._stats is None:
+            return False
+        try:
+            return _file_stat(path) == tuple(self._stats[slot])
+        except OSError:
+            return False
+
+    def contains(self, path_list: List[str]) -> bool:
+        return all(self.is_fresh(p) for p in path_list)
+
+    @property
+    def array(self) -> np.memmap:
+        if self._array is None:
+            self._array = np.memmap(_data_path(self._pack_dir, self._sub_folder), dtype=self._dtype, mode="r")
+        return self._array
+
+    def _packed_array(self, path: str) -> np.ndarray:
+        slot = self._path2slot[path]
+        h, w, c = self._shapes[slot]
+        offset = self._offsets[slot]
+        view = self.array[offset:offset + h * w * c]
+        return view.reshape((h, w) if c == 1 else (h, w, c))
+
+    def _is_stale(self, path: str) -> bool:
+        if self._check_files and not self.is_fresh(path):
+            logger.opt(depth=2).trace(f"{path} was modified after packing, reading it from the disk")
+            return True
+        return False
+
+    def get_array(self, path: str) -> np.ndarray:
+        """return a zero-copy view (h, w) or (h, w, c) of the packed image"""
+        if self._is_stale(path):
+            with Image.open(path) as img:
+                return np.asarray(img)
+        return self._packed_array(path)
+
+    def get_image(self, path: str) -> Image.Image:
+        """PIL image backed by the memory map for `L` and `I;16` modes, `P` images get back their palette."""
+        if self._is_stale(path):
+            return Image.open(path)
+        img = Image.fromarray(self._packed_array(path))
+        if self._mode == "P" and self._palettes is not None:
+            img.putpalette(self._palettes[self._path2slot[path]].tolist())  # turns the `L` image into `P`
+        return img
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_array"] = None
+        return state
+
+    def __deepcopy__(self, memo):
+        # the store is read-only, sharing it is safe.
+        return self
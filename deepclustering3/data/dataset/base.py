@@ -1,10 +1,15 @@
+import hashlib
+import json
 import os
 import re
+import time
 from collections import OrderedDict
-from copy import deepcopy as dcopy
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from copy import copy, deepcopy as dcopy
 from pathlib import Path
-from typing import List, Tuple, Dict, Union, Any
+from typing import List, Tuple, Dict, Union, Any, Optional
 
+import numpy as np
 from PIL import Image, ImageFile
 from torch import Tensor
 from torch.utils.data import Dataset
@@ -13,19 +18,30 @@ from deepclustering3.augment import SequentialWrapper
 from deepclustering3.augment.pil_augment import ToTensor, ToLabel
 from deepclustering3.logger import logger
 from deepclustering3.mytqdm import tqdm
-from deepclustering3.types import typePath
-from deepclustering3.utils.io import path2Path
+from ._cache import LRUArrayCache
+from ._packed import PackedSliceStore, pack_memory_dictionary
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 __all__ = ["DatasetBase", "extract_sub_dataset_based_on_scan_names"]
 
 
+def _first_suffix(name: str) -> str:
+    # string-only equivalent of `Path(name).suffixes[0]`
+    if name.endswith("."):
+        return ""
+    parts = name.lstrip(".").split(".")
+    return "." + parts[1] if len(parts) > 1 else ""
+
+
+def _stem(name: str) -> str:
+    # string-only equivalent of `Path(name).stem`
+    i = name.rfind(".")
+    return name[:i] if 0 < i < len(name) - 1 else name
+
+
 def allow_extension(path: str, extensions: List[str]) -> bool:
-    try:
-        return Path(path).suffixes[0] in extensions
-    except:  # noqa
-        return False
+    return _first_suffix(os.path.basename(path)) in extensions
 
 
 def default_transform() -> SequentialWrapper:
@@ -35,9 +51,10 @@ def default_transform() -> SequentialWrapper:
     )
 
 
-def get_stem(path: typePath):
-    path_ = path2Path(path)
-    return path_.stem
+def decode_image(path: str) -> np.ndarray:
+    """decode an image into a numpy array. The palette of `P` mode images is dropped, only indices are kept."""
+    with Image.open(path) as img:
+        return np.asarray(img)
 
 
 def check_folder_types(type_: str):
@@ -50,21 +67,102 @@ def is_image_folder(type_: str):
     return False
 
 
-def make_memory_dictionary(root: str, mode: str, folders: List[str], extensions) -> Dict[str, List[str]]:
+def _index_sidecar_path(folder: str, cache_dir: str) -> str:
+    # one sidecar per absolute folder path, the dataset folders themselves are never written.
+    digest = hashlib.sha1(os.path.abspath(folder).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(folder)}-{digest}.index.json")
+
+
+def scan_folder(folder: str, extensions: List[str], cache_dir: str = None) -> Tuple[List[str], List[str]]:
+    """
+    list the sorted file names with allowed extensions of a folder, together with their stems.
+    If `cache_dir` is given, the result is persisted to a json sidecar in it, keyed by the folder mtime and its
+    number of entries, so that the unchanged folders are not filtered, sorted and split again.
+    :return: sorted file names and their stems
+    """
+    mtime_ns = os.stat(folder).st_mtime_ns
+    entries = os.listdir(folder)
+    sidecar = _index_sidecar_path(folder, cache_dir) if cache_dir is not None else None
+    if sidecar is not None and os.path.isfile(sidecar):
+        try:
+            with open(sidecar, "r") as f:
+                index = json.load(f)
+            if index["mtime_ns"] == mtime_ns and index["num_entries"] == len(entries) \
+                    and index["extensions"] == sorted(extensions):
+                return index["names"], index["stems"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    names = sorted([x for x in entries if allow_extension(x, extensions)])
+    stems = [_stem(x) for x in names]
+    if sidecar is not None:
+        _write_sidecar(sidecar, {"mtime_ns": mtime_ns, "num_entries": len(entries),
+                                 "extensions": sorted(extensions), "names": names, "stems": stems})
+    return names, stems
+
+
+def _write_sidecar(sidecar: str, index: Dict[str, Any]) -> None:
+    # written to a temporary file then renamed, so that concurrent readers never see a partial index.
+    try:
+        os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+    except OSError as e:
+        logger.trace(f"cannot create the file index folder of {sidecar}: {e}")
+        return
+    if not os.access(os.path.dirname(sidecar), os.W_OK):
+        logger.trace(f"skip writing file index {sidecar}, read-only folder")
+        return
+    tmp = f"{sidecar}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, sidecar)
+    except OSError as e:
+        logger.trace(f"cannot write file index {sidecar}: {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+def make_file_index(root: str, mode: str, folders: List[str], extensions, cache_dir: str = None) \
+    -> Tuple[Dict[str, List[str]], Dict[str, np.ndarray]]:
+    """
+    :param cache_dir: folder of the file index sidecars, see `scan_folder`. None lists the folders every time.
+    :return: the memory dictionary {sub_folder: sorted paths} and the stem arrays {sub_folder: stems}
+    """
     for subfolder in folders:
         assert (Path(root, mode, subfolder).exists() and Path(root, mode, subfolder).is_dir()), \
             os.path.join(root, mode, subfolder)
 
-    items = [os.listdir(Path(os.path.join(root, mode, sub))) for sub in folders]
-    cleaned_items = sorted([[x for x in item if allow_extension(x, extensions)] for item in items])
-
-    memory = OrderedDict()
-    for subfolder, item in zip(folders, cleaned_items):
-        memory[subfolder] = sorted([os.path.join(root, mode, subfolder, x_path) for x_path in item])
+    memory, stems = OrderedDict(), OrderedDict()
+    for subfolder in folders:
+        folder = os.path.join(root, mode, subfolder)
+        names, stem_list = scan_folder(folder, extensions, cache_dir=cache_dir)
+        memory[subfolder] = [os.path.join(folder, x) for x in names]
+        stems[subfolder] = np.asarray(stem_list, dtype=str)
 
     sub_memory_len_list = [len(x) for x in memory.values()]
     assert len(set(sub_memory_len_list)) == 1, sub_memory_len_list
-    return memory
+    return memory, stems
+
+
+def make_memory_dictionary(root: str, mode: str, folders: List[str], extensions) -> Dict[str, List[str]]:
+    return make_file_index(root, mode, folders, extensions)[0]
+
+
+def make_stem_array(memory: Dict[str, List[str]]) -> np.ndarray:
+    """
+    compute the stems of a memory dictionary once, checking that all sub-folders are aligned.
+    """
+    stems = [np.asarray([_stem(os.path.basename(x)) for x in path_list], dtype=str) for path_list in memory.values()]
+    check_stem_alignment(stems)
+    return stems[0]
+
+
+def check_stem_alignment(stems: List[np.ndarray]):
+    for stem_array in stems[1:]:
+        mismatch = np.flatnonzero(stem_array != stems[0])
+        assert len(mismatch) == 0, (stems[0][mismatch[:5]], stem_array[mismatch[:5]])
 
 
 class DatasetBase(Dataset):
@@ -72,13 +170,14 @@ class DatasetBase(Dataset):
 
     def __init__(self, *, root_dir: str, mode: str, sub_folders: Union[List[str], str],
                  sub_folder_types: Union[List[str], str], transforms: SequentialWrapper = None,
-                 group_re: str = None) -> None:
+                 group_re: str = None, index_cache_dir: str = None) -> None:
         """
         :param root_dir: dataset root
         :param mode: train or test mode
         :param sub_folders: the folder list inside train or test folder
         :param transforms: SequentialWrapper transformer
         :param group_re: regex to group scans
+        :param index_cache_dir: folder where the file lists of the sub-folders are cached, None to disable the cache
         """
         self._name: str = f"{self.__class__.__name__}-{mode}"
         self._mode: str = mode
@@ -94,10 +193,18 @@ class DatasetBase(Dataset):
         self._transforms = transforms if transforms else default_transform()
 
         logger.opt(depth=1).trace(f"Creating {self.__class__.__name__}")
-        self._memory = make_memory_dictionary(self._root_dir, self._mode, self._sub_folders, self.allow_extension)
-        # pre-load
+        self._memory, stems = make_file_index(self._root_dir, self._mode, self._sub_folders, self.allow_extension,
+                                              cache_dir=index_cache_dir)
+        check_stem_alignment(list(stems.values()))
+        self._stems: np.ndarray = stems[self._sub_folders[0]]
+        # positions of a subset view inside the memory dictionary, None for the whole dataset
+        self._indices: Optional[np.ndarray] = None
+        # pre-load and decoded-image cache
         self._is_preload = False
-        self._preload_storage: OrderedDict = OrderedDict()
+        self._cache: Optional[LRUArrayCache] = None
+        # packed memory-mapped storage
+        self._is_packed = False
+        self._packed_storage: Dict[str, PackedSliceStore] = OrderedDict()
 
         # regex for scan
         self._pattern = group_re
@@ -105,13 +212,43 @@ class DatasetBase(Dataset):
 
         if self._pattern:
             self._re_pattern = re.compile(self._pattern)
+        # built on first use, so that stems not matching `group_re` only fail the scan-based methods
+        self._scan_names: Optional[List[str]] = None
+        self._scan_ids: Optional[np.ndarray] = None
+
+    def _build_scan_index(self):
+        """run `group_re` once over all stems, keeping sorted scan names and an integer scan id per slice"""
+        if self._scan_ids is not None:
+            return
+        if self._re_pattern is None:
+            raise RuntimeError("Putting group_re first, instead of None")
+        names = [self._get_scan_name(x) for x in self._stems]
+        scan_names, scan_ids = np.unique(np.asarray(names, dtype=str), return_inverse=True)
+        self._scan_names = scan_names.tolist()
+        self._scan_ids = scan_ids.astype(np.int64)
+
+    def _global_indices(self) -> np.ndarray:
+        if self._indices is None:
+            return np.arange(len(self._stems))
+        return self._indices
+
+    def _global_index(self, index: int) -> int:
+        return int(self._indices[index]) if self._indices is not None else index
 
     def get_memory_dictionary(self) -> Dict[str, List[str]]:
-        return self._memory
+        if self._indices is None:
+            return self._memory
+        return OrderedDict((k, [v[i] for i in self._indices]) for k, v in self._memory.items())
 
     def set_memory_dictionary(self, new_dictionary: Dict[str, Any], deepcopy=True):
         assert isinstance(new_dictionary, dict)
         self._memory = dcopy(new_dictionary) if deepcopy else new_dictionary
+        self._stems = make_stem_array(self._memory)
+        self._indices = None
+        self._scan_names, self._scan_ids = None, None
+        if self._cache is not None:
+            # cache keys are positions in the previous memory dictionary, which may be shared with other views.
+            self.enable_cache(max_bytes=self._cache.max_bytes)
 
     @property
     def pattern(self):
@@ -122,11 +259,13 @@ class DatasetBase(Dataset):
         return self._mode
 
     def __len__(self) -> int:
+        if self._indices is not None:
+            return len(self._indices)
         return int(len(self._memory[self._sub_folders[0]]))
 
     def __getitem__(self, index) -> Tuple[List[Tensor], str]:
         image_list, filename_list = self._getitem_index(index)
-        filename = Path(filename_list[0]).stem
+        filename = str(self._stems[self._global_index(index)])
 
         images = [x for x, t in zip(image_list, self._sub_folder_types) if t]
         labels = [x for x, t in zip(image_list, self._sub_folder_types) if not t]
@@ -135,34 +274,127 @@ class DatasetBase(Dataset):
         return [*images, *labels], filename
 
     def _getitem_index(self, index):
-        image_list = self._preload_storage[index] if self._is_preload else \
-            [Image.open(self._memory[subfolder][index]) for subfolder in self._sub_folders]
-
+        index = self._global_index(index)
+        if self._is_packed:
+            image_list = [self._packed_storage[subfolder].get_image(self._memory[subfolder][index])
+                          for subfolder in self._sub_folders]
+        elif self._cache is not None:
+            image_list = [Image.fromarray(self._get_cached_array(subfolder, index)) for subfolder in self._sub_folders]
+        else:
+            image_list = [Image.open(self._memory[subfolder][index]) for subfolder in self._sub_folders]
+
+        # stems of the sub-folders have been checked to be aligned when the memory dictionary was set.
         filename_list = [self._memory[subfolder][index] for subfolder in self._sub_folders]
+        return image_list, filename_list
 
-        stem_set = set([get_stem(x) for x in filename_list])
-        assert len(stem_set) == 1, stem_set
+    def _get_cached_array(self, subfolder: str, index: int) -> np.ndarray:
+        key = (subfolder, index)
+        array = self._cache.get(key)
+        if array is None:
+            array = decode_image(self._memory[subfolder][index])
+            self._cache.put(key, array)
+        return array
 
-        return image_list, filename_list
+    def enable_cache(self, max_bytes: int = None, shared_counters=False):
+        """
+        keep decoded images in a byte-bounded LRU cache, one per DataLoader worker: call `warm_cache` before creating
+        the DataLoader so that its workers inherit the warmed entries instead of decoding their own copies.
+        :param max_bytes: budget of the cache of each worker, None means unbounded
+        :param shared_counters: share the cache counters among forked DataLoader workers
+        """
+        self._cache = LRUArrayCache(max_bytes=max_bytes, shared_counters=shared_counters)
+
+    def disable_cache(self):
+        self._cache = None
 
-    def _preload(self):
-        logger.opt(depth=1).trace(f"preloading {len(self)} {self.__class__.__name__} data ...")
-        for index in tqdm(range(len(self)), total=len(self)):
-            self._preload_storage[index] = \
-                [Image.open(self._memory[subfolder][index]) for subfolder in self._sub_folders]
+    @property
+    def cache(self) -> Optional[LRUArrayCache]:
+        return self._cache
 
-    def preload(self):
+    def warm_cache(self, num_workers: int = 0, backend: str = "thread") -> Dict[str, float]:
+        """
+        fully decode images into the cache until its budget is reached.
+        Call it before creating the DataLoader: forked workers share the warmed entries copy-on-write, while the
+        entries they cache themselves are private copies.
+        :param num_workers: size of the decoding pool, 0 decodes in the current thread
+        :param backend: `thread` or `process` pool
+        :return: throughput report
+        """
+        if self._cache is None:
+            raise RuntimeError(f"Call `enable_cache` before warming the cache of {self.__class__.__name__}")
+        assert backend in ("thread", "process"), backend
+        keys = [(subfolder, index) for index in self._global_indices().tolist() for subfolder in self._sub_folders]
+        keys = [k for k in keys if k not in self._cache]
+        logger.opt(depth=1).trace(f"decoding {len(keys)} {self.__class__.__name__} images into cache ...")
+
+        num_images, num_bytes, start = 0, 0, time.perf_counter()
+        executor = None
+        if num_workers > 0:
+            executor = (ThreadPoolExecutor if backend == "thread" else ProcessPoolExecutor)(max_workers=num_workers)
+        chunk_size = max(num_workers, 1) * 16
+        indicator = tqdm(total=len(keys))
+        budget_reached = False
+        try:
+            for i in range(0, len(keys), chunk_size):
+                chunk = keys[i:i + chunk_size]
+                paths = [self._memory[subfolder][index] for subfolder, index in chunk]
+                arrays = executor.map(decode_image, paths) if executor else map(decode_image, paths)
+                for key, array in zip(chunk, arrays):
+                    if self._cache.is_full(array.nbytes):
+                        budget_reached = True
+                        break
+                    self._cache.put(key, array)
+                    num_images += 1
+                    num_bytes += array.nbytes
+                indicator.update(len(chunk))
+                if budget_reached:
+                    break
+        finally:
+            indicator.close()
+            if executor:
+                executor.shutdown()
+        elapsed = max(time.perf_counter() - start, 1e-12)
+        report = {"images": num_images, "seconds": elapsed, "images/s": num_images / elapsed,
+                  "MB/s": num_bytes / elapsed / 1e6}
+        logger.opt(depth=1).info(f"{self.__class__.__name__} decoded {num_images} images in {elapsed:.2f}s, "
+                                 f"{report['images/s']:.1f} images/s, {report['MB/s']:.1f} MB/s")
+        return report
+
+    def preload(self, num_workers: int = 0, backend: str = "thread") -> Dict[str, float]:
+        """
+        fully decode the whole dataset into an unbounded cache, to be called before creating the DataLoader.
+        :param num_workers: size of the decoding pool, 0 decodes in the current thread
+        :param backend: `thread` or `process` pool
+        """
         self._is_preload = True
-        self._preload()
+        if self._cache is None or self._cache.max_bytes is not None:
+            self.enable_cache(max_bytes=None)
+        return self.warm_cache(num_workers=num_workers, backend=backend)
 
     def deload(self):
         self._is_preload = False
-        del self._preload_storage
-        self._preload_storage = OrderedDict()
+        self.disable_cache()
 
     def is_preloaded(self) -> bool:
         return self._is_preload
 
+    def pack(self, pack_dir: str = None, overwrite=False):
+        """
+        decode all images once into one memory-mapped file per sub-folder, then serve samples as views of it.
+        :param pack_dir: folder to save the packed files, default to `root_dir/mode/.packed`
+        :param overwrite: re-pack even if a valid pack exists
+        """
+        pack_dir = pack_dir or os.path.join(self._root_dir, self._mode, ".packed")
+        self._packed_storage = OrderedDict(pack_memory_dictionary(self._memory, pack_dir, overwrite=overwrite))
+        self._is_packed = True
+
+    def unpack(self):
+        self._is_packed = False
+        self._packed_storage = OrderedDict()
+
+    def is_packed(self) -> bool:
+        return self._is_packed
+
     def _get_scan_name(self, stem: str) -> str:
         if self._re_pattern is None:
             raise RuntimeError("Putting group_re first, instead of None")
@@ -173,10 +405,34 @@ class DatasetBase(Dataset):
         return group_name
 
     def get_stem_list(self):
-        return [get_stem(x) for x in self._memory[self._sub_folders[0]]]
+        if self._indices is None:
+            return self._stems.tolist()
+        return self._stems[self._indices].tolist()
+
+    def get_scan_ids(self) -> np.ndarray:
+        """integer scan id of each slice, indexing `get_scan_names()`"""
+        self._build_scan_index()
+        if self._indices is None:
+            return self._scan_ids
+        return self._scan_ids[self._indices]
+
+    def get_scan_names(self) -> List[str]:
+        """sorted scan names of the whole memory dictionary, shared by all subset views"""
+        self._build_scan_index()
+        return self._scan_names
 
     def get_scan_list(self):
-        return sorted(set([self._get_scan_name(filename) for filename in self.get_stem_list()]))
+        return [self.get_scan_names()[i] for i in np.unique(self.get_scan_ids())]
+
+    def get_subset(self, indices: Union[List[int], np.ndarray]) -> "DatasetBase":
+        """
+        return a view of `indices` sharing the memory dictionary, the cache and the packed storage of this dataset.
+        The view has its own copy of the transforms.
+        """
+        new_dataset = copy(self)
+        new_dataset._transforms = copy(self._transforms)
+        new_dataset._indices = self._global_indices()[np.asarray(indices, dtype=np.int64)]
+        return new_dataset
 
     @property
     def transforms(self) -> SequentialWrapper:
@@ -190,20 +446,12 @@ class DatasetBase(Dataset):
 
 def extract_sub_dataset_based_on_scan_names(dataset: DatasetBase, group_names: List[str],
                                             transforms: SequentialWrapper = None) -> DatasetBase:
-    loaded: bool = dataset.is_preloaded()
-    available_group_names = sorted(set(dataset.get_scan_list()))
+    available_group_names = dataset.get_scan_list()
     for g in group_names:
         assert g in available_group_names
-    memory = dataset.get_memory_dictionary()
-    get_scan_name = dataset._get_scan_name  # noqa
-    new_memory = type(memory)()
-    for sub_folder, path_list in memory.items():
-        new_memory[sub_folder] = [x for x in path_list if get_scan_name(x) in group_names]
-
-    new_dataset = dcopy(dataset)
-    new_dataset.set_memory_dictionary(new_dictionary=new_memory)
+    name2id = {x: i for i, x in enumerate(dataset.get_scan_names())}
+    group_ids = np.asarray([name2id[g] for g in group_names], dtype=np.int64)
+    new_dataset = dataset.get_subset(np.flatnonzero(np.isin(dataset.get_scan_ids(), group_ids)))
     if transforms:
         new_dataset.transforms = transforms
-    if loaded:
-        new_dataset.preload()
     return new_dataset
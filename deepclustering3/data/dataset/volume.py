@@ -0,0 +1,47 @@
+from typing import List, Tuple
+
+import torch
+from torch import Tensor
+from torch.utils.data import Dataset
+
+from .base import DatasetBase
+from ..sampler import group_indices_by_scan
+
+__all__ = ["VolumeDataset"]
+
+
+class VolumeDataset(Dataset):
+    """
+    Scan-level view of a DatasetBase, grouping the slices with its `group_re`.
+    Each item is the list of stacked (D, H, W) volumes, (D, C, H, W) for multi-channel images,
+    one per sub-folder, and the scan name.
+    The transforms of the slice dataset are applied per slice, so they should be deterministic.
+    """
+
+    def __init__(self, dataset: DatasetBase) -> None:
+        self._dataset = dataset
+        scan_ids = dataset.get_scan_ids()
+        self._slice_groups = group_indices_by_scan(scan_ids)
+        scan_names = dataset.get_scan_names()
+        self._scan_names = [scan_names[scan_ids[g[0]]] for g in self._slice_groups]
+
+    @property
+    def dataset(self) -> DatasetBase:
+        return self._dataset
+
+    def get_scan_list(self) -> List[str]:
+        return list(self._scan_names)
+
+    def __len__(self) -> int:
+        return len(self._slice_groups)
+
+    def __getitem__(self, index) -> Tuple[List[Tensor], str]:
+        slices = [self._dataset[i] for i in self._slice_groups[index].tolist()]
+        volumes = []
+        for k in range(len(slices[0][0])):
+            volume = torch.stack([s[0][k] for s in slices], dim=0)
+            volumes.append(volume.squeeze(1) if volume.dim() == 4 and volume.shape[1] == 1 else volume)
+        return volumes, self._scan_names[index]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({len(self)} scans of {self._dataset.__class__.__name__})"
@@ -1,5 +1,58 @@
 import queue as Queue
 import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Dict, Union, Any, Optional, Tuple
+
+import torch
+from torch import Tensor
+import torch.distributed as dist
+from torch.utils.data import DataLoader, BatchSampler as _BatchSampler, SequentialSampler as _SequentialSampler
+from torch.utils.data.dataloader import _BaseDataLoaderIter  # noqa
+
+from .sampler import DistributedEvalSampler, SequentialSampler
+
+
+class _EndToken:
+    """end-of-stream token, so that a `None` item does not stop the iteration"""
+    pass
+
+
+class _ExceptionWrapper:
+    def __init__(self, exception: BaseException) -> None:
+        self.exception = exception
+
+
+class PrefetchStats:
+    """
+    statistics of a prefetcher, seen from the consumer side.
+    `starved` counts the items the consumer had to wait for, which means that the data pipeline is the bottleneck.
+    """
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self):
+        self.num_items = 0
+        self.starved = 0
+        self.wait_time = 0.0
+        self._depth_sum = 0
+
+    def update(self, depth: int, wait_time: float):
+        self.num_items += 1
+        self.starved += int(depth == 0)
+        self.wait_time += wait_time
+        self._depth_sum += depth
+
+    def summary(self) -> Dict[str, float]:
+        n = max(self.num_items, 1)
+        return {"items": self.num_items, "starved": self.starved, "starved_ratio": self.starved / n,
+                "wait_time": self.wait_time, "mean_depth": self._depth_sum / n}
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.summary()})"
 
 
 class BackgroundGenerator(threading.Thread):
@@ -23,22 +76,38 @@ class BackgroundGenerator(threading.Thread):
 
         Setting max_prefetch to -1 lets it store as many batches as it can, which will work slightly (if any) faster, but will require storing
         all batches in memory. If you use infinite generator with max_prefetch=-1, it will exceed the RAM size unless dequeued quickly enough.
+
+        Exceptions raised by the generator are re-raised in the consumer thread. For CPU-bound work such as PIL
+        decoding and augmentation, use `ProcessPrefetcher` instead, which is not limited by the GIL.
         """
         threading.Thread.__init__(self)
         self.queue = Queue.Queue(max_prefetch)
         self.generator = generator
         self.daemon = True
+        self.stats = PrefetchStats()
+        self._exhausted = False
         self.start()
 
     def run(self):
-        for item in self.generator:
-            self.queue.put(item)
-        self.queue.put(None)
+        try:
+            for item in self.generator:
+                self.queue.put(item)
+        except Exception as e:  # noqa
+            self.queue.put(_ExceptionWrapper(e))
+        finally:
+            self.queue.put(_EndToken())
 
     def next(self):
+        if self._exhausted:
+            raise StopIteration
+        depth = self.queue.qsize()
+        start = time.perf_counter()
         next_item = self.queue.get()
-        # print(self.queue.qsize())
-        if next_item is None:
+        self.stats.update(depth, time.perf_counter() - start)
+        if isinstance(next_item, _ExceptionWrapper):
+            raise next_item.exception
+        if isinstance(next_item, _EndToken):
+            self._exhausted = True
             raise StopIteration
         return next_item
 
@@ -53,6 +122,248 @@ class BackgroundGenerator(threading.Thread):
         return len(self.generator)
 
 
+def _shutdown_pool(executor: ProcessPoolExecutor, futures: deque):
+    for f in futures:
+        f.cancel()
+    futures.clear()
+    executor.shutdown(wait=False)
+
+
+class ProcessPrefetcher:
+    """
+    Apply `function` to the items of `iterable` in a process pool, keeping up to `max_prefetch` results in flight.
+    Results are returned in the order of `iterable`, and exceptions raised by `function` are re-raised by `next()`.
+    The pool is shut down when the iteration ends, by `close`, or when the prefetcher is garbage collected.
+
+    >>> prefetcher = ProcessPrefetcher(dataset.__getitem__, sampler, num_workers=4, max_prefetch=8) # noqa
+    >>> for sample in prefetcher: # noqa
+    >>>     ...
+    >>> print(prefetcher.stats) # noqa
+    """
+
+    def __init__(self, function: Callable, iterable: Iterable, num_workers: int = 2, max_prefetch: int = 4,
+                 mp_context=None) -> None:
+        """
+        :param function: picklable callable applied to each item
+        :param iterable: source of the items, iterated in the current process
+        :param num_workers: number of worker processes
+        :param max_prefetch: number of items being processed or ready at any moment of time
+        :param mp_context: multiprocessing context of the pool
+        """
+        if max_prefetch <= 0:
+            raise ValueError(f"max_prefetch should be a positive integer, given {max_prefetch}.")
+        self._function = function
+        self._iterable = iterable
+        self._source = iter(iterable)
+        self._max_prefetch = max_prefetch
+        self._executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context)
+        self._futures = deque()
+        self._source_exhausted = False
+        self.stats = PrefetchStats()
+        # the finalizer must not hold the prefetcher, it only shuts the pool down once.
+        self._finalizer = weakref.finalize(self, _shutdown_pool, self._executor, self._futures)
+        self._fill()
+
+    def _fill(self):
+        while not self._source_exhausted and len(self._futures) < self._max_prefetch:
+            try:
+                item = next(self._source)
+            except StopIteration:
+                self._source_exhausted = True
+                break
+            self._futures.append(self._executor.submit(self._function, item))
+
+    def __next__(self):
+        if not self._futures:
+            self.close()
+            raise StopIteration
+        depth = sum(f.done() for f in self._futures)
+        start = time.perf_counter()
+        future = self._futures.popleft()
+        try:
+            result = future.result()
+        except BaseException:
+            self.close()
+            raise
+        self.stats.update(depth, time.perf_counter() - start)
+        self._fill()
+        return result
+
+    def __iter__(self):
+        return self
+
+    def __len__(self):
+        return len(self._iterable)  # noqa
+
+    def close(self):
+        self._source_exhausted = True
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+
+def _stateful_sampler(loader) -> Tuple[Optional[Any], int]:
+    """return the sampler of a DataLoader or of its iterator having a `state_dict`, with the batch size"""
+    index_sampler = getattr(loader, "_index_sampler", None)
+    for sampler in (index_sampler, getattr(index_sampler, "sampler", None)):
+        if callable(getattr(sampler, "state_dict", None)) and callable(getattr(sampler, "load_state_dict", None)):
+            return sampler, getattr(index_sampler, "batch_size", None) or 1
+    return None, 1
+
+
+def is_stateful_loader(loader) -> bool:
+    return isinstance(loader, (DataLoader, _BaseDataLoaderIter)) and _stateful_sampler(loader)[0] is not None
+
+
+def loader_state_dict(loader: Union[DataLoader, _BaseDataLoaderIter], num_pending_batches=0) -> Dict[str, Any]:
+    """
+    state of the sampler behind a DataLoader or a DataLoader iterator, e.g. `InfiniteRandomSampler`.
+    For a live iterator, the indices served to the workers but not yet yielded, plus the `num_pending_batches`
+    yielded batches not consumed by the caller, are given back so that they are served again after resuming.
+    """
+    sampler, batch_size = _stateful_sampler(loader)
+    if sampler is None:
+        raise ValueError(f"{loader.__class__.__name__} does not have a sampler with state.")
+    num_unconsumed = 0
+    if isinstance(loader, _BaseDataLoaderIter):
+        num_consumed = (loader._num_yielded - num_pending_batches) * batch_size  # noqa
+        num_unconsumed = max(getattr(sampler, "num_served", num_consumed) - num_consumed, 0)
+    return sampler.state_dict(num_unconsumed=num_unconsumed)
+
+
+def load_loader_state_dict(loader: Union[DataLoader, _BaseDataLoaderIter], state_dict: Dict[str, Any]):
+    """
+    restore the sampler behind a DataLoader or a DataLoader iterator. For a live iterator, the batches which were
+    already prefetched by the workers are served before the restored ones.
+    """
+    sampler, _ = _stateful_sampler(loader)
+    if sampler is None:
+        raise ValueError(f"{loader.__class__.__name__} does not have a sampler with state.")
+    sampler.load_state_dict(state_dict)
+
+
+def shard_eval_loader(loader: Any) -> Optional[Any]:
+    """
+    the evaluation loader of this rank. Out of a distributed run, the loader itself. In a distributed run, a
+    sequential DataLoader is rebuilt with a `DistributedEvalSampler`, each sample being evaluated once over all
+    ranks, and a loader already sharded by a `DistributedEvalSampler` is kept. None if the loader cannot be sharded,
+    e.g. with a custom batch sampler, in which case it should be evaluated on the master only.
+    """
+    if not dist.is_available() or not dist.is_initialized() or dist.get_world_size() == 1:
+        return loader
+    if not isinstance(loader, DataLoader):
+        return None
+    if isinstance(loader.sampler, DistributedEvalSampler):
+        return loader
+    if not (type(loader.batch_sampler) is _BatchSampler and
+            isinstance(loader.sampler, (_SequentialSampler, SequentialSampler))):
+        return None
+    return DataLoader(
+        loader.dataset, batch_size=loader.batch_size, sampler=DistributedEvalSampler(loader.dataset),
+        num_workers=loader.num_workers, collate_fn=loader.collate_fn, pin_memory=loader.pin_memory,
+        drop_last=loader.drop_last, timeout=loader.timeout, worker_init_fn=loader.worker_init_fn,
+        multiprocessing_context=loader.multiprocessing_context, prefetch_factor=loader.prefetch_factor,
+        persistent_workers=loader.persistent_workers,
+    )
+
+
+def _apply_to_tensors(data: Any, function: Callable[[Tensor], Tensor]) -> Any:
+    if isinstance(data, Tensor):
+        return function(data)
+    if isinstance(data, tuple) and hasattr(data, "_fields"):  # namedtuple
+        return type(data)(*(_apply_to_tensors(x, function) for x in data))
+    if isinstance(data, (list, tuple)):
+        return type(data)(_apply_to_tensors(x, function) for x in data)
+    if isinstance(data, dict):
+        return type(data)((k, _apply_to_tensors(v, function)) for k, v in data.items())
+    return data
+
+
+class DevicePrefetcher:
+    """
+    Move the batches of any data iterable to `device`, one batch ahead.
+    On cuda, host batches are pinned and copied with non-blocking transfers on a side stream, so that the copy of
+    the next batch overlaps the computation on the current one. On cpu, batches are returned untouched.
+
+    The iterator of `iterable` is only created by the first `next`: a DataLoader can be wrapped before resuming a
+    checkpoint, its restored sampler state then applies to the very first batch, none being prefetched yet.
+    `next` continues the current pass, e.g. over an infinite loader, while each `iter` starts a new pass so that
+    the prefetcher can be looped over once per epoch. Batches of a loader with `pin_memory` are not pinned again.
+
+    >>> train_iter = DevicePrefetcher(train_loader, device="cuda") # noqa
+    >>> image, target = next(train_iter)  # already on cuda # noqa
+    """
+
+    def __init__(self, iterable: Iterable, device: Union[str, torch.device], pin_memory=True) -> None:
+        self._iterable = iterable
+        self._iterator: Optional[Iterable] = None
+        self._device = torch.device(device)
+        # the workers of a DataLoader with `pin_memory` already return pinned batches
+        self._pin_memory = pin_memory and not getattr(iterable, "pin_memory", getattr(iterable, "_pin_memory", False))
+        self._use_cuda = self._device.type == "cuda" and torch.cuda.is_available()
+        self._stream = torch.cuda.Stream(device=self._device) if self._use_cuda else None
+        self._next_batch = None
+
+    def _start(self):
+        self._iterator = iter(self._iterable)
+        self._next_batch = None
+        if self._use_cuda:
+            self._preload()
+
+    @property
+    def device(self) -> torch.device:
+        return self._device
+
+    def _preload(self):
+        try:
+            batch = next(self._iterator)
+        except StopIteration:
+            self._next_batch = _EndToken()
+            return
+        if self._pin_memory:
+            batch = _apply_to_tensors(batch, lambda t: t if t.is_cuda or t.is_pinned() else t.pin_memory())
+        with torch.cuda.stream(self._stream):
+            self._next_batch = _apply_to_tensors(batch, lambda t: t.to(self._device, non_blocking=True))
+
+    def __next__(self):
+        if self._iterator is None:
+            self._start()
+        if not self._use_cuda:
+            return next(self._iterator)
+        torch.cuda.current_stream(self._device).wait_stream(self._stream)
+        batch = self._next_batch
+        if isinstance(batch, _EndToken):
+            raise StopIteration
+        # the tensors were allocated on the side stream, mark them as used by the current stream.
+        _apply_to_tensors(batch, lambda t: t.record_stream(torch.cuda.current_stream(self._device)))
+        self._preload()
+        return batch
+
+    def __iter__(self):
+        self._start()
+        return self
+
+    def __len__(self):
+        return len(self._iterable)  # noqa
+
+    def state_dict(self) -> Dict[str, Any]:
+        """sampler state of the wrapped DataLoader or its iterator, counting the batch held on the device as pending"""
+        loader = self._iterable if self._iterator is None else self._iterator
+        if not is_stateful_loader(loader):
+            return {}
+        num_pending = int(self._use_cuda and self._next_batch is not None and
+                          not isinstance(self._next_batch, _EndToken))
+        return loader_state_dict(loader, num_pending_batches=num_pending)
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        if state_dict:
+            load_loader_state_dict(self._iterable if self._iterator is None else self._iterator, state_dict)
+
+
 # decorator
 class background:
     def __init__(self, max_prefetch=1):
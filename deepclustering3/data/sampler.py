@@ -1,6 +1,10 @@
 from collections import Iterator
+from typing import List, Dict, Any, Optional
 
+import numpy as np
 import torch
+import torch.distributed as dist
+from torch import Tensor
 from torch._six import int_classes as _int_classes
 from torch.utils.data import Sampler
 
@@ -196,39 +200,421 @@ class BatchSampler(Sampler):
             return (len(self.sampler) + self.batch_size - 1) // self.batch_size
 
 
+def group_indices_by_scan(scan_ids) -> List[np.ndarray]:
+    """
+    group slice positions by scan id in one vectorized pass.
+    :param scan_ids: integer scan id of each slice
+    :return: sorted positions of each scan, scans ordered by id
+    """
+    scan_ids = np.asarray(scan_ids)
+    order = np.argsort(scan_ids, kind="stable")
+    _, starts = np.unique(scan_ids[order], return_index=True)
+    return np.split(order, starts[1:]) if len(order) > 0 else []
+
+
+class ScanBatchSampler(Sampler):
+    r"""Yields all slices of one scan contiguously as one batch, so that metrics can be computed per volume.
+
+    Args:
+        data_source (Dataset): dataset providing ``get_scan_ids()``, or an array of scan ids
+        shuffle (bool): shuffle the order of the scans, slices of one scan are always kept in order
+        max_batch_size (int, optional): split the slices of long scans into consecutive chunks of this size
+
+    Example:
+        >>> list(ScanBatchSampler([0, 0, 1, 1, 1, 2], max_batch_size=2))
+        [[0, 1], [2, 3], [4], [5]]
+    """
+
+    def __init__(self, data_source, shuffle=False, max_batch_size=None):  # noqa
+        scan_ids = data_source.get_scan_ids() if hasattr(data_source, "get_scan_ids") else data_source
+        if max_batch_size is not None and (not isinstance(max_batch_size, _int_classes) or max_batch_size <= 0):
+            raise ValueError(
+                "max_batch_size should be a positive integer value, "
+                "but got max_batch_size={}".format(max_batch_size)
+            )
+        self.shuffle = shuffle
+        self.max_batch_size = max_batch_size
+        self._groups = group_indices_by_scan(scan_ids)
+        if max_batch_size is not None:
+            self._groups = [list(np.split(g, range(max_batch_size, len(g), max_batch_size))) for g in self._groups]
+        else:
+            self._groups = [[g] for g in self._groups]
+
+    def __iter__(self):
+        order = torch.randperm(len(self._groups)).tolist() if self.shuffle else range(len(self._groups))
+        for i in order:
+            for chunk in self._groups[i]:
+                yield chunk.tolist()
+
+    def __len__(self):
+        return sum(len(g) for g in self._groups)
+
+
+def _draw_seed(generator: torch.Generator = None) -> int:
+    return int(torch.randint(2 ** 62, (), dtype=torch.int64, generator=generator).item())
+
+
 class _InfiniteRandomIterator(Iterator):
-    def __init__(self, data_source, shuffle=True):
+    """
+    Iterates over successive permutations of the data source, the permutation of epoch `e` being drawn from
+    `seed + e`. The permutation is kept as a tensor, served one index at a time or in whole chunks with
+    `next_batch`. The position in the stream is captured by `state_dict` as (seed, epoch, position), so that any
+    number of indices can be rewound by arithmetic on the epoch and the position.
+    """
+
+    def __init__(self, data_source, shuffle=True, seed: int = 0):
         self.data_source = data_source
         self.shuffle = shuffle
-        if self.shuffle:
-            self.iterator = iter(torch.randperm(len(self.data_source)).tolist())
-        else:
-            self.iterator = iter(
-                torch.arange(start=0, end=len(self.data_source)).tolist()
-            )
+        self.seed = seed
+        self.generator = torch.Generator()
+        self._epoch = -1
+        self._num_served = 0
+        self._new_epoch()
 
-    def __next__(self):
-        try:
-            idx = next(self.iterator)
-        except StopIteration:
-            if self.shuffle:
-                self.iterator = iter(torch.randperm(len(self.data_source)).tolist())
-            else:
-                self.iterator = iter(
-                    torch.arange(start=0, end=len(self.data_source)).tolist()
-                )
-            idx = next(self.iterator)
+    def _draw(self, n: int) -> Tensor:
+        if self.shuffle:
+            return torch.randperm(n, generator=self.generator)
+        return torch.arange(start=0, end=n)
+
+    def _new_epoch(self):
+        self._epoch += 1
+        self.generator.manual_seed(self.seed + self._epoch)
+        self._indices = self._draw(len(self.data_source))
+        self._index_list = None
+        self._position = 0
+
+    def __next__(self) -> int:
+        if self._position >= len(self._indices):
+            self._new_epoch()
+        if self._index_list is None:
+            self._index_list = self._indices.tolist()
+        idx = self._index_list[self._position]
+        self._position += 1
+        self._num_served += 1
         return idx
 
+    def next_batch(self, batch_size: int) -> Tensor:
+        """return the next `batch_size` indices as one tensor, crossing permutations if needed"""
+        chunks = []
+        remaining = batch_size
+        while remaining > 0:
+            if self._position >= len(self._indices):
+                self._new_epoch()
+            chunk = self._indices[self._position:self._position + remaining]
+            chunks.append(chunk)
+            self._position += len(chunk)
+            remaining -= len(chunk)
+        self._num_served += batch_size
+        return chunks[0] if len(chunks) == 1 else torch.cat(chunks)
+
+    @property
+    def num_served(self) -> int:
+        return self._num_served
+
+    def state_dict(self, num_unconsumed: int = 0) -> Dict[str, Any]:
+        """
+        :param num_unconsumed: number of served indices which have not been consumed yet, e.g. prefetched by a
+                               DataLoader. The state is rewound by this number, across as many epochs as needed.
+        """
+        # all the permutations have the same length, the stream is then addressed by its offset.
+        epoch_length = len(self._indices)
+        offset = self._epoch * epoch_length + self._position - num_unconsumed
+        if offset < 0:
+            raise ValueError(f"cannot rewind {num_unconsumed} indices, at epoch {self._epoch} and position "
+                             f"{self._position}.")
+        epoch, position = divmod(offset, epoch_length)
+        return {"seed": self.seed, "epoch": epoch, "position": position}
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        self.seed = state_dict["seed"]
+        self._epoch = state_dict["epoch"] - 1
+        self._new_epoch()
+        self._position = state_dict["position"]
+
 
 class InfiniteRandomSampler(Sampler):
-    def __init__(self, data_source, shuffle=True):
+    """
+    Samples elements randomly and infinitely, one permutation after the other.
+    Each iterator draws its permutations from a seed of its own, taken from the sampler's generator, and its
+    position can be saved and restored with `state_dict`/`load_state_dict`, so that a resumed run sees the same
+    data order.
+    """
+
+    def __init__(self, data_source, shuffle=True, seed: int = None):
         super().__init__(data_source)
         self.data_source = data_source
         self.shuffle = shuffle
+        self.generator = torch.Generator()
+        self.generator.manual_seed(_draw_seed() if seed is None else seed)
+        self._next_seed: Optional[int] = None
+        self._iterator: Optional[_InfiniteRandomIterator] = None
+        self._pending_state: Optional[Dict[str, Any]] = None
+
+    def _peek_seed(self) -> int:
+        # seed of the next iterator, drawn once so that `state_dict` before `__iter__` describes that iterator.
+        if self._next_seed is None:
+            self._next_seed = _draw_seed(self.generator)
+        return self._next_seed
+
+    def _make_iterator(self) -> _InfiniteRandomIterator:
+        seed, self._next_seed = self._peek_seed(), None
+        return _InfiniteRandomIterator(self.data_source, shuffle=self.shuffle, seed=seed)
 
     def __iter__(self):
-        return _InfiniteRandomIterator(self.data_source, shuffle=self.shuffle)
+        self._iterator = self._make_iterator()
+        if self._pending_state is not None:
+            self._iterator.load_state_dict(self._pending_state)
+            self._pending_state = None
+        return self._iterator
 
     def __len__(self):
         return len(self.data_source)
+
+    @property
+    def num_served(self) -> int:
+        return self._iterator.num_served if self._iterator is not None else 0
+
+    def state_dict(self, num_unconsumed: int = 0) -> Dict[str, Any]:
+        if self._pending_state is not None:
+            return self._pending_state
+        if self._iterator is None:
+            return {"seed": self._peek_seed(), "epoch": 0, "position": 0}
+        return self._iterator.state_dict(num_unconsumed=num_unconsumed)
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        """
+        restore the random stream. If an iterator is alive, e.g. inside a DataLoader iterator, it is restored in
+        place; batches that the DataLoader has already prefetched are still served first, so restore the state
+        before creating the DataLoader iterator. Otherwise, the state is applied to the next iterator.
+        """
+        if self._iterator is None:
+            self._pending_state = state_dict
+            return
+        self._iterator.load_state_dict(state_dict)
+
+
+class InfiniteBatchSampler(Sampler):
+    r"""Yields whole batches of indices from an :class:`InfiniteRandomSampler`, slicing its permutation
+    instead of collecting indices one by one.
+
+    Args:
+        sampler (InfiniteRandomSampler): Base sampler.
+        batch_size (int): Size of mini-batch.
+    """
+
+    def __init__(self, sampler: InfiniteRandomSampler, batch_size: int):
+        if not isinstance(sampler, InfiniteRandomSampler):
+            raise ValueError(
+                "sampler should be an instance of "
+                "InfiniteRandomSampler, but got sampler={}".format(sampler)
+            )
+        if (
+            not isinstance(batch_size, _int_classes)
+            or isinstance(batch_size, bool)
+            or batch_size <= 0
+        ):
+            raise ValueError(
+                "batch_size should be a positive integer value, "
+                "but got batch_size={}".format(batch_size)
+            )
+        self.sampler = sampler
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        iterator = iter(self.sampler)
+        while True:
+            yield iterator.next_batch(self.batch_size).tolist()
+
+    def __len__(self):
+        return (len(self.sampler) + self.batch_size - 1) // self.batch_size
+
+    def state_dict(self, num_unconsumed: int = 0) -> Dict[str, Any]:
+        return self.sampler.state_dict(num_unconsumed=num_unconsumed)
+
+    def load_state_dict(self, state_dict: Dict[str, Any]):
+        return self.sampler.load_state_dict(state_dict)
+
+
+def get_rank_and_world_size(rank: int = None, num_replicas: int = None):
+    """rank and world size given explicitly, or from the initialized process group, else (0, 1)"""
+    initialized = dist.is_available() and dist.is_initialized()
+    if num_replicas is None:
+        num_replicas = dist.get_world_size() if initialized else 1
+    if rank is None:
+        rank = dist.get_rank() if initialized else 0
+    if num_replicas <= 0 or not 0 <= rank < num_replicas:
+        raise ValueError(f"invalid rank {rank} for a world size of {num_replicas}.")
+    return rank, num_replicas
+
+
+def shard_indices(indices: Tensor, rank: int, num_replicas: int, drop_last=False) -> Tensor:
+    """
+    the part of `indices` read by `rank`. The indices are padded by wrapping around (or truncated with `drop_last`)
+    to a multiple of `num_replicas`, so that all ranks get the same number of indices.
+    """
+    n = len(indices)
+    if n == 0:
+        return indices
+    if drop_last:
+        indices = indices[:n - n % num_replicas]
+    elif n % num_replicas:
+        padding = num_replicas - n % num_replicas
+        indices = torch.cat([indices, indices.repeat((padding + n - 1) // n)[:padding]])
+    return indices[rank::num_replicas]
+
+
+class _DistributedInfiniteRandomIterator(_InfiniteRandomIterator):
+    """each permutation is drawn from `seed + epoch`, identically on all ranks, and sharded by rank."""
+
+    def __init__(self, data_source, shuffle=True, seed=0, rank=0, num_replicas=1, drop_last=False):
+        self.rank = rank
+        self.num_replicas = num_replicas
+        self.drop_last = drop_last
+        super().__init__(data_source, shuffle=shuffle, seed=seed)
+
+    def _draw(self, n: int) -> Tensor:
+        return shard_indices(super()._draw(n), self.rank, self.num_replicas, drop_last=self.drop_last)
+
+
+class DistributedInfiniteRandomSampler(InfiniteRandomSampler):
+    """
+    `InfiniteRandomSampler` partitioning each permutation across the ranks of the process group.
+    All ranks draw the same permutation from `seed + epoch`, padded to a multiple of the world size, and rank `r`
+    reads the positions `r, r + world_size, ...`. `seed` must be the same on all ranks.
+    """
+
+    def __init__(self, data_source, shuffle=True, seed: int = 0, rank: int = None, num_replicas: int = None,
+                 drop_last=False):
+        super().__init__(data_source, shuffle=shuffle, seed=seed)
+        self.seed = seed
+        self.rank, self.num_replicas = get_rank_and_world_size(rank, num_replicas)
+        self.drop_last = drop_last
+
+    def _peek_seed(self) -> int:
+        return self.seed
+
+    def _make_iterator(self) -> _InfiniteRandomIterator:
+        return _DistributedInfiniteRandomIterator(self.data_source, shuffle=self.shuffle, seed=self.seed,
+                                                  rank=self.rank, num_replicas=self.num_replicas,
+                                                  drop_last=self.drop_last)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.data_source) // self.num_replicas
+        return (len(self.data_source) + self.num_replicas - 1) // self.num_replicas
+
+
+class _EpochMixin:
+    """
+    shared epoch counter of the finite distributed samplers. The epoch is increased at each `__iter__`, so that all
+    ranks iterating the same number of times draw the same order, or it can be set explicitly with `set_epoch`.
+    """
+    seed: int
+
+    def _init_epoch(self, seed: int):
+        self.seed = seed
+        self._epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self._epoch = epoch
+
+    def _next_generator(self) -> torch.Generator:
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self._epoch)
+        self._epoch += 1
+        return generator
+
+
+class DistributedWeightedRandomSampler(_EpochMixin, Sampler):
+    r"""Rank-sharded :class:`WeightedRandomSampler`. ``num_samples`` indices are drawn identically on all ranks
+    and each rank reads ``ceil(num_samples / world_size)`` of them.
+
+    Args:
+        weights (sequence)   : a sequence of weights, not necessary summing up to one
+        num_samples (int): number of samples to draw over all ranks
+        replacement (bool): if ``True``, samples are drawn with replacement.
+        seed (int): seed shared by all ranks
+        rank (int, optional): rank of the current process, default from the process group
+        num_replicas (int, optional): world size, default from the process group
+    """
+
+    def __init__(self, weights, num_samples, replacement=True, seed: int = 0, rank: int = None,
+                 num_replicas: int = None):
+        if (
+            not isinstance(num_samples, _int_classes)
+            or isinstance(num_samples, bool)
+            or num_samples <= 0
+        ):
+            raise ValueError(
+                "num_samples should be a positive integer "
+                "value, but got num_samples={}".format(num_samples)
+            )
+        if not isinstance(replacement, bool):
+            raise ValueError(
+                "replacement should be a boolean value, but got "
+                "replacement={}".format(replacement)
+            )
+        self.weights = torch.as_tensor(weights, dtype=torch.double)
+        self.num_samples = num_samples
+        self.replacement = replacement
+        self.rank, self.num_replicas = get_rank_and_world_size(rank, num_replicas)
+        self._init_epoch(seed)
+
+    def __iter__(self):
+        indices = torch.multinomial(self.weights, self.num_samples, self.replacement,
+                                    generator=self._next_generator())
+        return iter(shard_indices(indices, self.rank, self.num_replicas).tolist())
+
+    def __len__(self):
+        return (self.num_samples + self.num_replicas - 1) // self.num_replicas
+
+
+class DistributedSubsetRandomSampler(_EpochMixin, Sampler):
+    r"""Rank-sharded :class:`SubsetRandomSampler`. The indices are shuffled identically on all ranks, padded to a
+    multiple of the world size and partitioned by rank.
+
+    Arguments:
+        indices (sequence): a sequence of indices
+        seed (int): seed shared by all ranks
+        rank (int, optional): rank of the current process, default from the process group
+        num_replicas (int, optional): world size, default from the process group
+        drop_last (bool): drop the tail of the permutation instead of padding it
+    """
+
+    def __init__(self, indices, seed: int = 0, rank: int = None, num_replicas: int = None, drop_last=False):
+        self.indices = indices
+        self.rank, self.num_replicas = get_rank_and_world_size(rank, num_replicas)
+        self.drop_last = drop_last
+        self._init_epoch(seed)
+
+    def __iter__(self):
+        permutation = torch.randperm(len(self.indices), generator=self._next_generator())
+        return (self.indices[i] for i in shard_indices(permutation, self.rank, self.num_replicas,
+                                                       drop_last=self.drop_last).tolist())
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.indices) // self.num_replicas
+        return (len(self.indices) + self.num_replicas - 1) // self.num_replicas
+
+
+class DistributedEvalSampler(Sampler):
+    r"""Rank-sharded :class:`SequentialSampler` for evaluation: rank ``r`` reads the indices ``r, r + world_size, ...``
+    without padding, so that each sample is seen exactly once over all ranks and the synchronized metrics are
+    those of the whole dataset. The ranks may read a different number of samples.
+
+    Arguments:
+        data_source (Dataset): dataset to sample from
+        rank (int, optional): rank of the current process, default from the process group
+        num_replicas (int, optional): world size, default from the process group
+    """
+
+    def __init__(self, data_source, rank: int = None, num_replicas: int = None):  # noqa
+        self.data_source = data_source
+        self.rank, self.num_replicas = get_rank_and_world_size(rank, num_replicas)
+
+    def __iter__(self):
+        return iter(range(self.rank, len(self.data_source), self.num_replicas))
+
+    def __len__(self):
+        return len(range(self.rank, len(self.data_source), self.num_replicas))
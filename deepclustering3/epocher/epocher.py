@@ -22,6 +22,8 @@ class _Epocher(_DDPMixin, metaclass=ABCMeta):
         self._cur_epoch = cur_epoch
 
         self.meters = MeterInterface()
+        # the meters are summed over the ranks at the end of `run`, to be disabled if the data are not sharded.
+        self.sync_meters = True
         self.indicator = tqdm(range(self._num_batches), disable=not self.on_master())
         self.__epocher_initialized__ = False
         self.__bind_trainer_done__ = False
@@ -55,6 +57,8 @@ class _Epocher(_DDPMixin, metaclass=ABCMeta):
         meters = self.meters
         yield meters
         meters.join()
+        if self.sync_meters:
+            meters.sync()
 
     @abstractmethod
     def configure_meters(self, meters: MeterInterface) -> MeterInterface:
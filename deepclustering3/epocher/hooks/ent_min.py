@@ -15,5 +15,5 @@ class EntropyMinHook(RegularizeHook):
 
     def _regularize(self, *, logits, **kwargs):
         entropy = self._criterion(logits.softmax(1))
-        self.meters["entropy"].add(entropy.item())
+        self.meters["entropy"].add(entropy.detach())
         return entropy * self._weight
@@ -1,52 +1,108 @@
 from collections import defaultdict
-from typing import List
+from numbers import Number
+from typing import List, Union, Optional
 
 import numpy as np
+import torch
+from torch import Tensor
 
-from .metric import Metric
+from .metric import Metric, scatter_rows
 
 
 class AverageValueMeter(Metric):
-    def __init__(self):
-        super(AverageValueMeter, self).__init__()
+    """
+    mean and std of the added values.
+
+    Values are written into a preallocated float64 buffer, on the device of the first tensor added, and reduced
+    only when the statistics are read: adding a 0-d tensor is one tensor write and does not synchronize with the
+    device, so losses can be added without `.item()`.
+    """
+
+    def __init__(self, threaded=False, executor=None):
+        super(AverageValueMeter, self).__init__(threaded=threaded, executor=executor)
         self.reset()
-        self.val = 0
 
-    def _add(self, value, n=1):
-        self.val = value
-        self.sum += value
-        self.var += value * value
+    def _add(self, value: Union[Tensor, Number], n=1):
+        if isinstance(value, Tensor):
+            value = value.detach().reshape(())
+        self._reserve(self._size + 1, device=value.device if isinstance(value, Tensor) else None)
+        self._values[self._size] = value
+        self._size += 1
         self.n += n
 
-        if self.n == 0:
-            self.mean, self.std = np.nan, np.nan
-        elif self.n == 1:
-            self.mean = 0.0 + self.sum  # This is to force a copy in torch/numpy
-            self.std = np.inf
-            self.mean_old = self.mean
-            self.m_s = 0.0
-        else:
-            self.mean = self.mean_old + (value - n * self.mean_old) / float(self.n)
-            self.m_s += (value - self.mean_old) * (value - self.mean)
-            self.mean_old = self.mean
-            self.std = np.sqrt(self.m_s / (self.n - 1.0))
+    def _reserve(self, size: int, device: Optional[torch.device]):
+        if self._values is None:
+            self._values = torch.zeros(max(size, 256), dtype=torch.float64, device=device)
+            return
+        capacity = len(self._values)
+        if size <= capacity:
+            return
+        grown = torch.zeros(max(size, 2 * capacity), dtype=torch.float64, device=self._values.device)
+        grown[:capacity] = self._values
+        self._values = grown
+
+    def _reduce(self):
+        return self._cached("_reduce_cache", self._compute_reduce)
+
+    def _compute_reduce(self):
+        if self._size == 0:
+            return np.nan, np.nan, 0.0
+        values = self._values[:self._size]
+        std = values.std() if self._size > 1 else values.new_tensor(np.inf)
+        # one synchronization for the mean, the std and the last value
+        total, std, last = torch.stack([values.sum(), std, values[-1]]).tolist()
+        return total / self.n if self.n != 0 else np.nan, std, last
+
+    @property
+    def mean(self) -> float:
+        return self._reduce()[0]
+
+    @property
+    def std(self) -> float:
+        return self._reduce()[1]
+
+    @property
+    def val(self) -> float:
+        """the last value added"""
+        return self._reduce()[2]
+
+    @property
+    def values(self) -> Tensor:
+        """the values added, on the device of the buffer"""
+        if self._values is None:
+            return torch.zeros(0, dtype=torch.float64)
+        return self._values[:self._size].clone()
 
     def value(self):
         return self.mean, self.std
 
     def reset(self):
         self.n = 0
-        self.sum = 0.0
-        self.var = 0.0
-        self.val = 0.0
-        self.mean = np.nan
-        self.mean_old = 0.0
-        self.m_s = 0.0
-        self.std = np.nan
+        self._size = 0
+        self._values: Optional[Tensor] = None
+        self._mark_dirty()
 
     def _summary(self) -> dict:
         # this function returns a dict and tends to aggregate the historical results.
-        return {"mean": self.mean, "_std": self.std}
+        mean, std, _ = self._reduce()
+        return {"mean": mean, "_std": std}
+
+    def _sync_metadata(self):
+        return self._size, self.n
+
+    def _sync_tensors(self, metadata, rank):
+        # the values of all ranks are concatenated, so that the std stays the one of all values.
+        sizes = [size for size, _ in metadata]
+        return [scatter_rows(self.values, sizes, rank)]
+
+    def _load_sync_tensors(self, metadata, tensors):
+        values, = tensors
+        device = self._values.device if self._values is not None else None
+        self.reset()
+        self._reserve(len(values), device=device)
+        self._values[:len(values)] = values
+        self._size = len(values)
+        self.n = sum(n for _, n in metadata)
 
 
 class MultipleAverageValueMeter(Metric):
@@ -57,6 +113,7 @@ class MultipleAverageValueMeter(Metric):
     def reset(self):
         for k, v in self._meter_dicts.items():
             v.reset()
+        self._mark_dirty()
 
     def _add(self, /, **kwargs):
         for k, v in kwargs.items():
@@ -68,8 +125,27 @@ class MultipleAverageValueMeter(Metric):
             result[k] = v.summary()["mean"]
         return result
 
+    def _sync_metadata(self):
+        return {k: v._sync_metadata() for k, v in self._meter_dicts.items()}  # noqa
+
+    def _sync_keys(self, metadata) -> List[str]:
+        # keys seen on any rank, in a deterministic order
+        return list(dict.fromkeys(k for rank_metadata in metadata for k in rank_metadata))
+
+    def _sync_tensors(self, metadata, rank):
+        tensors = []
+        for k in self._sync_keys(metadata):
+            tensors.extend(self._meter_dicts[k]._sync_tensors(  # noqa
+                [rank_metadata.get(k, (0, 0)) for rank_metadata in metadata], rank))
+        return tensors
+
+    def _load_sync_tensors(self, metadata, tensors):
+        for k, t in zip(self._sync_keys(metadata), tensors):
+            self._meter_dicts[k]._load_sync_tensors(  # noqa
+                [rank_metadata.get(k, (0, 0)) for rank_metadata in metadata], [t])
+
 
 class AverageValueListMeter(MultipleAverageValueMeter):
-    def add(self, list_value: List[float], **kwargs):
+    def _add(self, list_value: List[float], **kwargs):
         for i, v in enumerate(list_value):
             self._meter_dicts[str(i)].add(v)
@@ -0,0 +1,130 @@
+from typing import Optional, Dict
+
+import torch
+from torch import Tensor
+
+from .metric import Metric, MetricExecutor
+from .utils import MeterResultDict, to_float, average_list
+from ..utils import validate
+
+__all__ = ["ConfusionMatrixMeter"]
+
+
+class ConfusionMatrixMeter(Metric):
+    """
+    Segmentation meter accumulating a C x C confusion matrix (rows: target, columns: prediction) with one
+    `bincount` of `target * C + pred` per batch, without one-hot encoding.
+    Dice, IoU, precision, recall and accuracy are derived from the matrix, over all pixels seen.
+    The dice is smoothed as in `UniversalDice`, so that a class absent from both the predictions and the targets has
+    a dice of 1, while its IoU, precision and recall are undefined (NaN).
+    """
+
+    def __init__(self, C=4, report_axises=None, ignore_index: Optional[int] = None, threaded=False,
+                 executor: MetricExecutor = None) -> None:
+        super().__init__(threaded=threaded, executor=executor)
+        assert report_axises is None or isinstance(
+            report_axises, (list, tuple)
+        ), f"`report_axises` should be either None or an iterator, given {type(report_axises)}"
+        if report_axises is not None:
+            assert max(report_axises) < C, (
+                "Incompatible parameter of `C`={} and "
+                "`report_axises`={}".format(C, report_axises)
+            )
+        self._C = C
+        self._report_axis = list(range(self._C)) if report_axises is None else list(report_axises)
+        self._ignore_index = ignore_index
+        self.reset()
+
+    def reset(self):
+        self._matrix: Optional[Tensor] = None
+        self._n = 0
+        self._mark_dirty()
+
+    def _to_class(self, x: Tensor, class_dim_size: int) -> Tensor:
+        if x.is_floating_point():
+            # probabilities or one-hot (B, C, ...)
+            assert x.dim() >= 2 and x.shape[1] == class_dim_size, x.shape
+            return x.argmax(1)
+        return x
+
+    def _check_labels(self, pred: Tensor, target: Tensor) -> bool:
+        # a label out of range would be counted in another cell of the matrix instead of failing.
+        if ((pred < 0) | (pred >= self._C) | (target < 0) | (target >= self._C)).any():
+            raise ValueError(f"labels should be in [0, {self._C}), given pred in [{pred.min()}, {pred.max()}] and "
+                             f"target in [{target.min()}, {target.max()}].")
+        return True
+
+    def _add(self, pred: Tensor, target: Tensor):
+        """
+        :param pred: class-coded (B, ...) or probability (B, C, ...) prediction
+        :param target: class-coded (B, ...) or one-hot (B, C, ...) float target
+        """
+        pred, target = self._to_class(pred, self._C), self._to_class(target, self._C)
+        assert pred.shape == target.shape, (
+            f"incompatible shape of `pred` and `target`, given "
+            f"{pred.shape} and {target.shape}."
+        )
+        pred, target = pred.reshape(-1).long(), target.reshape(-1).long()
+        if self._ignore_index is not None:
+            kept = target != self._ignore_index
+            pred, target = pred[kept], target[kept]
+        # the check synchronizes with the device, it follows the validation mode as the other checks of the meters.
+        validate(self._check_labels, pred, target)
+        counts = torch.bincount(target * self._C + pred, minlength=self._C ** 2)
+        if self._matrix is None:
+            self._matrix = torch.zeros(self._C, self._C, dtype=torch.long, device=counts.device)
+        self._matrix += counts.view(self._C, self._C)
+        self._n += 1
+
+    @property
+    def confusion_matrix(self) -> Tensor:
+        if self._matrix is None:
+            return torch.zeros(self._C, self._C, dtype=torch.long)
+        return self._matrix.clone()
+
+    def metrics(self) -> Dict[str, Tensor]:
+        """per-class dice, iou, precision and recall (the per-class accuracy), and the overall accuracy"""
+        return self._cached("_metrics_cache", self._compute_metrics)
+
+    def _compute_metrics(self) -> Dict[str, Tensor]:
+        matrix = self.confusion_matrix.double()
+        tp = matrix.diagonal()
+        fp = matrix.sum(0) - tp
+        fn = matrix.sum(1) - tp
+        return {
+            "dice": (2 * tp + 1e-6) / (2 * tp + fp + fn + 1e-6),
+            "iou": tp / (tp + fp + fn),
+            "precision": tp / (tp + fp),
+            "recall": tp / (tp + fn),
+            "accuracy": tp.sum() / matrix.sum(),
+        }
+
+    def _sync_metadata(self):
+        return self._n
+
+    def _sync_tensors(self, metadata, rank):
+        return [self._matrix if self._matrix is not None else self.confusion_matrix]
+
+    def _load_sync_tensors(self, metadata, tensors):
+        self._matrix = tensors[0].long()
+        self._n = sum(metadata)
+
+    def _summary(self) -> dict:
+        dice = self.metrics()["dice"]
+        report_dict = {f"DSC{i}": to_float(dice[i]) for i in self._report_axis}
+        report_dict.update({"DSC_mean": average_list(report_dict.values())})
+        return MeterResultDict(report_dict)
+
+    def detailed_summary(self) -> dict:
+        metrics = self.metrics()
+        report_dict = {}
+        for name, key in (("DSC", "dice"), ("IoU", "iou"), ("Precision", "precision"), ("Recall", "recall")):
+            values = {f"{name}{i}": to_float(metrics[key][i]) for i in self._report_axis}
+            report_dict.update(values)
+            report_dict[f"{name}_mean"] = average_list(values.values())
+        report_dict["Accuracy"] = to_float(metrics["accuracy"])
+        return MeterResultDict(report_dict)
+
+    def __repr__(self):
+        string = f"C={self._C}, report_axis={self._report_axis}\n"
+        return string + "\t" + str(self.detailed_summary())
@@ -1,23 +1,35 @@
 from collections.abc import Iterable
-from typing import Union, List
+from typing import Union, List, Dict, Optional, Tuple, Set
 
 import numpy as np
 import torch
-from deepclustering2.meters2.individual_meters._metric import _Metric, MeterResultDict
-from deepclustering2.type import to_float
-from deepclustering2.utils import iter_average as average_list
-from deepclustering2.utils import (
-    simplex,
+from torch import Tensor
+
+from .metric import Metric, MetricExecutor
+from .utils import MeterResultDict, to_float, average_list
+from ..utils import (
     one_hot,
     class2one_hot,
     probs2one_hot,
+    validate,
 )
-from torch import Tensor
 
 
-class UniversalDice(_Metric):
-    def __init__(self, C=4, report_axises=None) -> None:
-        super(UniversalDice, self).__init__()
+class UniversalDice(Metric):
+    """
+    Dice meter accumulating the intersections and unions of each group (slice, or scan given by `group_name`) into
+    running sums. Group names are mapped to integer ids at `add` time, so that the memory is bounded by the number
+    of groups and the summary is computed once per change.
+
+    Each slice added without `group_name` is a group of its own: the memory and the cost of `value` grow with the
+    number of slices of the epoch. With `keep_slices=False`, the dice of these slices are folded into running sums
+    at `add` time instead, costing O(C) whatever the number of slices; `log` and `group_names` then only cover the
+    named groups.
+    """
+
+    def __init__(self, C=4, report_axises=None, keep_slices=True, threaded=False,
+                 executor: MetricExecutor = None) -> None:
+        super(UniversalDice, self).__init__(threaded=threaded, executor=executor)
         assert report_axises is None or isinstance(
             report_axises, (list, tuple)
         ), f"`report_axises` should be either None or an iterator, given {type(report_axises)}"
@@ -30,15 +42,22 @@ class UniversalDice(_Metric):
         self._report_axis = list(range(self._C))
         if report_axises is not None:
             self._report_axis = report_axises
+        self._keep_slices = keep_slices
         self.reset()
 
     def reset(self):
-        self._intersections = []
-        self._unions = []
-        self._group_names = []
+        self._group2id: Dict[str, int] = {}
+        # names generated for the slices added without `group_name`, only unique within a rank
+        self._slice_groups: Set[str] = set()
+        # running sums of (num_groups, C), grown by doubling
+        self._intersections: Optional[Tensor] = None
+        self._unions: Optional[Tensor] = None
+        # count, sum and sum of squares of the folded slice dices (3, C), with `keep_slices=False`
+        self._slice_stats: Optional[Tensor] = None
         self._n = 0
+        self._mark_dirty()
 
-    def add(
+    def _add(
         self, pred: Tensor, target: Tensor, group_name: Union[str, List[str]] = None
     ):
         """
@@ -69,53 +88,89 @@ class UniversalDice(_Metric):
 
         onehot_pred, onehot_target = self._convert2onehot(pred, target)
         B, C, *hw = pred.shape
-
-        # current group name:
-        current_group_name = [
-            str(self._n) + f"_{i:03d}" for i in range(B)
-        ]  # make it like slice based dice
-        if group_name is not None:
-            current_group_name = group_name
-            if isinstance(group_name, str):
-                # this is too make 3D dice.
-                current_group_name = [group_name] * B
-        assert isinstance(current_group_name, (list, tuple))
-        if isinstance(current_group_name, tuple):
-            current_group_name = list(current_group_name)
         interaction, union = (
             self._intersaction(onehot_pred, onehot_target),
             self._union(onehot_pred, onehot_target),
         )
-        self._intersections.append(interaction)
-        self._unions.append(union)
-        self._group_names.extend(current_group_name)
+        if group_name is None and not self._keep_slices:
+            dices = self._dices(interaction, union)
+            stats = torch.stack([torch.ones_like(dices).sum(0), dices.sum(0), (dices ** 2).sum(0)])
+            self._slice_stats = stats if self._slice_stats is None else self._slice_stats + stats
+            self._n += 1
+            return
+
+        # current group name:
+        if group_name is None:
+            # make it like slice based dice
+            current_group_name = [str(self._n) + f"_{i:03d}" for i in range(B)]
+            self._slice_groups.update(current_group_name)
+        elif isinstance(group_name, str):
+            # this is too make 3D dice.
+            current_group_name = [group_name] * B
+        else:
+            current_group_name = list(group_name)
+
+        group_ids = torch.tensor(
+            [self._group2id.setdefault(name, len(self._group2id)) for name in current_group_name],
+            dtype=torch.long, device=onehot_pred.device
+        )
+        self._reserve(len(self._group2id), device=interaction.device)
+        self._intersections.index_add_(0, group_ids, interaction)
+        self._unions.index_add_(0, group_ids, union)
         self._n += 1
 
+    def _reserve(self, num_groups: int, device: torch.device):
+        if self._intersections is None:
+            capacity = max(num_groups, 16)
+            self._intersections = torch.zeros(capacity, self._C, dtype=torch.long, device=device)
+            self._unions = torch.zeros(capacity, self._C, dtype=torch.long, device=device)
+            return
+        capacity = len(self._intersections)
+        if num_groups <= capacity:
+            return
+        capacity = max(num_groups, 2 * capacity)
+        for name in ("_intersections", "_unions"):
+            previous = getattr(self, name)
+            grown = torch.zeros(capacity, self._C, dtype=previous.dtype, device=previous.device)
+            grown[:len(previous)] = previous
+            setattr(self, name, grown)
+
+    @staticmethod
+    def _dices(intersections: Tensor, unions: Tensor) -> Tensor:
+        return (2 * intersections.double() + 1e-6) / (unions.double() + 1e-6)
+
+    def _group_dices(self) -> Tensor:
+        num_groups = len(self._group2id)
+        return self._dices(self._intersections[:num_groups], self._unions[:num_groups])
+
     @property
     def log(self):
-        if self._n > 0:
-            group_names = self.group_names
-            interaction_array = torch.cat(self._intersections, dim=0)
-            union_array = torch.cat(self._unions, dim=0)
-            group_name_array = np.asarray(self._group_names)
-            resulting_dice = []
-            for unique_name in group_names:
-                index = group_name_array == unique_name
-                group_dice = (2 * interaction_array[index].sum(0) + 1e-6) / (
-                    union_array[index].sum(0) + 1e-6
-                )
-                resulting_dice.append(group_dice)
-            resulting_dice = torch.stack(resulting_dice, dim=0)
-            return resulting_dice
+        """dice of each group (num_groups, C), groups sorted by name"""
+        if self._group2id:
+            order = torch.tensor([self._group2id[name] for name in self.group_names],
+                                 device=self._intersections.device)
+            return self._group_dices()[order].float()
 
     def value(self, **kwargs):
         if self._n == 0:
             return ([np.nan] * self._C, [np.nan] * self._C)
+        return self._cached("_value_cache", self._compute_value)
 
-        resulting_dice = self.log
-        return (resulting_dice.mean(0), resulting_dice.std(0))
+    def _compute_value(self):
+        if self._slice_stats is None:
+            resulting_dice = self._group_dices()
+            return resulting_dice.mean(0), resulting_dice.std(0)
+        # the folded slices and the named groups together, with the unbiased std as `Tensor.std`
+        count, total, squares = self._slice_stats
+        if self._group2id:
+            group_dices = self._group_dices()
+            count, total, squares = count + len(group_dices), total + group_dices.sum(0), \
+                squares + (group_dices ** 2).sum(0)
+        mean = total / count
+        std = ((squares - count * mean ** 2).clamp_min(0) / (count - 1)).sqrt()
+        return mean, std
 
-    def summary(self) -> dict:
+    def _summary(self) -> dict:
         means, stds = self.value()
         report_dict = {f"DSC{i}": to_float(means[i]) for i in self._report_axis}
         report_dict.update({"DSC_mean": average_list(report_dict.values())})
@@ -135,9 +190,52 @@ class UniversalDice(_Metric):
             }
         )
 
+    def _sync_metadata(self):
+        return list(self._group2id), sorted(self._slice_groups), self._n
+
+    @staticmethod
+    def _sync_groups(metadata) -> Dict[Tuple[int, str], int]:
+        # the named groups are merged over the ranks (e.g. the slices of one scan split between them), the generated
+        # slice names are made unique by their rank.
+        groups = {}
+        for rank, (names, slice_groups, _) in enumerate(metadata):
+            slice_groups = set(slice_groups)
+            for name in names:
+                key = (rank, name) if name in slice_groups else (-1, name)
+                groups.setdefault(key, len(groups))
+        return groups
+
+    def _sync_tensors(self, metadata, rank):
+        groups = self._sync_groups(metadata)
+        device = self._intersections.device if self._intersections is not None else None
+        intersections = torch.zeros(len(groups), self._C, dtype=torch.long, device=device)
+        unions = torch.zeros_like(intersections)
+        if self._group2id:
+            local_ids = torch.tensor(
+                [groups[(rank, name) if name in self._slice_groups else (-1, name)] for name in self._group2id],
+                dtype=torch.long, device=device
+            )
+            intersections[local_ids] = self._intersections[:len(local_ids)]
+            unions[local_ids] = self._unions[:len(local_ids)]
+        if self._keep_slices:
+            return [intersections, unions]
+        slice_stats = self._slice_stats if self._slice_stats is not None else \
+            torch.zeros(3, self._C, dtype=torch.double, device=device)
+        return [intersections, unions, slice_stats]
+
+    def _load_sync_tensors(self, metadata, tensors):
+        groups = self._sync_groups(metadata)
+        names = [name if rank < 0 else f"rank{rank}_{name}" for rank, name in groups]
+        self._group2id = {name: i for i, name in enumerate(names)}
+        self._slice_groups = {name for (rank, _), name in zip(groups, names) if rank >= 0}
+        self._intersections, self._unions = (t.long() for t in tensors[:2])
+        if not self._keep_slices:
+            self._slice_stats = tensors[2].double() if tensors[2][0].sum() > 0 else None
+        self._n = sum(n for *_, n in metadata)
+
     @property
     def group_names(self):
-        return sorted(set(self._group_names))
+        return sorted(self._group2id)
 
     @staticmethod
     def _intersaction(pred: Tensor, target: Tensor):
@@ -148,7 +246,8 @@ class UniversalDice(_Metric):
         :return: tensor of intersaction over classes
         """
         assert pred.shape == target.shape
-        assert one_hot(pred) and one_hot(target)
+        validate(one_hot, pred)
+        validate(one_hot, target)
 
         B, C, *hw = pred.shape
         intersect = (pred * target).sum(list(range(2, 2 + len(hw))))
@@ -164,7 +263,8 @@ class UniversalDice(_Metric):
         :return: tensor of intersaction over classes
         """
         assert pred.shape == target.shape
-        assert one_hot(pred) and one_hot(target)
+        validate(one_hot, pred)
+        validate(one_hot, target)
 
         B, C, *hw = pred.shape
         union = (pred + target).sum(list(range(2, 2 + len(hw))))
@@ -172,10 +272,12 @@ class UniversalDice(_Metric):
         return union
 
     def _convert2onehot(self, pred: Tensor, target: Tensor):
-        # only two possibility: both onehot or both class-coded.
+        # only two possibility: both onehot or both class-coded, told apart by the dtype of `pred` as in
+        # `ConfusionMatrixMeter`, the checks of the values being left to `validate`.
         assert pred.shape == target.shape
         # if they are onehot-coded:
-        if simplex(pred, 1) and one_hot(target):
+        if pred.is_floating_point():
+            validate(one_hot, target)
             return probs2one_hot(pred).long(), target.long()
         # here the pred and target are labeled long
         return (
@@ -1,10 +1,40 @@
 from collections import OrderedDict, defaultdict
+from collections.abc import Mapping
 from contextlib import contextmanager
 from typing import Dict, List
 
+import torch
+import torch.distributed as dist
+
 from . import metric
 
 
+class _StatisticsView(Mapping):
+    """
+    read-only mapping of group name to the statistics of its meters, computed when a group is looked up.
+    Groups with name starting with `_` are ignored, as in `MeterInterface.statistics`.
+    """
+
+    def __init__(self, meter_interface: "MeterInterface", cheap=True) -> None:
+        self._meter_interface = meter_interface
+        self._cheap = cheap
+
+    def _groups(self) -> List[str]:
+        return [g for g in self._meter_interface.groups() if not g.startswith("_")]
+
+    def __getitem__(self, group_name: str) -> Dict[str, dict]:
+        if group_name not in self._groups():
+            raise KeyError(group_name)
+        meters = self._meter_interface._get_meters_by_group(group_name)  # noqa
+        return {k: m.cheap_summary() if self._cheap else m.summary() for k, m in meters.items()}
+
+    def __iter__(self):
+        return iter(self._groups())
+
+    def __len__(self):
+        return len(self._groups())
+
+
 class MeterInterface:
     """
     meter interface only concerns about the situation in one epoch,
@@ -51,10 +81,58 @@ class MeterInterface:
                 m.reset()
 
     def join(self):
+        """barrier on the threaded meters, each executor is flushed once"""
+        executors = []
         for g in self.groups():
-            meters = self._get_meters_by_group(g)
-            for m in meters.values():
-                m.join()
+            for m in self._get_meters_by_group(g).values():
+                if m.executor is not None and all(m.executor is not e for e in executors):
+                    executors.append(m.executor)
+        for executor in executors:
+            executor.flush()
+
+    def sync(self):
+        """
+        sum the sufficient statistics of every meter over the ranks of the default process group, so that each rank
+        reports the statistics of the whole data. It is a collective call: every rank must register the same meters.
+
+        The metadata of the meters are exchanged with one `all_gather_object`, then all statistics are flattened into
+        one float64 buffer reduced by one `all_reduce`, on the cuda device for nccl and on cpu otherwise (gloo).
+        Meters not implementing the synchronization are kept local. Calling `sync` again is a no-op for the meters
+        not updated since their last synchronization.
+        """
+        if not dist.is_available() or not dist.is_initialized() or dist.get_world_size() == 1:
+            return
+        self.join()
+        meters = [m for g in self.groups() for m in self._get_meters_by_group(g).values()]
+        world_size, rank = dist.get_world_size(), dist.get_rank()
+        gathered: List[List] = [None] * world_size  # noqa
+        dist.all_gather_object(gathered, [(m._is_synced(), m._sync_metadata()) for m in meters])  # noqa
+        synced = [[gathered[r][i][0] for r in range(world_size)] for i in range(len(meters))]
+        for i, flags in enumerate(synced):
+            if any(flags) and not all(flags):
+                raise RuntimeError(f"{meters[i].__class__.__name__} was updated after the last `sync` on some ranks "
+                                   f"only, its statistics cannot be summed again.")
+        meters = [m for i, m in enumerate(meters) if not synced[i][0]]
+        metadata = [[gathered[r][i][1] for r in range(world_size)] for i in range(len(gathered[rank]))
+                    if not synced[i][0]]
+
+        tensors = [m._sync_tensors(metadata[i], rank) for i, m in enumerate(meters)]  # noqa
+        flat_tensors = [t for ts in tensors if ts is not None for t in ts]
+        if len(flat_tensors) == 0:
+            return
+        device = torch.device("cuda", torch.cuda.current_device()) if dist.get_backend() == "nccl" \
+            else torch.device("cpu")
+        bucket = torch.cat([t.reshape(-1).to(device=device, dtype=torch.float64) for t in flat_tensors])
+        dist.all_reduce(bucket)
+
+        chunks = iter(bucket.split([t.numel() for t in flat_tensors]))
+        for i, m in enumerate(meters):
+            if tensors[i] is None:
+                continue
+            reduced = [next(chunks).view(t.shape).to(device=t.device, dtype=t.dtype) for t in tensors[i]]
+            m._load_sync_tensors(metadata[i], reduced)  # noqa
+            m._mark_dirty()  # noqa
+            m._mark_synced()  # noqa
 
     def _get_meters_by_group(self, group_name: str):
         if group_name not in self.groups():
@@ -93,6 +171,13 @@ class MeterInterface:
             if not g.startswith("_"):
                 yield g, self._statistics_by_group(g)
 
+    def progress_statistics(self) -> _StatisticsView:
+        """
+        lazy view of the statistics for the progress display: nothing is computed until the display reads a group,
+        then each meter gives its `cheap_summary`, recomputed only if the meter changed since the previous read.
+        """
+        return _StatisticsView(self, cheap=True)
+
     def __enter__(self):
         self.reset()
 
@@ -1,31 +1,125 @@
 import atexit
+import copy
 from abc import ABCMeta, abstractmethod
-from threading import Thread
+from collections import deque
+from threading import Thread, Condition, current_thread
+from typing import Optional, Deque, Tuple, Any, List, Sequence
 
 from loguru import logger
-
-from .utils import ThreadQueue
-
-
-class _StopToken:
-    pass
+from torch import Tensor
+
+__all__ = ["Metric", "MetricExecutor", "get_default_executor", "scatter_rows"]
+
+
+class MetricExecutor:
+    """
+    one worker thread applying the pending `add` of any number of threaded metrics.
+
+    `submit` appends to a deque under a condition variable and the worker drains all pending calls at once, in
+    submission order, sleeping on the condition while there is nothing to do.
+    `flush` is a barrier: it returns when every call submitted before it has been applied, and re-raises the first
+    exception raised by an `add` since the previous flush.
+    """
+
+    def __init__(self, name: str = "metric_executor") -> None:
+        self._name = name
+        self._condition = Condition()
+        self._pending: Deque[Tuple["Metric", tuple, dict]] = deque()
+        self._num_submitted = 0
+        self._num_done = 0
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._worker: Optional[Thread] = None
+
+    def submit(self, metric: "Metric", args: tuple, kwargs: dict) -> None:
+        with self._condition:
+            if self._closed:
+                raise RuntimeError(f"{self._name} is closed.")
+            if self._worker is None:
+                logger.trace(f"{self._name} spawn a thread")
+                self._worker = Thread(target=self._run, name=self._name, daemon=True)
+                self._worker.start()
+            self._pending.append((metric, args, kwargs))
+            self._num_submitted += 1
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                batch, self._pending = self._pending, deque()
+            for metric, args, kwargs in batch:
+                try:
+                    metric._apply_add(*args, **kwargs)  # noqa
+                except BaseException as e:  # noqa
+                    logger.opt(exception=e).error(f"{metric.__class__.__name__}.add failed in {self._name}")
+                    with self._condition:
+                        if self._error is None:
+                            self._error = e
+            with self._condition:
+                self._num_done += len(batch)
+                self._condition.notify_all()
+
+    def flush(self) -> None:
+        if self._worker is current_thread():
+            raise RuntimeError(f"{self._name} cannot be flushed from its worker.")
+        with self._condition:
+            target = self._num_submitted
+            self._condition.wait_for(lambda: self._num_done >= target)
+            error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def close(self) -> None:
+        """apply the pending calls and stop the worker"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            worker = self._worker
+        if worker is not None and worker is not current_thread():
+            worker.join()
+            logger.trace(f"{self._name} end the thread")
+
+    @property
+    def num_pending(self) -> int:
+        with self._condition:
+            return self._num_submitted - self._num_done
+
+
+_default_executor: Optional[MetricExecutor] = None
+
+
+def get_default_executor() -> MetricExecutor:
+    """the executor shared by the threaded metrics, closed once at exit"""
+    global _default_executor
+    if _default_executor is None:
+        _default_executor = MetricExecutor()
+        atexit.register(_default_executor.close)
+    return _default_executor
 
 
 class Metric(metaclass=ABCMeta):
+    """
+    base of the meters.
+
+    `summary` and `cheap_summary` are cached until the next `add`, `reset` or synchronization, tracked by a version
+    counter, so that reading them repeatedly, e.g. by the progress bar, costs nothing when nothing was added.
+    The subclasses call `_mark_dirty` in `reset`, and can cache their own intermediate results with `_cached`.
+    """
     _initialized = False
+    _version = 0
+    _synced_version = None
 
-    def __init__(self, threaded=False, use_deque=False) -> None:
+    def __init__(self, threaded=False, executor: MetricExecutor = None) -> None:
         super().__init__()
         self._initialized = True
-        self._threaded = threaded
-
+        self._threaded = threaded or executor is not None
+        self._executor: Optional[MetricExecutor] = None
         if self._threaded:
-            logger.trace(f"{self.__class__.__name__} spawn a thread")
-            self._queue = ThreadQueue(use_deque=use_deque)
-            self._worker = Thread(target=self._worker_func, name="threaded_worker",
-                                  args=(self._queue,), )
-            self._worker.start()
-            atexit.register(self.close)
+            self._executor = executor or get_default_executor()
 
     @abstractmethod
     def reset(self):
@@ -34,40 +128,85 @@ class Metric(metaclass=ABCMeta):
     def add(self, *args, **kwargs):
         assert self._initialized, f"{self.__class__.__name__} must be initialized by overriding __init__"
         if not self._threaded:
-            return self._add(*args, **kwargs)
-        return self._add_queue(*args, **kwargs)
+            return self._apply_add(*args, **kwargs)
+        self._executor.submit(self, args, kwargs)
+
+    def _apply_add(self, *args, **kwargs):
+        result = self._add(*args, **kwargs)
+        self._mark_dirty()
+        return result
 
     @abstractmethod
     def _add(self, *args, **kwargs):
         pass
 
-    def _add_queue(self, *args, **kwargs):
-        self._queue.put((args, kwargs))
+    def _mark_dirty(self):
+        self._version += 1
+
+    def _cached(self, name: str, function):
+        # the version is read before computing: an `add` applied meanwhile by a worker invalidates the result.
+        version = self._version
+        cache = self.__dict__.get(name)
+        if cache is None or cache[0] != version:
+            cache = (version, function())
+            self.__dict__[name] = cache
+        return copy.copy(cache[1])  # the callers may prune the returned dict
 
     def summary(self):
-        return self._summary()
+        return self._cached("_summary_cache", self._summary)
 
     @abstractmethod
     def _summary(self):
         pass
 
-    def _worker_func(self, input_queue: ThreadQueue):
-        while True:
-            try:
-                args, kwags = input_queue.get()
-            except IndexError:
-                continue
-            if isinstance(args[0], _StopToken):
-                break
-            self._add(*args, **kwags)
+    def cheap_summary(self):
+        """summary for the progress display, which may be approximated or partial for expensive meters"""
+        return self._cached("_cheap_summary_cache", self._cheap_summary)
+
+    def _cheap_summary(self):
+        return self.summary()
+
+    @property
+    def executor(self) -> Optional[MetricExecutor]:
+        return self._executor
 
     def join(self):
+        """wait until the submitted `add` are applied, the worker is kept for the next ones"""
         if not self._threaded:
             return
-        self.close()
-        logger.trace(f"{self.__class__.__name__} join the thread")
-        self._worker.join()
-        logger.trace(f"{self.__class__.__name__} end the thread")
+        self._executor.flush()
 
     def close(self):
-        self._add_queue(_StopToken())
+        self.join()
+
+    # distributed synchronization, driven by `MeterInterface.sync`: the metadata of every rank are gathered first,
+    # then the tensors returned by `_sync_tensors` are summed over the ranks and given back to `_load_sync_tensors`.
+    # Both tensor lists must have the same shapes on all ranks, which the gathered metadata make possible.
+    # A synchronized meter holds the global statistics until its next `add` or `reset`, and is not reduced again.
+    def _mark_synced(self):
+        self._synced_version = self._version
+
+    def _is_synced(self) -> bool:
+        return self._synced_version == self._version
+
+    def _sync_metadata(self) -> Any:
+        """picklable description of the local state, e.g. the number of values"""
+        return None
+
+    def _sync_tensors(self, metadata: List[Any], rank: int) -> Optional[List[Tensor]]:
+        """the local sufficient statistics to be summed over the ranks, None if the metric is kept local"""
+        return None
+
+    def _load_sync_tensors(self, metadata: List[Any], tensors: List[Tensor]) -> None:
+        pass
+
+
+def scatter_rows(rows: Tensor, sizes: Sequence[int], rank: int) -> Tensor:
+    """
+    put the `rows` of this rank at its offset in a zero tensor of `sum(sizes)` rows, so that summing the result
+    over the ranks concatenates the rows of all ranks, in rank order.
+    """
+    offset = sum(sizes[:rank])
+    out = rows.new_zeros((sum(sizes), *rows.shape[1:]))
+    out[offset:offset + len(rows)] = rows
+    return out
@@ -1,29 +1,143 @@
+from typing import Tuple, Union, Sequence, Optional, Dict, Callable
+
 import numpy as np
-from deepclustering2.type import to_numpy
-from medpy.metric import assd
-from medpy.metric.binary import __surface_distances
+import torch
+from scipy.ndimage import binary_erosion, distance_transform_edt, generate_binary_structure
+
+__all__ = ["surface_distance_pair", "surface_distances", "hausdorff_distance", "hausdorff_distance_95",
+           "mod_hausdorff_distance", "average_surface_distance"]
+
+_spacing_type = Union[float, Sequence[float], None]
+
+# reductions of the two directed distance sets (from the border of mask1 to mask2, and back). hd, hd95 and assd follow
+# the definitions of medpy.
+_reductions: Dict[str, Callable[[np.ndarray, np.ndarray], float]] = {
+    "hd": lambda sds1, sds2: max(sds1.max(), sds2.max()),
+    "hd95": lambda sds1, sds2: np.percentile(np.hstack((sds1, sds2)), 95),
+    "mhd": lambda sds1, sds2: max(np.percentile(sds1, 95), np.percentile(sds2, 95)),
+    "assd": lambda sds1, sds2: np.mean((sds1.mean(), sds2.mean())),
+}
+
+
+def _to_bool_array(data) -> np.ndarray:
+    if isinstance(data, torch.Tensor):
+        data = data.detach().cpu().numpy()
+    return np.atleast_1d(np.asarray(data).astype(bool, copy=False))
+
+
+def _check_spacing(voxelspacing: _spacing_type, ndim: int) -> Optional[Tuple[float, ...]]:
+    if voxelspacing is None:
+        return None
+    if np.isscalar(voxelspacing):
+        voxelspacing = (voxelspacing,) * ndim
+    voxelspacing = tuple(float(x) for x in voxelspacing)
+    if len(voxelspacing) != ndim:
+        raise ValueError(f"`voxelspacing` should give one spacing per spatial axis ({ndim}), given {voxelspacing}.")
+    if min(voxelspacing) <= 0:
+        raise ValueError(f"`voxelspacing` should be positive, given {voxelspacing}.")
+    return voxelspacing
+
+
+def _border(mask: np.ndarray, spatial_dims: int) -> np.ndarray:
+    # voxels of the mask with at least one face-connected background neighbour, the leading (batch) axes of `mask`
+    # are not eroded.
+    footprint = generate_binary_structure(spatial_dims, 1)
+    footprint = footprint.reshape((1,) * (mask.ndim - spatial_dims) + footprint.shape)
+    return mask ^ binary_erosion(mask, structure=footprint, iterations=1)
+
+
+def _directed_distances(border1: np.ndarray, border2: np.ndarray, voxelspacing) -> Tuple[np.ndarray, np.ndarray]:
+    # one distance transform per mask, shared by both directions.
+    distance_to1 = distance_transform_edt(~border1, sampling=voxelspacing)
+    distance_to2 = distance_transform_edt(~border2, sampling=voxelspacing)
+    return distance_to2[border1], distance_to1[border2]
+
+
+def _reduce(reduction: Callable[[np.ndarray, np.ndarray], float], sds1: np.ndarray, sds2: np.ndarray, empty1: bool,
+            empty2: bool, empty_value: float) -> float:
+    if empty1 and empty2:
+        return 0.0
+    if empty1 or empty2:
+        return empty_value
+    return float(reduction(sds1, sds2))
+
+
+def surface_distance_pair(data1, data2, voxelspacing: _spacing_type = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    the distances from the border voxels of `data1` to the border of `data2`, and from `data2` to `data1`.
+    The border and its distance transform are computed once per mask and shared by both directions.
+    Both sets are empty if one of the masks is.
+    """
+    data1, data2 = _to_bool_array(data1), _to_bool_array(data2)
+    assert data1.shape == data2.shape, (data1.shape, data2.shape)
+    voxelspacing = _check_spacing(voxelspacing, data1.ndim)
+    if not data1.any() or not data2.any():
+        return np.zeros(0), np.zeros(0)
+    return _directed_distances(_border(data1, data1.ndim), _border(data2, data2.ndim), voxelspacing)
+
+
+def surface_distances(pred, target, voxelspacing: _spacing_type = None, metrics=("hd", "hd95", "assd"),
+                      empty_value=np.nan) -> Dict[str, np.ndarray]:
+    """
+    batched surface distances between binary (B, C, ...) masks, e.g. one-hot predictions and targets.
+
+    The borders of the whole batch are extracted with one erosion, and the two directed distance sets of each
+    (b, c) pair come from one distance transform per mask.
+    :param voxelspacing: spacing of the spatial axes, one number or one per axis
+    :param metrics: names among "hd", "hd95" (percentile of both sets as medpy), "mhd" (max of the directed 95th
+                    percentiles) and "assd"
+    :param empty_value: value of a pair with exactly one empty mask, for which the distances are undefined. A pair
+                        of empty masks gives 0.
+    :return: dict of (B, C) arrays, one per metric
+    """
+    pred, target = _to_bool_array(pred), _to_bool_array(target)
+    assert pred.shape == target.shape, (pred.shape, target.shape)
+    assert pred.ndim >= 3, f"inputs should be of shape (B, C, ...), given {pred.shape}."
+    for metric in metrics:
+        if metric not in _reductions:
+            raise ValueError(f"`metrics` should be among {list(_reductions)}, given {metric}.")
+    B, C, *spatial = pred.shape
+    voxelspacing = _check_spacing(voxelspacing, len(spatial))
+
+    spatial_axes = tuple(range(2, pred.ndim))
+    pred_empty, target_empty = ~pred.any(axis=spatial_axes), ~target.any(axis=spatial_axes)
+    pred_border, target_border = _border(pred, len(spatial)), _border(target, len(spatial))
+
+    results = {metric: np.empty((B, C), dtype=np.float64) for metric in metrics}
+    for b in range(B):
+        for c in range(C):
+            empty1, empty2 = pred_empty[b, c], target_empty[b, c]
+            sds1 = sds2 = np.zeros(0)
+            if not (empty1 or empty2):
+                sds1, sds2 = _directed_distances(pred_border[b, c], target_border[b, c], voxelspacing)
+            for metric in metrics:
+                results[metric][b, c] = _reduce(_reductions[metric], sds1, sds2, empty1, empty2, empty_value)
+    return results
+
+
+def _pair_metric(reduction, data1, data2, voxelspacing, empty_value) -> float:
+    data1, data2 = _to_bool_array(data1), _to_bool_array(data2)
+    sds1, sds2 = surface_distance_pair(data1, data2, voxelspacing)
+    return _reduce(reduction, sds1, sds2, not data1.any(), not data2.any(), empty_value)
+
 
-__all__ = ["hausdorff_distance", "mod_hausdorff_distance", "average_surface_distance"]
+def hausdorff_distance(data1, data2, voxelspacing=None, empty_value=np.nan):
+    return _pair_metric(_reductions["hd"], data1, data2, voxelspacing, empty_value)
 
 
-def hausdorff_distance(data1, data2, voxelspacing=None):
-    data1, data2 = to_numpy(data1), to_numpy(data2)
-    hd1 = __surface_distances(data1, data2, voxelspacing, connectivity=1)
-    hd2 = __surface_distances(data2, data1, voxelspacing, connectivity=1)
-    hd = max(hd1.max(), hd2.max())
-    return hd
+def hausdorff_distance_95(data1, data2, voxelspacing=None, empty_value=np.nan):
+    """95th percentile of the distances of both directions, as medpy's `hd95`"""
+    return _pair_metric(_reductions["hd95"], data1, data2, voxelspacing, empty_value)
 
 
-def mod_hausdorff_distance(data1, data2, voxelspacing=None, percentile=95):
-    data1, data2 = to_numpy(data1), to_numpy(data2)
-    hd1 = __surface_distances(data1, data2, voxelspacing, connectivity=1)
-    hd2 = __surface_distances(data2, data1, voxelspacing, connectivity=1)
-    hd95_1 = np.percentile(hd1, percentile)
-    hd95_2 = np.percentile(hd2, percentile)
-    mhd = max(hd95_1, hd95_2)
-    return mhd
+def mod_hausdorff_distance(data1, data2, voxelspacing=None, percentile=95, empty_value=np.nan):
+    """the maximum of the two directed `percentile`-th distances"""
+    return _pair_metric(
+        lambda sds1, sds2: max(np.percentile(sds1, percentile), np.percentile(sds2, percentile)),
+        data1, data2, voxelspacing, empty_value
+    )
 
 
-def average_surface_distance(data1, data2, voxelspacing=None):
-    data1, data2 = to_numpy(data1), to_numpy(data2)
-    return assd(data1, data2, voxelspacing)
+def average_surface_distance(data1, data2, voxelspacing=None, empty_value=np.nan):
+    """symmetric average surface distance, as medpy's `assd`"""
+    return _pair_metric(_reductions["assd"], data1, data2, voxelspacing, empty_value)
@@ -1,33 +1,60 @@
-from typing import List, Union
+import weakref
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import List, Union, Optional
 
 import numpy as np
-from deepclustering2.meters2.individual_meters._metric import _Metric, MeterResultDict
-from deepclustering2.utils import (
-    simplex,
-    one_hot,
-    class2one_hot,
-    probs2one_hot,
-    to_float,
-)
+import torch
 from torch import Tensor
 
+from .metric import Metric, MetricExecutor, scatter_rows
 from .surface_distance import (
     mod_hausdorff_distance,
     hausdorff_distance,
+    hausdorff_distance_95,
     average_surface_distance,
+    surface_distances,
 )
+from .utils import MeterResultDict, to_float
+from ..utils import (
+    one_hot,
+    class2one_hot,
+    probs2one_hot,
+    validate,
+)
+
+__all__ = ["SurfaceMeter"]
+
+_meter_choices = {
+    "mod_hausdorff": mod_hausdorff_distance,
+    "hausdorff": hausdorff_distance,
+    "hausdorff95": hausdorff_distance_95,
+    "average_surface": average_surface_distance,
+}
+# names of the batched kernel `surface_distances`
+_kernel_names = {"mod_hausdorff": "mhd", "hausdorff": "hd", "hausdorff95": "hd95", "average_surface": "assd"}
+
+
+def _surface_job(metername: str, pred: np.ndarray, target: np.ndarray, voxelspacing):
+    # module level, to be picklable by the process pool.
+    return _meter_choices[metername](pred, target, voxelspacing=voxelspacing)
+
 
+class SurfaceMeter(Metric):
+    """
+    surface distance meter, one value per sample and per reported class.
 
-class SurfaceMeter(_Metric):
-    meter_choices = {
-        "mod_hausdorff": mod_hausdorff_distance,
-        "hausdorff": hausdorff_distance,
-        "average_surface": average_surface_distance,
-    }
-    abbr = {"mod_hausdorff": "MHD", "hausdorff": "HD", "average_surface": "ASD"}
+    The (b, c) pairs of a batch are independent jobs: with `num_workers` > 0 they are fanned out to a pool of
+    threads (the erosion and the distance transform of scipy release the GIL) or of processes if `use_process`.
+    A pair with exactly one empty mask has no defined distance and is ignored by the mean and the std, a pair of
+    empty masks counts as 0. The pool is created by the first `add` and shut down by `shutdown` or when the meter is
+    garbage collected, it is not part of the pickled or copied meter.
+    """
+    meter_choices = _meter_choices
+    abbr = {"mod_hausdorff": "MHD", "hausdorff": "HD", "hausdorff95": "HD95", "average_surface": "ASD"}
 
-    def __init__(self, C=4, report_axises=None, metername: str = "hausdorff") -> None:
-        super(SurfaceMeter, self).__init__()
+    def __init__(self, C=4, report_axises=None, metername: str = "hausdorff", num_workers: int = 0,
+                 use_process=False, threaded=False, executor: MetricExecutor = None) -> None:
+        super(SurfaceMeter, self).__init__(threaded=threaded, executor=executor)
         assert report_axises is None or isinstance(
             report_axises, (list, tuple)
         ), f"`report_axises` should be either None or an iterator, given {type(report_axises)}"
@@ -44,13 +71,22 @@ class SurfaceMeter(_Metric):
         self._surface_name = metername
         self._abbr = self.abbr[metername]
         self._surface_function = self.meter_choices[metername]
+        assert num_workers >= 0, num_workers
+        self._num_workers = num_workers
+        self._use_process = use_process
+        self._pool: Optional[Executor] = None
+        self._pool_finalizer: Optional[weakref.finalize] = None
         self.reset()
 
     def reset(self):
         self._mhd = []
         self._n = 0
+        # running sums of the defined values and their counts per class, for `cheap_summary`
+        self._running_sum = np.zeros(len(self._report_axis))
+        self._running_count = np.zeros(len(self._report_axis))
+        self._mark_dirty()
 
-    def add(
+    def _add(
         self,
         pred: Tensor,
         target: Tensor,
@@ -60,7 +96,7 @@ class SurfaceMeter(_Metric):
         add pred and target
         :param pred: class- or onehot-coded tensor of the same shape as the target
         :param target: class- or onehot-coded tensor of the same shape as the pred
-        : res: resolution for different dimension
+        :param voxelspacing: resolution for different dimension
         :return:
         """
         assert pred.shape == target.shape, (
@@ -75,14 +111,20 @@ class SurfaceMeter(_Metric):
         assert mhd.shape == (B, len(self._report_axis))
         self._mhd.append(mhd)
         self._n += 1
+        self._update_running(mhd)
+
+    def _update_running(self, mhd: np.ndarray):
+        defined = ~np.isnan(mhd)
+        self._running_sum += np.where(defined, mhd, 0).sum(0)
+        self._running_count += defined.sum(0)
 
     def value(self, **kwargs):
         if self._n == 0:
             return ([np.nan] * self._C, [np.nan] * self._C)
         mhd = np.concatenate(self._mhd, axis=0)
-        return (mhd.mean(0), mhd.std(0))
+        return (np.nanmean(mhd, 0), np.nanstd(mhd, 0))
 
-    def summary(self) -> dict:
+    def _summary(self) -> dict:
         means, stds = self.value()
         return MeterResultDict(
             {
@@ -91,6 +133,14 @@ class SurfaceMeter(_Metric):
             }
         )
 
+    def _cheap_summary(self) -> dict:
+        # means from the running sums, without concatenating the values of the samples.
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = self._running_sum / self._running_count
+        return MeterResultDict(
+            {f"{self._abbr}{i}": to_float(means[num]) for num, i in enumerate(self._report_axis)}
+        )
+
     def detailed_summary(self) -> dict:
         means, stds = self.value()
         return MeterResultDict(
@@ -100,12 +150,46 @@ class SurfaceMeter(_Metric):
                     for num, i in enumerate(self._report_axis)
                 },
                 **{
-                    f"{self._abbr}{i}": to_float(stds[num].item())
+                    f"{self._abbr}_std{i}": to_float(stds[num])
                     for num, i in enumerate(self._report_axis)
                 },
             }
         )
 
+    def _sync_metadata(self):
+        return sum(len(x) for x in self._mhd), self._n
+
+    def _sync_tensors(self, metadata, rank):
+        # the per-sample values of all ranks are concatenated, as their std is reported.
+        rows = np.concatenate(self._mhd, axis=0) if self._mhd else np.zeros((0, len(self._report_axis)))
+        return [scatter_rows(torch.from_numpy(rows), [size for size, _ in metadata], rank)]
+
+    def _load_sync_tensors(self, metadata, tensors):
+        self.reset()
+        self._mhd = [tensors[0].cpu().numpy()]
+        self._n = sum(n for _, n in metadata)
+        self._update_running(self._mhd[0])
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            pool_class = ProcessPoolExecutor if self._use_process else ThreadPoolExecutor
+            self._pool = pool_class(max_workers=self._num_workers)
+            self._pool_finalizer = weakref.finalize(self, self._pool.shutdown, wait=False)
+        return self._pool
+
+    def shutdown(self):
+        """release the workers, a new pool is created by the next `add`"""
+        if self._pool is not None:
+            self._pool_finalizer.detach()
+            self._pool.shutdown(wait=True)
+            self._pool, self._pool_finalizer = None, None
+
+    def __getstate__(self):
+        # the pool is not picklable, the copies create their own one.
+        state = self.__dict__.copy()
+        state["_pool"], state["_pool_finalizer"] = None, None
+        return state
+
     def _evalue(self, pred: Tensor, target: Tensor, voxelspacing):
         """
         return the B\times C list
@@ -114,24 +198,30 @@ class SurfaceMeter(_Metric):
         :return: tensor of size B x C of type np.array
         """
         assert pred.shape == target.shape
-        assert one_hot(pred, axis=1) and one_hot(target, axis=1)
+        validate(one_hot, pred, axis=1)
+        validate(one_hot, target, axis=1)
         B, C, *hw = pred.shape
-        result = np.zeros([B, len(self._report_axis)])
-        for b, (one_batch_img, one_batch_gt) in enumerate(zip(pred, target)):
-            for c, (one_slice_img, one_slice_gt) in enumerate(
-                zip(one_batch_img[self._report_axis], one_batch_gt[self._report_axis])
-            ):
-                mhd = self._surface_function(
-                    one_slice_img, one_slice_gt, voxelspacing=voxelspacing
-                )
-                result[b, c] = mhd
-        return result
+        # one device to host copy per batch, the jobs share the arrays.
+        pred = pred[:, self._report_axis].bool().cpu().numpy()
+        target = target[:, self._report_axis].bool().cpu().numpy()
+        if self._num_workers == 0:
+            kernel = _kernel_names[self._surface_name]
+            return surface_distances(pred, target, voxelspacing, metrics=(kernel,))[kernel]
+
+        jobs = [(b, c) for b in range(B) for c in range(len(self._report_axis))]
+        preds, targets = [pred[b, c] for b, c in jobs], [target[b, c] for b, c in jobs]
+        names, spacings = [self._surface_name] * len(jobs), [voxelspacing] * len(jobs)
+        chunksize = max(1, len(jobs) // (4 * self._num_workers)) if self._use_process else 1
+        values = self._get_pool().map(_surface_job, names, preds, targets, spacings, chunksize=chunksize)
+        return np.fromiter(values, dtype=np.float64, count=len(jobs)).reshape(B, len(self._report_axis))
 
     def _convert2onehot(self, pred: Tensor, target: Tensor):
-        # only two possibility: both onehot or both class-coded.
+        # only two possibility: both onehot or both class-coded, told apart by the dtype of `pred` as in
+        # `ConfusionMatrixMeter`, the checks of the values being left to `validate`.
         assert pred.shape == target.shape
         # if they are onehot-coded:
-        if simplex(pred, 1) and one_hot(target):
+        if pred.is_floating_point():
+            validate(one_hot, target)
             return probs2one_hot(pred).long(), target.long()
         # here the pred and target are labeled long
         return (
@@ -1,10 +1,11 @@
 from abc import ABCMeta
 from collections import OrderedDict
-from collections import deque
-from queue import Queue as _Queue
-from typing import Dict, Any
+from numbers import Number
+from typing import Dict, Any, Iterable, Union
 
+import numpy as np
 import pandas as pd
+import torch
 
 
 def OrderedDict2DataFrame(dictionary: Dict[int, Dict]):
@@ -15,6 +16,26 @@ def OrderedDict2DataFrame(dictionary: Dict[int, Dict]):
     return validated_table
 
 
+class MeterResultDict(OrderedDict):
+    def __repr__(self):
+        return "\t".join(f"{k}:{v:.3f}" for k, v in self.items())
+
+
+def to_float(value: Union[torch.Tensor, np.ndarray, Number]) -> float:
+    if isinstance(value, torch.Tensor):
+        return float(value.item())
+    if isinstance(value, np.ndarray):
+        return float(value.item())
+    return float(value)
+
+
+def average_list(values: Iterable[Number]) -> float:
+    values = list(values)
+    if len(values) == 0:
+        return np.nan
+    return sum(values) / len(values)
+
+
 class HistoricalContainer(metaclass=ABCMeta):
     """
     Aggregate historical information in a ordered dict.
@@ -62,27 +83,3 @@ def rename_df_columns(dataframe: pd.DataFrame, name: str, sep="_"):
     dataframe.columns = list(map(lambda x: name + sep + x, dataframe.columns))
     return dataframe
 
-
-class ThreadQueue:
-    def __init__(self, use_deque=False) -> None:
-        super().__init__()
-        self._use_deque = use_deque
-        if use_deque:
-            self.__queue = deque()
-        else:
-            self.__queue = _Queue()
-
-    def get(self):
-        if self._use_deque:
-            self.__queue: deque
-            return self.__queue.popleft()
-        self.__queue: _Queue
-        return self.__queue.get()
-
-    def put(self, item):
-        if self._use_deque:
-            self.__queue: deque
-            self.__queue.append(item)
-        else:
-            self.__queue: _Queue
-            self.__queue.put(item)
@@ -50,20 +50,29 @@ class tqdm(_tqdm):
         return self.set_description(desc=des)
 
     def set_postfix_statics(self, group_dictionary, group_iter_time=None, cache_time=10):
+        """
+        :param group_dictionary: mapping of group name to statistics, read only every `cache_time` iterations, e.g.
+                                 the lazy `MeterInterface.progress_statistics()`
+        """
         self._cur_iter += 1
-        if not hasattr(self, "__cached__"):
-            self.__cached__ = dict(group_dictionary)
-            self._group_keys = list(self.__cached__.keys())
-        if self._cur_iter % cache_time == 0:
+        refreshed = False
+        if not hasattr(self, "__cached__") or self._cur_iter % cache_time == 0:
             self.__cached__ = dict(group_dictionary)  # noqa
             self._group_keys = list(self.__cached__.keys())  # noqa
+            refreshed = True
         if group_iter_time is None:
+            displayed = None
+        else:
+            displayed = self._group_keys[self._cur_iter // group_iter_time % len(self._group_keys)]
+        # the postfix is only formatted again when the statistics or the displayed group change
+        if not refreshed and displayed == getattr(self, "_displayed_group", None):
+            return
+        self._displayed_group = displayed
+        if displayed is None:
             return self._set_postfix_statics(self.__cached__)
-        group_index = self._cur_iter // group_iter_time % len(self._group_keys)
-        group_name = self._group_keys[group_index]
         if len(self._group_keys) == 1:
-            return self._set_postfix_statics(self.__cached__[group_name])
-        return self._set_postfix_statics({group_name: self.__cached__[group_name]})
+            return self._set_postfix_statics(self.__cached__[displayed])
+        return self._set_postfix_statics({displayed: self.__cached__[displayed]})
 
     def _set_postfix_statics(self, dict2display):
         pretty_str = create_meter_display(dict2display)
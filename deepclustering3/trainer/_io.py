@@ -8,6 +8,7 @@ from typing import Dict
 import torch
 
 from ._buffer import _BufferMixin
+from ..data.loader import is_stateful_loader, loader_state_dict, load_loader_state_dict
 from ..meters.storage_interface import Storage
 from ..types import typePath
 from ..utils.io import path2Path, yaml_write
@@ -61,6 +62,9 @@ class _IOMixin(_BufferMixin, metaclass=ABCMeta):
         for module_name, module in local_modules.items():
             if hasattr(module, "state_dict") and callable(module.state_dict):
                 local_state_dict[module_name] = module.state_dict()
+            elif is_stateful_loader(module):
+                # data order of loaders with an `InfiniteRandomSampler`
+                local_state_dict[module_name] = loader_state_dict(module)
         destination = {**local_state_dict, **{"_buffers": buffer_state_dict}}
         return destination
 
@@ -79,11 +83,12 @@ class _IOMixin(_BufferMixin, metaclass=ABCMeta):
                 super(_IOMixin, self).load_state_dict(state_dict["_buffers"])
                 continue
 
-            if hasattr(module, "load_state_dict") and callable(
-                getattr(module, "load_state_dict", None)
-            ):
+            if callable(getattr(module, "load_state_dict", None)) or is_stateful_loader(module):
                 try:
-                    module.load_state_dict(state_dict[module_name])
+                    if is_stateful_loader(module):
+                        load_loader_state_dict(module, state_dict[module_name])
+                    else:
+                        module.load_state_dict(state_dict[module_name])
                 except KeyError:
                     missing_keys.append(module_name)
                 except Exception as ex:
@@ -9,6 +9,7 @@ from deepclustering3.scheduler.warmup import GradualWarmupScheduler
 from ._functional import _ToMixin
 from ._io import _IOMixin, _TensorWriterMixin, _StorageMixin
 from ..amp.ddp import _DDPMixin
+from ..data.loader import shard_eval_loader
 from ..epocher import Epocher
 from ..epocher.hooks import EpocherHook
 from ..types import criterionType as _criterion_type, dataIterType as _dataiter_type, genericLoaderType as _loader_type, \
@@ -87,18 +88,26 @@ class Trainer(_DDPMixin, _StorageMixin, _TensorWriterMixin, _ToMixin, _IOMixin,
         start_epoch = max(self._cur_epoch + 1, self._start_epoch)
         self._cur_score: float
 
+        # in a distributed run, every rank evaluates its shard of the validation set and the metrics are synchronized
+        # by the epochers. A loader which cannot be sharded is evaluated on the master only, without synchronization.
+        val_loader = shard_eval_loader(self._val_loader)
+
         for self._cur_epoch in range(start_epoch, self._max_epoch):
-            with self._storage:  # save csv each epoch
-                train_metrics = self.run_tra_epoch()
-                if self.on_master():
-                    eval_metrics, cur_score = self.run_eval_epoch(model=self._model, loader=self._val_loader)
+            train_metrics = self.run_tra_epoch()
+            if val_loader is not None:
+                eval_metrics, cur_score = self.run_eval_epoch(model=self._model, loader=val_loader)
+            elif self.on_master():
+                eval_metrics, cur_score = self.run_eval_epoch(model=self._model, loader=self._val_loader,
+                                                              sync_meters=False)
+            if self.on_master():
+                with self._storage:  # save csv each epoch
                     self._storage.add_from_meter_interface(tra=train_metrics, val=eval_metrics, epoch=self._cur_epoch)
                     self._writer.add_scalars_from_meter_interface(
                         tra=train_metrics, val=eval_metrics, epoch=self._cur_epoch
                     )
-                self.save_to(save_name="last.pth")
-                if self._best_score < cur_score:
-                    self.save_to(save_name="best.pth")
+                    self.save_to(save_name="last.pth")
+                    if self._best_score < cur_score:
+                        self.save_to(save_name="best.pth")
 
     def run_tra_epoch(self, **kwargs):
         epocher = self._create_tra_epoch(**kwargs)
@@ -121,8 +130,9 @@ class Trainer(_DDPMixin, _StorageMixin, _TensorWriterMixin, _ToMixin, _IOMixin,
         ...
 
     @torch.no_grad()
-    def run_eval_epoch(self, *, model, loader, **kwargs):
+    def run_eval_epoch(self, *, model, loader, sync_meters=True, **kwargs):
         epocher = self._create_eval_epoch(model=model, loader=loader, **kwargs)
+        epocher.sync_meters = sync_meters
         return self._run_eval_epoch(epocher)
 
     @abstractmethod
@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 from functools import partial
 from functools import reduce
 from itertools import repeat
@@ -40,6 +41,55 @@ triple = _ntuple(3)
 quadruple = _ntuple(4)
 
 
+# validation mode of the checks run in the hot paths (meters, criterions, one-hot conversions)
+_VALIDATION_MODES = ("off", "sampled", "strict")
+_validation = {"mode": "strict", "every": 100, "calls": 0}
+
+
+def set_validation_mode(mode: str, every: int = 100) -> None:
+    """
+    :param mode: `strict` runs all checks passed to `validate`, `sampled` runs one call out of `every`,
+                 `off` skips them, avoiding their host-device synchronizations.
+    :param every: sampling period of the `sampled` mode
+    """
+    if mode not in _VALIDATION_MODES:
+        raise ValueError(f"validation mode should be in {_VALIDATION_MODES}, given {mode}.")
+    if every <= 0:
+        raise ValueError(f"every should be a positive integer, given {every}.")
+    _validation.update(mode=mode, every=int(every), calls=0)
+
+
+def get_validation_mode() -> str:
+    return _validation["mode"]
+
+
+@contextmanager
+def validation_mode(mode: str, every: int = 100):
+    previous = _validation["mode"], _validation["every"]
+    set_validation_mode(mode, every)
+    try:
+        yield
+    finally:
+        set_validation_mode(*previous)
+
+
+def validate(check: Callable[..., bool], *args, **kwargs) -> None:
+    """
+    run `check(*args, **kwargs)` according to the validation mode, raising an AssertionError if it fails.
+    To be used instead of `assert` for the checks which are not needed for the logic.
+    >>> validate(simplex, probs, axis=1)  # noqa
+    """
+    mode = _validation["mode"]
+    if mode == "off":
+        return
+    if mode == "sampled":
+        _validation["calls"] += 1
+        if _validation["calls"] % _validation["every"] != 0:
+            return
+    if not check(*args, **kwargs):
+        raise AssertionError(f"validation `{getattr(check, '__name__', check)}` failed.")
+
+
 # Assert utils
 def uniq(a: Tensor) -> Set:
     """
@@ -52,14 +102,40 @@ def uniq(a: Tensor) -> Set:
     return set([x.item() for x in a.unique()])
 
 
+def _integer_range(sub: Iterable):
+    """(low, high) if `sub` is a range of consecutive integers, else None"""
+    values = sorted(set(sub))
+    if not values or not all(isinstance(x, int) and not isinstance(x, bool) for x in values):
+        return None
+    if values[-1] - values[0] + 1 != len(values):
+        return None
+    return values[0], values[-1]
+
+
 def sset(a: Tensor, sub: Iterable) -> bool:
     """
     if a tensor is the subset of the other
+    For a range of consecutive integers, e.g. `[0, 1]` or `range(C)`, the check is a min/max and integrality test
+    with a single synchronization, instead of `unique` with one `.item()` per element.
     :param a:
     :param sub:
     :return:
     """
-    return uniq(a).issubset(sub)
+    sub = list(sub)
+    integer_range = _integer_range(sub)
+    if integer_range is None:
+        return uniq(a).issubset(sub)
+    if a.numel() == 0:
+        return True
+    if a.dtype == torch.bool:
+        a = a.to(torch.uint8)
+    if a.is_floating_point():
+        stats = torch.stack([a.min().double(), a.max().double(), (a != a.round()).any().double()])
+    else:
+        stats = torch.stack([a.min().double(), a.max().double(), torch.zeros((), dtype=torch.double,
+                                                                             device=a.device)])
+    low, high, non_integer = stats.tolist()
+    return integer_range[0] <= low and high <= integer_range[1] and not non_integer
 
 
 def eq(a: Tensor, b: Tensor) -> bool:
@@ -112,7 +188,7 @@ def union(a: Tensor, b: Tensor) -> Tensor:
 
 
 def probs2class(probs: Tensor, class_dim: int = 1) -> Tensor:
-    assert simplex(probs, axis=class_dim)
+    validate(simplex, probs, axis=class_dim)
     res = probs.argmax(dim=class_dim)
     return res
 
@@ -123,23 +199,23 @@ def class2one_hot(seg: Tensor, C: int, class_dim: int = 1) -> Tensor:
     """
     if len(seg.shape) == 2:  # Only w, h, used by the dataloader
         seg = seg.unsqueeze(dim=0)
-    assert sset(seg, list(range(C)))
+    validate(sset, seg, list(range(C)))
 
     b, *wh = seg.shape  # type:  Tuple[int, int, int]
 
     res: Tensor = torch.stack([seg == c for c in range(C)], dim=class_dim).type(
         torch.long
     )
-    assert one_hot(res, axis=class_dim)
+    validate(one_hot, res, axis=class_dim)
     return res
 
 
 def probs2one_hot(probs: Tensor, class_dim: int = 1) -> Tensor:
     C = probs.shape[class_dim]
-    assert simplex(probs, axis=class_dim)
+    validate(simplex, probs, axis=class_dim)
     res = class2one_hot(probs2class(probs, class_dim=class_dim), C, class_dim=class_dim)
     assert res.shape == probs.shape
-    assert one_hot(res, class_dim)
+    validate(one_hot, res, class_dim)
     return res
 
 
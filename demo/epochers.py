@@ -35,7 +35,9 @@ class TrainEpocher(EpocherWithPlugin, _ProcessData, metaclass=ABCMeta):
 
     def _run(self, **kwargs):
         self._model.train()
-        for self._cur_batch, data in zip(self.indicator, self._train_iter):
+        for self._cur_batch in self.indicator:
+            # `next` continues the stream of the train iterator over the epochs, `iter` would restart it.
+            data = next(self._train_iter)
             image, label = self._preprocess_data(data, self.device)
             self.hooks_before_update()
             prediction_with_logits = self._model(image)
@@ -47,11 +49,11 @@ class TrainEpocher(EpocherWithPlugin, _ProcessData, metaclass=ABCMeta):
             self._optimizer.step()
             with torch.no_grad():
                 with self.meters.focus_on("train"):
-                    self.meters["loss"].add(sup_loss.item())
+                    self.meters["loss"].add(sup_loss.detach())
                 with self.meters.focus_on("reg"):
                     self.meters["acc"].add(
-                        torch.eq(prediction_with_logits.max(1)[1], label.squeeze()).float().mean().item())
-                statics = self.meters.statistics()  # no execution here.
+                        torch.eq(prediction_with_logits.max(1)[1], label.squeeze()).float().mean())
+                statics = self.meters.progress_statistics()  # no execution here.
                 self.indicator.set_postfix_statics(statics, group_iter_time=None, cache_time=10)
             self.hooks_end_update()
 
@@ -78,11 +80,11 @@ class EvalEpocher(EpocherWithPlugin, _ProcessData):
             image, label = self._preprocess_data(data, self.device)
             prediction_with_logits = self._model(image)
             loss = self._criterion(prediction_with_logits, label)
-            self.meters["loss"].add(loss.item())
+            self.meters["loss"].add(loss.detach())
             with self.meters.focus_on("acc"):
                 self.meters["acc"].add(
-                    torch.eq(prediction_with_logits.max(1)[1], label.squeeze()).float().mean().item())
-            statics = self.meters.statistics()
+                    torch.eq(prediction_with_logits.max(1)[1], label.squeeze()).float().mean())
+            statics = self.meters.progress_statistics()
             self.indicator.set_postfix_statics(statics)
 
     def get_score(self):
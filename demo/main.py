@@ -7,6 +7,7 @@ from torchvision.models import resnet18
 from torchvision.transforms import Compose, RandomCrop, ColorJitter, Resize, ToTensor, CenterCrop
 
 from deepclustering3.config import ConfigManger
+from deepclustering3.data.loader import DevicePrefetcher
 from deepclustering3.data.sampler import InfiniteRandomSampler
 from demo.trainers import demoTrainer
 
@@ -42,7 +43,9 @@ with config_parser(scope="base") as config:
     model.conv1 = nn.Conv2d(1, 64, kernel_size=(7, 7), stride=(2, 2), padding=(3, 3), bias=False)
     model.fc = nn.Linear(512, 10)
     resume_from = config["Trainer"].pop("resume_from", None)
-    trainer = demoTrainer(model=model, criterion=nn.CrossEntropyLoss(), tra_loader=iter(train_loader),
+    # the iterator of `train_loader` is created by the first batch, after resuming the sampler state.
+    train_iter = DevicePrefetcher(train_loader, device=config["Trainer"].get("device", "cpu"))
+    trainer = demoTrainer(model=model, criterion=nn.CrossEntropyLoss(), tra_loader=train_iter,
                           val_loader=val_loader, **config["Trainer"])
 
     from deepclustering3.epocher.hooks import EntropyMinHook
@@ -0,0 +1,173 @@
+from unittest import TestCase
+
+import torch
+
+from deepclustering3.augment.tensor_augment import TensorRandomCrop, TensorRandomHorizontalFlip, \
+    TensorRandomRotation, TensorResize, TensorCutout, TensorSequentialWrapper
+
+
+class TestTensorAugment(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self._images = torch.rand(6, 1, 32, 24)
+        self._targets = torch.randint(0, 4, (6, 32, 24))
+
+    def test_crop(self):
+        crop = TensorRandomCrop((16, 12))
+        params = crop.get_params(6, 32, 24, generator=torch.Generator().manual_seed(1))
+        cropped = crop.apply(self._images, params)
+        assert cropped.shape == (6, 1, 16, 12)
+        for i in range(6):
+            top, left = params["top"][i], params["left"][i]
+            assert torch.equal(cropped[i], self._images[i, :, top:top + 16, left:left + 12])
+
+    def test_flip(self):
+        flip = TensorRandomHorizontalFlip(p=0.5)
+        params = flip.get_params(6, 32, 24, generator=torch.Generator().manual_seed(1))
+        flipped = flip.apply(self._images, params)
+        for i in range(6):
+            expected = self._images[i].flip(-1) if params["flip"][i] else self._images[i]
+            assert torch.equal(flipped[i], expected)
+
+    def test_rotation(self):
+        image = torch.rand(2, 1, 16, 16)
+        rotated = TensorRandomRotation(0).apply(image, {"angle": torch.tensor([90.0, 90.0])}, interpolation="nearest")
+        assert torch.equal(rotated, torch.rot90(image, k=1, dims=(-2, -1)))
+
+    def test_wrapper_shares_params(self):
+        transform = TensorSequentialWrapper(
+            com_transform=[TensorRandomCrop(20), TensorRandomHorizontalFlip(), TensorRandomRotation(30),
+                           TensorCutout(4, 8), TensorResize((24, 24))]
+        )
+        images, targets = transform(self._targets[:, None].float(), self._targets,
+                                    generator=torch.Generator().manual_seed(1))
+        assert images.shape == (6, 1, 24, 24) and targets.shape == (6, 24, 24)
+        assert targets.dtype == torch.long
+        assert set(targets.unique().tolist()) <= {0, 1, 2, 3}
+
+        transform = TensorSequentialWrapper(com_transform=[TensorRandomCrop(20), TensorRandomHorizontalFlip()])
+        images, targets = transform(self._targets[:, None].float(), self._targets,
+                                    generator=torch.Generator().manual_seed(2))
+        assert torch.equal(images[:, 0].long(), targets)
+
+
+class TestExplicitParams(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        import numpy as np
+        from PIL import Image
+        self._image = Image.fromarray(np.random.randint(0, 4, (40, 32), dtype=np.uint8))
+
+    def test_shared_params(self):
+        from deepclustering3.augment import SequentialWrapper
+        from deepclustering3.augment.pil_augment import Compose, RandomCrop, RandomHorizontalFlip, RandomRotation, \
+            PILCutout, ToLabel, has_params_protocol
+        # images are rotated with bilinear and targets with nearest, a right angle resamples both exactly.
+        com_transform = Compose([RandomCrop(24), RandomHorizontalFlip(), RandomRotation((90, 90)), PILCutout(2, 6)])
+        assert has_params_protocol(com_transform)
+        transform = SequentialWrapper(com_transform, image_transform=ToLabel(), target_transform=ToLabel())
+        images, targets = transform([self._image, self._image], [self._image], com_seed=3)
+        assert images[0].shape == (1, 24, 24)
+        assert torch.equal(images[0], images[1]) and torch.equal(images[0], targets[0])
+        images_, _ = transform([self._image], [self._image], com_seed=3)
+        assert torch.equal(images[0], images_[0])
+
+    def test_rotation_interpolation(self):
+        import numpy as np
+        from PIL import Image
+        from deepclustering3.augment.pil_augment import RandomRotation
+        rotation = RandomRotation(30, resample=Image.BILINEAR)
+        assert np.array_equal(np.asarray(rotation.apply(self._image, 30.0)),
+                              np.asarray(self._image.rotate(30.0, Image.BILINEAR)))
+        nearest = rotation.apply(self._image, 30.0, interpolation=Image.NEAREST)
+        assert np.array_equal(np.asarray(nearest), np.asarray(self._image.rotate(30.0, Image.NEAREST)))
+
+    def test_global_states_untouched(self):
+        import random
+        import numpy as np
+        from deepclustering3.augment import SequentialWrapperTwice
+        from deepclustering3.augment.pil_augment import Compose, RandomCrop, ToTensor, ToLabel
+        transform = SequentialWrapperTwice(Compose([RandomCrop(24)]), image_transform=ToTensor(),
+                                           target_transform=ToLabel(), total_freedom=False)
+        random_state, np_state, torch_state = random.getstate(), np.random.get_state(), torch.get_rng_state()
+        (image1, image2), (target1, target2) = transform([self._image], [self._image], seed=1)
+        assert random.getstate() == random_state
+        assert np.array_equal(np.random.get_state()[1], np_state[1])
+        assert torch.equal(torch.get_rng_state(), torch_state)
+        assert torch.equal(target1, target2)
+
+    def test_fused_geometric(self):
+        from deepclustering3.augment import SequentialWrapper
+        from deepclustering3.augment.pil_augment import Compose, RandomCrop, RandomHorizontalFlip, RandomRotation, \
+            Resize, ToLabel
+        com_transform = Compose([RandomCrop(24), RandomRotation((90, 90)), RandomHorizontalFlip(), Resize((48, 48))])
+        fused = SequentialWrapper(com_transform, image_transform=ToLabel(), target_transform=ToLabel(),
+                                  fuse_geometric=True)
+        separate = SequentialWrapper(com_transform, image_transform=ToLabel(), target_transform=ToLabel())
+        for seed in range(5):
+            images, targets = fused([self._image], [self._image], com_seed=seed)
+            images_, targets_ = separate([self._image], [self._image], com_seed=seed)
+            assert images[0].shape == targets[0].shape == (1, 48, 48)
+            # labels are resampled with nearest in both cases
+            assert torch.equal(targets[0], targets_[0])
+
+    def test_fused_tolerance(self):
+        import numpy as np
+        from PIL import Image
+        from deepclustering3.augment import SequentialWrapper
+        from deepclustering3.augment.pil_augment import Compose, RandomCrop, RandomHorizontalFlip, RandomRotation, \
+            Resize, ToLabel
+        image = Image.fromarray(np.add.outer(np.arange(40) * 3, np.arange(32) * 2).astype(np.uint8))
+        for size in [(48, 48), (12, 12)]:
+            com_transform = Compose([RandomCrop(24), RandomRotation(30), RandomHorizontalFlip(), Resize(size)])
+            fused = SequentialWrapper(com_transform, image_transform=ToLabel(), target_transform=ToLabel(),
+                                      fuse_geometric=True)
+            separate = SequentialWrapper(com_transform, image_transform=ToLabel(), target_transform=ToLabel())
+            for seed in range(5):
+                (image_,), _ = fused([image], [image], com_seed=seed)
+                (image__,), _ = separate([image], [image], com_seed=seed)
+                assert image_.shape == image__.shape == (1, *size)
+                # both paths resample the images bilinearly, only the rounding of the chained passes differs
+                assert (image_.float() - image__.float()).abs().mean() < 6, (size, seed)
+
+    def test_fused_filters(self):
+        import numpy as np
+        from PIL import Image
+        from deepclustering3.augment.sychronize import apply_fused_with_params
+        from deepclustering3.augment.pil_augment import Compose, RandomRotation, Resize
+        image = Image.fromarray((np.asarray(self._image) > 1).astype(np.uint8) * 200)
+        nearest = Compose([RandomRotation(30, resample=Image.NEAREST), Resize((48, 48), interpolation=Image.NEAREST)])
+        (warped,), _ = apply_fused_with_params([image], [], nearest, np.random.default_rng(0))
+        assert set(np.unique(np.asarray(warped)).tolist()) <= {0, 200}
+        (warped,), _ = apply_fused_with_params([image], [], nearest, np.random.default_rng(0),
+                                               interpolation=Image.BILINEAR)
+        assert not set(np.unique(np.asarray(warped)).tolist()) <= {0, 200}
+
+    def test_n_views(self):
+        from deepclustering3.augment import SequentialWrapperNViews, SequentialWrapperTwice
+        from deepclustering3.augment.pil_augment import Compose, RandomCrop, ToLabel
+        transform = SequentialWrapperNViews(4, Compose([RandomCrop(24)]), image_transform=ToLabel(),
+                                            target_transform=ToLabel(), total_freedom=False)
+        images, targets = transform([self._image, self._image], [self._image], seed=1)
+        assert len(images) == 8 and len(targets) == 4
+        # the common transform is shared, the target output is reused
+        assert all(torch.equal(x, images[0]) for x in images)
+        assert all(t is targets[0] for t in targets)
+
+        twice = SequentialWrapperTwice(Compose([RandomCrop(24)]), image_transform=ToLabel(),
+                                       target_transform=ToLabel(), total_freedom=True)
+        images, targets = twice([self._image], [self._image], seed=1)
+        images_, targets_ = SequentialWrapperNViews(2, Compose([RandomCrop(24)]), image_transform=ToLabel(),
+                                                    target_transform=ToLabel())([self._image], [self._image], seed=1)
+        assert all(torch.equal(x, y) for x, y in zip(images + targets, images_ + targets_))
+
+
+class TestAugmentBench(TestCase):
+    def test_benchmark(self):
+        import json
+        from deepclustering3.augment.bench import run_benchmark
+        results = run_benchmark(num_samples=4, batch_size=2, size=(64, 64), repeats=1)
+        assert len(results["per_transform"]) == 5
+        assert set(results["engines"]) == {"pil", "pil_fused", "pil_seeded", "tensor"}
+        assert all(r["samples_per_second"] > 0 for r in results["engines"].values())
+        json.dumps(results)
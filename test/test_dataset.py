@@ -81,3 +81,249 @@ class TestACDCTransform(TestCase):
         del train_scans
         assert len(labeled_set.get_scan_list()) == 10
         assert len(unlabeled_set.get_scan_list()) == 165
+
+
+def create_fake_dataset(root: str, num_scans=3, num_slices=4, size=(32, 24)):
+    import os
+    import numpy as np
+    from PIL import Image
+    for sub_folder in ("img", "gt"):
+        os.makedirs(os.path.join(root, "train", sub_folder), exist_ok=True)
+    for p in range(num_scans):
+        for s in range(num_slices):
+            name = f"patient{p:03d}_00_{s}.png"
+            Image.fromarray(np.random.randint(0, 255, size=size[::-1], dtype=np.uint8)) \
+                .save(os.path.join(root, "train", "img", name))
+            Image.fromarray(np.random.randint(0, 4, size=size[::-1], dtype=np.uint8)) \
+                .save(os.path.join(root, "train", "gt", name))
+
+
+class FakeDatasetTestCase(TestCase):
+    """a fake dataset in a temporary root, wrapped by a `DatasetBase` as `self._dataset`"""
+    num_scans = 3
+    num_slices = 4
+    make_dataset = True
+
+    def setUp(self) -> None:
+        super().setUp()
+        import tempfile
+        from deepclustering3.data.dataset import DatasetBase
+        self._root = tempfile.mkdtemp()
+        create_fake_dataset(self._root, num_scans=self.num_scans, num_slices=self.num_slices)
+        if self.make_dataset:
+            self._dataset = DatasetBase(root_dir=self._root, mode="train", sub_folders=["img", "gt"],
+                                        sub_folder_types=["image", "gt"], group_re=r"patient\d+_\d+")
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        shutil.rmtree(self._root)
+
+
+class TestPackedDataset(FakeDatasetTestCase):
+    def test_pack(self):
+        (image, target), filename = self._dataset[5]
+        self._dataset.pack()
+        assert self._dataset.is_packed()
+        (image_, target_), filename_ = self._dataset[5]
+        assert filename == filename_
+        assert torch.allclose(image, image_) and torch.equal(target, target_)
+
+    def test_modified_after_packing(self):
+        import os
+        import numpy as np
+        from PIL import Image
+        self._dataset.pack()
+        path = self._dataset._memory["gt"][5]  # noqa
+        Image.fromarray(np.full((24, 32), 3, dtype=np.uint8)).save(path)
+        os.utime(path, ns=(0, 0))  # a different mtime even on coarse file systems
+        (_, target), _ = self._dataset[5]
+        assert (target == 3).all()
+        # a new pack is made as the existing one is stale
+        self._dataset.pack()
+        assert self._dataset._packed_storage["gt"].is_fresh(path)  # noqa
+
+    def test_pack_palette(self):
+        import os
+        import numpy as np
+        from PIL import Image
+        from deepclustering3.data.dataset._packed import pack_sub_folder
+        path = os.path.join(self._root, "palette.png")
+        image = Image.fromarray(np.random.randint(0, 4, size=(8, 8), dtype=np.uint8)).convert("P")
+        image.putpalette([10, 20, 30] * 256)
+        image.save(path)
+        store = pack_sub_folder([path], os.path.join(self._root, ".packed"), "palette")
+        packed = store.get_image(path)
+        assert packed.mode == "P" and packed.getpalette()[:3] == [10, 20, 30]
+        assert np.array_equal(np.asarray(packed), np.asarray(Image.open(path)))
+
+    def test_pack_sub_dataset(self):
+        self._dataset.pack()
+        sub_set = extract_sub_dataset_based_on_scan_names(self._dataset, ["patient001_00"])
+        assert len(sub_set) == 4
+        (image, target), filename = sub_set[0]
+        assert filename.startswith("patient001_00")
+
+
+class TestCachedDataset(FakeDatasetTestCase):
+    def test_bounded_cache(self):
+        # each slice of the fake dataset is 32 * 24 bytes, two sub-folders.
+        self._dataset.enable_cache(max_bytes=32 * 24 * 2 * 3)
+        for i in range(len(self._dataset)):
+            _ = self._dataset[i]
+        cache = self._dataset.cache
+        assert len(cache) == 6 and cache.nbytes <= cache.max_bytes
+        assert cache.misses == 2 * len(self._dataset)
+        assert cache.evictions == 2 * len(self._dataset) - 6
+        _ = self._dataset[len(self._dataset) - 1]
+        assert cache.hits == 2
+
+    def test_pickle(self):
+        import pickle
+        self._dataset.enable_cache(shared_counters=True)
+        _ = self._dataset[0]
+        cache = pickle.loads(pickle.dumps(self._dataset)).cache
+        assert len(cache) == 2 and cache.misses == 2
+        _ = cache.get(("img", 0))
+        assert cache.hits == 1 and self._dataset.cache.hits == 0
+
+    def test_preload(self):
+        (image, target), _ = self._dataset[3]
+        self._dataset.preload()
+        assert len(self._dataset.cache) == 2 * len(self._dataset)
+        (image_, target_), _ = self._dataset[3]
+        assert torch.allclose(image, image_) and torch.equal(target, target_)
+
+
+class TestParallelPreload(FakeDatasetTestCase):
+    def test_preload_with_pool(self):
+        for backend in ("thread", "process"):
+            self._dataset.deload()
+            report = self._dataset.preload(num_workers=2, backend=backend)
+            assert report["images"] == 2 * len(self._dataset)
+            assert len(self._dataset.cache) == 2 * len(self._dataset)
+
+    def test_sub_dataset_reuses_preload(self):
+        self._dataset.preload(num_workers=2)
+        sub_set = extract_sub_dataset_based_on_scan_names(self._dataset, ["patient002_00"])
+        assert sub_set.is_preloaded()
+        assert sub_set.cache is self._dataset.cache
+        assert sub_set.cache.misses == 0
+        (image, target), filename = sub_set[1]
+        assert filename.startswith("patient002_00")
+
+
+class TestFileIndex(FakeDatasetTestCase):
+    # the file indexes are built by the tests themselves
+    make_dataset = False
+
+    def test_sidecar_index(self):
+        import os
+        from deepclustering3.data.dataset.base import scan_folder, _index_sidecar_path  # noqa
+        folder = os.path.join(self._root, "train", "img")
+        cache_dir = os.path.join(self._root, "index_cache")
+        # the cache is opt-in, the dataset folders are never written
+        names, stems = scan_folder(folder, [".png"])
+        assert not os.path.exists(cache_dir)
+        assert sorted(os.listdir(os.path.join(self._root, "train"))) == ["gt", "img"]
+        assert scan_folder(folder, [".png"], cache_dir=cache_dir) == (names, stems)
+        assert os.path.exists(_index_sidecar_path(folder, cache_dir))
+        assert names == sorted(os.listdir(folder))
+        assert stems == [x[:-4] for x in names]
+        assert scan_folder(folder, [".png"], cache_dir=cache_dir) == (names, stems)
+
+        open(os.path.join(folder, "extra.txt"), "w").close()
+        open(os.path.join(folder, "patient999_00_0.png"), "w").close()
+        names_, _ = scan_folder(folder, [".png"], cache_dir=cache_dir)
+        assert names_ == sorted(names + ["patient999_00_0.png"])
+        assert not [x for x in os.listdir(cache_dir) if x.endswith(".tmp")]
+
+        # a change hidden by the mtime granularity is still seen through the number of entries
+        stat = os.stat(folder)
+        open(os.path.join(folder, "patient999_00_1.png"), "w").close()
+        os.utime(folder, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        names_, _ = scan_folder(folder, [".png"], cache_dir=cache_dir)
+        assert "patient999_00_1.png" in names_
+
+    def test_read_only_cache_dir(self):
+        import os
+        import stat
+        from deepclustering3.data.dataset.base import scan_folder
+        folder = os.path.join(self._root, "train", "img")
+        cache_dir = os.path.join(self._root, "index_cache")
+        os.mkdir(cache_dir)
+        mode = os.stat(cache_dir).st_mode
+        os.chmod(cache_dir, stat.S_IRUSR | stat.S_IXUSR)
+        try:
+            names, _ = scan_folder(folder, [".png"], cache_dir=cache_dir)
+        finally:
+            os.chmod(cache_dir, mode)
+        assert names == sorted(os.listdir(folder))
+        assert os.listdir(cache_dir) == []
+
+    def test_stem_array(self):
+        from deepclustering3.data.dataset import DatasetBase
+        dataset = DatasetBase(root_dir=self._root, mode="train", sub_folders=["img", "gt"],
+                              sub_folder_types=["image", "gt"])
+        assert dataset.get_stem_list()[0] == "patient000_00_0"
+        _, filename = dataset[0]
+        assert filename == "patient000_00_0"
+
+
+class TestScanIndex(FakeDatasetTestCase):
+    num_scans = 5
+
+    def test_scan_ids(self):
+        assert self._dataset.get_scan_names() == [f"patient{i:03d}_00" for i in range(5)]
+        assert self._dataset.get_scan_ids().tolist() == sum([[i] * 4 for i in range(5)], [])
+
+    def test_lazy_scan_index(self):
+        import os
+        from PIL import Image
+        from deepclustering3.data.dataset import DatasetBase
+        for sub_folder in ("img", "gt"):
+            Image.new("L", (32, 24)).save(os.path.join(self._root, "train", sub_folder, "unmatched.png"))
+        # the pattern is only used by the scan-based methods
+        dataset = DatasetBase(root_dir=self._root, mode="train", sub_folders=["img", "gt"],
+                              sub_folder_types=["image", "gt"], group_re=r"patient\d+_\d+")
+        assert len(dataset) == 21
+        with self.assertRaises(AttributeError):
+            dataset.get_scan_list()
+
+    def test_subset_transforms(self):
+        from deepclustering3.augment import SequentialWrapper
+        sub_set = self._dataset.get_subset([0, 1])
+        sub_set.transforms._image_transform = None  # noqa
+        assert self._dataset.transforms._image_transform is not None  # noqa
+        sub_set.transforms = SequentialWrapper()
+        assert self._dataset.transforms is not sub_set.transforms
+
+    def test_subset_view(self):
+        sub_set = extract_sub_dataset_based_on_scan_names(self._dataset, ["patient003_00", "patient001_00"])
+        assert len(sub_set) == 8
+        assert sub_set.get_scan_list() == ["patient001_00", "patient003_00"]
+        assert sub_set.get_memory_dictionary()["img"][0] == self._dataset.get_memory_dictionary()["img"][4]
+        sub_sub_set = extract_sub_dataset_based_on_scan_names(sub_set, ["patient003_00"])
+        assert sub_sub_set.get_stem_list() == self._dataset.get_stem_list()[12:16]
+        _, filename = sub_sub_set[0]
+        assert filename == "patient003_00_0"
+        assert len(self._dataset) == 20
+
+
+class TestVolumeDataset(FakeDatasetTestCase):
+    def test_volume(self):
+        from deepclustering3.data.dataset import VolumeDataset
+        volume_set = VolumeDataset(self._dataset)
+        assert len(volume_set) == 3
+        (image, target), scan_name = volume_set[1]
+        assert scan_name == "patient001_00"
+        assert image.shape == (4, 24, 32) and target.shape == (4, 24, 32)
+        (image_slice, target_slice), _ = self._dataset[5]
+        assert torch.equal(target[1], target_slice[0])
+
+    def test_scan_batch_loader(self):
+        from torch.utils.data import DataLoader
+        from deepclustering3.data.sampler import ScanBatchSampler
+        loader = DataLoader(self._dataset, batch_sampler=ScanBatchSampler(self._dataset))
+        for (image, target), filenames in loader:
+            assert image.shape[0] == 4
+            assert len(set(f[:13] for f in filenames)) == 1
@@ -0,0 +1,122 @@
+from unittest import TestCase
+
+import torch
+
+from deepclustering3.data.loader import BackgroundGenerator, ProcessPrefetcher
+
+
+def _square(x):
+    if x < 0:
+        raise ValueError(x)
+    return x * x
+
+
+def _generator_with_error():
+    yield 1
+    raise ValueError("error in producer")
+
+
+class TestBackgroundGenerator(TestCase):
+    def test_none_item(self):
+        assert list(BackgroundGenerator(iter([1, None, 2]))) == [1, None, 2]
+
+    def test_exception(self):
+        generator = BackgroundGenerator(_generator_with_error())
+        assert next(generator) == 1
+        with self.assertRaises(ValueError):
+            next(generator)
+
+
+class TestProcessPrefetcher(TestCase):
+    def test_order(self):
+        with ProcessPrefetcher(_square, range(50), num_workers=3, max_prefetch=6) as prefetcher:
+            assert list(prefetcher) == [x * x for x in range(50)]
+            assert prefetcher.stats.num_items == 50
+
+    def test_exception(self):
+        prefetcher = ProcessPrefetcher(_square, [1, 2, -1, 3], num_workers=2)
+        assert next(prefetcher) == 1
+        assert next(prefetcher) == 4
+        with self.assertRaises(ValueError):
+            next(prefetcher)
+
+    def test_finalizer(self):
+        import gc
+        prefetcher = ProcessPrefetcher(_square, range(10), num_workers=2)
+        assert next(prefetcher) == 0
+        finalizer = prefetcher._finalizer
+        assert finalizer.alive
+        del prefetcher
+        gc.collect()
+        # an abandoned prefetcher shuts its pool down as BackgroundGenerator leaves its daemon thread
+        assert not finalizer.alive
+
+
+class TestDevicePrefetcher(TestCase):
+    def test_cpu(self):
+        from deepclustering3.data.loader import DevicePrefetcher
+        batches = [(torch.randn(2, 3), torch.ones(2)) for _ in range(3)]
+        assert all(x[0] is y[0] for x, y in zip(DevicePrefetcher(iter(batches), device="cpu"), batches))
+
+    def test_passes(self):
+        from deepclustering3.data.loader import DevicePrefetcher
+        from torch.utils.data import DataLoader
+        prefetcher = DevicePrefetcher(DataLoader(list(range(6)), batch_size=2), device="cpu")
+        assert next(prefetcher).tolist() == [0, 1]
+        assert next(prefetcher).tolist() == [2, 3]
+        # each loop is a whole pass over the loader
+        for _ in range(2):
+            assert [batch.tolist() for batch in prefetcher] == [[0, 1], [2, 3], [4, 5]]
+        assert not DevicePrefetcher(DataLoader([0], pin_memory=True), device="cpu")._pin_memory  # noqa
+
+    def test_cuda(self):
+        from deepclustering3.data.loader import DevicePrefetcher
+        if not torch.cuda.is_available():
+            self.skipTest("cuda is not available")
+        batches = [{"image": torch.randn(2, 3), "name": ["a", "b"]} for _ in range(3)]
+        results = list(DevicePrefetcher(iter(batches), device="cuda"))
+        assert len(results) == 3
+        assert results[0]["image"].is_cuda and results[0]["name"] == ["a", "b"]
+        assert torch.equal(results[2]["image"].cpu(), batches[2]["image"])
+
+
+class TestFastCollate(TestCase):
+    def test_collate_images(self):
+        import numpy as np
+        from PIL import Image
+        from deepclustering3.data.collate import fast_collate
+        arrays = [np.random.randint(0, 255, (8, 6), dtype=np.uint8) for _ in range(3)]
+        batch = [((Image.fromarray(a), torch.full((2,), float(i))), f"name{i}") for i, a in enumerate(arrays)]
+        (images, vectors), names = fast_collate(batch)
+        assert images.shape == (3, 1, 8, 6) and images.dtype == torch.uint8
+        assert torch.equal(images[1, 0], torch.from_numpy(arrays[1]))
+        assert vectors.shape == (3, 2) and names == ["name0", "name1", "name2"]
+
+        rgb = [np.random.randint(0, 255, (8, 6, 3), dtype=np.uint8) for _ in range(2)]
+        images = fast_collate(rgb)
+        assert images.shape == (2, 3, 8, 6)
+        assert torch.equal(images[0], torch.from_numpy(rgb[0]).permute(2, 0, 1))
+
+    def test_collate_uint16(self):
+        import numpy as np
+        from PIL import Image
+        from deepclustering3.data.collate import fast_collate
+        arrays = [np.random.randint(0, 65535, (8, 6), dtype=np.uint16) for _ in range(2)]
+        images = fast_collate([Image.fromarray(a) for a in arrays])
+        assert images.dtype == torch.int32
+        assert torch.equal(images[1, 0], torch.from_numpy(arrays[1].astype(np.int32)))
+
+    def test_to_tensor_to_label(self):
+        import numpy as np
+        from PIL import Image
+        import torchvision.transforms.functional as tf
+        from deepclustering3.augment.pil_augment import ToTensor, ToLabel
+        for shape in ((8, 6), (8, 6, 3)):
+            image = Image.fromarray(np.random.randint(0, 255, shape, dtype=np.uint8))
+            assert torch.allclose(ToTensor()(image), tf.to_tensor(image))
+        label = Image.fromarray(np.random.randint(0, 3, (8, 6), dtype=np.uint8))
+        target = ToLabel({0: 0, 1: 10, 2: 20})(label)
+        assert target.dtype == torch.long and target.shape == (1, 8, 6)
+        assert torch.equal(target, torch.from_numpy(np.asarray(label, dtype=np.int64))[None] * 10)
+        with self.assertRaises(KeyError):
+            ToLabel({0: 0, 1: 10})(label)
@@ -62,3 +62,452 @@ class TestMeterInterface(TestCase):
         meter_generator = meters.statistics()
         for g, meters in meter_generator:
             print(g, meters)
+
+
+class TestUniversalDice(TestCase):
+    def test_group_dice(self):
+        import torch
+        from deepclustering3.meters.general_dice_meter import UniversalDice
+        torch.manual_seed(1)
+        meter = UniversalDice(C=3)
+        preds, targets, names = [], [], []
+        for i in range(5):
+            pred, target = torch.randint(0, 3, (4, 8, 8)), torch.randint(0, 3, (4, 8, 8))
+            group_name = [f"scan{(i * 4 + j) % 3}" for j in range(4)]
+            meter.add(pred, target, group_name=group_name)
+            preds.append(pred), targets.append(target), names.extend(group_name)
+        pred, target = torch.cat(preds), torch.cat(targets)
+
+        assert meter.group_names == ["scan0", "scan1", "scan2"]
+        expected = []
+        for name in meter.group_names:
+            index = torch.tensor([n == name for n in names])
+            p, t = pred[index], target[index]
+            intersection = torch.stack([((p == c) & (t == c)).sum() for c in range(3)]).double()
+            union = torch.stack([(p == c).sum() + (t == c).sum() for c in range(3)]).double()
+            expected.append((2 * intersection + 1e-6) / (union + 1e-6))
+        expected = torch.stack(expected)
+        assert torch.allclose(meter.log.double(), expected, atol=1e-6)
+        summary = meter.summary()
+        assert abs(summary["DSC1"] - expected[:, 1].mean().item()) < 1e-6
+        assert meter.summary() == summary
+
+    def test_slice_dice(self):
+        import torch
+        from deepclustering3.meters.general_dice_meter import UniversalDice
+        meter = UniversalDice(C=2)
+        for _ in range(10):
+            target = torch.randint(0, 2, (3, 8, 8))
+            meter.add(target, target)
+        assert meter.log.shape == (30, 2)
+        assert abs(meter.summary()["DSC_mean"] - 1.0) < 1e-6
+        meter.reset()
+        assert meter.log is None
+
+    def test_folded_slices(self):
+        import torch
+        from deepclustering3.meters.general_dice_meter import UniversalDice
+        torch.manual_seed(1)
+        meter, folded = UniversalDice(C=3), UniversalDice(C=3, keep_slices=False)
+        for i in range(6):
+            pred, target = torch.randint(0, 3, (4, 8, 8)), torch.randint(0, 3, (4, 8, 8))
+            group_name = "scan" if i % 3 == 0 else None
+            meter.add(pred, target, group_name=group_name)
+            folded.add(pred, target, group_name=group_name)
+        # the slices are not kept as groups, but the statistics are the same
+        assert folded.group_names == ["scan"] and len(meter.group_names) == 1 + 4 * 4
+        for key, value in meter.detailed_summary().items():
+            assert abs(folded.detailed_summary()[key] - value) < 1e-6, key
+
+    def test_onehot_inputs(self):
+        import torch
+        from deepclustering3.meters.general_dice_meter import UniversalDice
+        target = torch.randint(0, 3, (2, 8, 8))
+        onehot = torch.nn.functional.one_hot(target, 3).permute(0, 3, 1, 2)
+        meter, onehot_meter = UniversalDice(C=3), UniversalDice(C=3)
+        meter.add(target, target)
+        # probabilities are told apart from labels by their dtype
+        onehot_meter.add(onehot.float().softmax(1), onehot)
+        assert torch.allclose(meter.log, onehot_meter.log)
+
+
+class TestConfusionMatrixMeter(TestCase):
+    def test_against_dice(self):
+        import torch
+        from deepclustering3.meters.confusion_matrix import ConfusionMatrixMeter
+        from deepclustering3.meters.general_dice_meter import UniversalDice
+        torch.manual_seed(1)
+        meter, dice_meter = ConfusionMatrixMeter(C=3), UniversalDice(C=3)
+        for _ in range(4):
+            pred, target = torch.randint(0, 3, (2, 8, 8)), torch.randint(0, 3, (2, 8, 8))
+            meter.add(pred, target)
+            dice_meter.add(pred, target, group_name="volume")
+        # with a single group, the dice of UniversalDice is the global dice
+        for i in range(3):
+            assert abs(meter.summary()[f"DSC{i}"] - dice_meter.summary()[f"DSC{i}"]) < 1e-5
+        assert meter.confusion_matrix.sum() == 4 * 2 * 8 * 8
+
+    def test_metrics(self):
+        import torch
+        from deepclustering3.meters.confusion_matrix import ConfusionMatrixMeter
+        meter = ConfusionMatrixMeter(C=2, ignore_index=255)
+        pred = torch.tensor([[0, 1, 1, 0]])
+        target = torch.tensor([[0, 1, 0, 255]])
+        meter.add(torch.nn.functional.one_hot(pred, 2).permute(0, 2, 1).float(), target)
+        assert meter.confusion_matrix.tolist() == [[1, 1], [0, 1]]
+        metrics = meter.metrics()
+        assert torch.allclose(metrics["iou"], torch.tensor([0.5, 0.5], dtype=torch.double))
+        assert torch.allclose(metrics["precision"], torch.tensor([1.0, 0.5], dtype=torch.double))
+        assert torch.allclose(metrics["recall"], torch.tensor([0.5, 1.0], dtype=torch.double))
+        assert abs(meter.detailed_summary()["Accuracy"] - 2 / 3) < 1e-6
+
+    def test_labels(self):
+        import math
+        import torch
+        from deepclustering3.meters.confusion_matrix import ConfusionMatrixMeter
+        meter = ConfusionMatrixMeter(C=3)
+        with self.assertRaises(ValueError):
+            meter.add(torch.tensor([[0, 3]]), torch.tensor([[0, 1]]))
+        with self.assertRaises(ValueError):
+            meter.add(torch.tensor([[0, 1]]), torch.tensor([[-1, 1]]))
+        from deepclustering3.utils.rearr import validation_mode
+        with validation_mode("off"):
+            # the bounds are not checked any more, the negative label only fails in `bincount`
+            with self.assertRaises(RuntimeError):
+                meter.add(torch.tensor([[0, 1]]), torch.tensor([[-1, 1]]))
+        # the class 2 is absent from both, as in UniversalDice its dice is 1
+        meter.add(torch.tensor([[0, 1]]), torch.tensor([[0, 1]]))
+        assert abs(meter.summary()["DSC2"] - 1) < 1e-6
+        assert math.isnan(meter.detailed_summary()["IoU2"])
+
+
+class TestSurfaceMeter(TestCase):
+    def test_shared_surface_distances(self):
+        import numpy as np
+        from deepclustering3.meters.surface_distance import surface_distance_pair, hausdorff_distance
+        data1, data2 = np.zeros((10, 10), dtype=bool), np.zeros((10, 10), dtype=bool)
+        data1[2:5, 2:5] = True
+        data2[2:5, 4:8] = True
+        sds1, sds2 = surface_distance_pair(data1, data2)
+        assert sds1.max() == 2 and sds2.max() == 3
+        assert hausdorff_distance(data1, data2) == 3
+        assert hausdorff_distance(data1, data2, voxelspacing=(1, 2)) == 6
+
+    def test_workers(self):
+        import numpy as np
+        import torch
+        from deepclustering3.meters.surface_meter import SurfaceMeter
+        torch.manual_seed(1)
+        target = torch.zeros(4, 16, 16, dtype=torch.long)
+        target[:, 4:12, 4:12] = 1
+        target[:, 6:9, 6:9] = 2
+        pred = target.clone()
+        pred[:, 3:6, 3:13] = torch.randint(0, 3, (4, 3, 10))
+        meters = [SurfaceMeter(C=3, report_axises=[1, 2]),
+                  SurfaceMeter(C=3, report_axises=[1, 2], num_workers=2),
+                  SurfaceMeter(C=3, report_axises=[1, 2], num_workers=2, use_process=True)]
+        for meter in meters:
+            meter.add(pred, target)
+            meter.shutdown()
+        values = [np.concatenate(meter._mhd) for meter in meters]  # noqa
+        assert values[0].shape == (4, 2)
+        assert np.allclose(values[0], values[1]) and np.allclose(values[0], values[2])
+        assert set(meters[0].summary()) == {"HD1", "HD2"}
+
+    def test_pool_lifetime(self):
+        import copy
+        import gc
+        import pickle
+        import torch
+        from deepclustering3.meters.surface_meter import SurfaceMeter
+        target = torch.zeros(2, 16, 16, dtype=torch.long)
+        target[:, 4:12, 4:12] = 1
+        meter = SurfaceMeter(C=2, report_axises=[1], num_workers=2)
+        meter.add(target, target)
+        # the copies do not share the pool of the meter
+        for clone in (copy.deepcopy(meter), pickle.loads(pickle.dumps(meter))):
+            assert clone._pool is None and clone.summary() == meter.summary()  # noqa
+        pool = meter._pool  # noqa
+        del meter
+        gc.collect()
+        assert pool._shutdown  # noqa
+
+
+class TestSurfaceDistances(TestCase):
+    def setUp(self) -> None:
+        import numpy as np
+        rng = np.random.default_rng(1)
+        self.pred = np.zeros((3, 2, 12, 14, 10), dtype=bool)
+        self.target = np.zeros((3, 2, 12, 14, 10), dtype=bool)
+        for b in range(3):
+            for c in range(2):
+                (z, y, x), (dz, dy, dx) = rng.integers(1, 5, size=3), rng.integers(3, 6, size=3)
+                self.pred[b, c, z:z + dz, y:y + dy, x:x + dx] = True
+                self.target[b, c, z + 1:z + dz + 1, y:y + dy + 2, x:x + dx] = True
+        self.pred[0, 0, 9:, 9:, 7:] = True  # a second component
+        self.spacing = (2.5, 0.8, 1.2)
+
+    def test_against_medpy(self):
+        try:
+            from medpy.metric import binary
+        except ImportError:
+            self.skipTest("medpy is not installed")
+        import numpy as np
+        from deepclustering3.meters.surface_distance import surface_distances
+        results = surface_distances(self.pred, self.target, voxelspacing=self.spacing)
+        for b in range(3):
+            for c in range(2):
+                args = (self.pred[b, c], self.target[b, c], self.spacing)
+                assert np.isclose(results["hd"][b, c], binary.hd(*args))
+                assert np.isclose(results["hd95"][b, c], binary.hd95(*args))
+                assert np.isclose(results["assd"][b, c], binary.assd(*args))
+
+    def test_batched_and_pairwise(self):
+        import numpy as np
+        import torch
+        from deepclustering3.meters.surface_distance import surface_distances, hausdorff_distance, \
+            average_surface_distance
+        results = surface_distances(torch.from_numpy(self.pred), torch.from_numpy(self.target), self.spacing,
+                                    metrics=("hd", "assd"))
+        assert set(results) == {"hd", "assd"} and results["hd"].shape == (3, 2)
+        for b in range(3):
+            for c in range(2):
+                assert np.isclose(results["hd"][b, c],
+                                  hausdorff_distance(self.pred[b, c], self.target[b, c], self.spacing))
+                assert np.isclose(results["assd"][b, c],
+                                  average_surface_distance(self.pred[b, c], self.target[b, c], self.spacing))
+        with self.assertRaises(ValueError):
+            surface_distances(self.pred, self.target, voxelspacing=(1, 1))
+
+    def test_empty_masks(self):
+        import numpy as np
+        from deepclustering3.meters.surface_distance import surface_distances, hausdorff_distance
+        pred, target = self.pred.copy(), self.target.copy()
+        pred[0, 0] = False
+        pred[1, 1], target[1, 1] = False, False
+        results = surface_distances(pred, target)
+        assert np.isnan(results["hd"][0, 0]) and results["hd"][1, 1] == 0
+        assert np.isfinite(results["hd95"][2]).all()
+        assert surface_distances(pred, target, empty_value=-1)["assd"][0, 0] == -1
+        assert np.isnan(hausdorff_distance(pred[0, 0], target[0, 0]))
+
+
+class TestMetricExecutor(TestCase):
+    def test_shared_worker(self):
+        import torch
+        from deepclustering3.meters.confusion_matrix import ConfusionMatrixMeter
+        from deepclustering3.meters.meter_interface import MeterInterface
+        from deepclustering3.meters.metric import MetricExecutor
+        executor = MetricExecutor()
+        meters = MeterInterface()
+        meters.register_meter("threaded1", ConfusionMatrixMeter(C=3, executor=executor))
+        meters.register_meter("threaded2", ConfusionMatrixMeter(C=3, executor=executor))
+        meters.register_meter("serial", ConfusionMatrixMeter(C=3))
+        torch.manual_seed(1)
+        for epoch in range(2):
+            with meters:
+                for _ in range(20):
+                    pred, target = torch.randint(0, 3, (2, 8, 8)), torch.randint(0, 3, (2, 8, 8))
+                    for name in ("threaded1", "threaded2", "serial"):
+                        meters[name].add(pred, target)
+            assert executor.num_pending == 0
+            expected = meters["serial"].confusion_matrix
+            assert torch.equal(meters["threaded1"].confusion_matrix, expected)
+            assert torch.equal(meters["threaded2"].confusion_matrix, expected)
+        assert meters["threaded1"].executor is meters["threaded2"].executor
+        executor.close()
+
+    def test_error(self):
+        import torch
+        from deepclustering3.meters.confusion_matrix import ConfusionMatrixMeter
+        from deepclustering3.meters.metric import MetricExecutor
+        executor = MetricExecutor()
+        meter = ConfusionMatrixMeter(C=2, executor=executor)
+        meter.add(torch.tensor([0, 1]), torch.tensor([0, 5]))
+        with self.assertRaises(ValueError):
+            meter.join()
+        meter.add(torch.tensor([0, 1]), torch.tensor([0, 1]))
+        meter.join()
+        assert meter.confusion_matrix.sum() == 2
+        executor.close()
+        with self.assertRaises(RuntimeError):
+            meter.add(torch.tensor([0, 1]), torch.tensor([0, 1]))
+
+
+class TestAverageValueMeter(TestCase):
+    def test_deferred_reduction(self):
+        import numpy as np
+        import torch
+        from deepclustering3.meters.averagemeter import AverageValueMeter
+        meter = AverageValueMeter()
+        assert np.isnan(meter.summary()["mean"])
+        values = torch.randn(1000, dtype=torch.float64)
+        for i, v in enumerate(values):
+            meter.add(v.clone().requires_grad_() if i % 2 else float(v))
+        assert len(meter.values) == 1000
+        assert abs(meter.summary()["mean"] - values.mean().item()) < 1e-10
+        assert abs(meter.summary()["_std"] - values.std().item()) < 1e-10
+        assert meter.val == values[-1].item()
+        meter.add(torch.tensor(10.0), n=2)
+        assert abs(meter.mean - (values.sum().item() + 10) / 1002) < 1e-10
+        meter.reset()
+        meter.add(torch.tensor([3.0]))
+        assert meter.mean == 3 and meter.std == np.inf
+
+
+def _rank_data(rank):
+    import torch
+    generator = torch.Generator().manual_seed(rank)
+    losses = torch.randn(3 + 2 * rank, generator=generator)
+    preds = [torch.randint(0, 3, (2, 6, 6), generator=generator) for _ in range(2 + rank)]
+    targets = [torch.randint(0, 3, (2, 6, 6), generator=generator) for _ in range(2 + rank)]
+    return losses, preds, targets
+
+
+def _fill_meters(meters, data):
+    for losses, preds, targets in data:
+        for loss in losses:
+            meters["loss"].add(loss)
+        meters["lr"].add([0.1] * (1 + len(preds) % 2))
+        for pred, target in zip(preds, targets):
+            meters["confusion"].add(pred, target)
+            meters["scan_dice"].add(pred, target, group_name="scan")
+            meters["slice_dice"].add(pred, target)
+
+
+def _meters():
+    from deepclustering3.meters.averagemeter import AverageValueMeter, AverageValueListMeter
+    from deepclustering3.meters.confusion_matrix import ConfusionMatrixMeter
+    from deepclustering3.meters.general_dice_meter import UniversalDice
+    meters = MeterInterface()
+    meters.register_meter("loss", AverageValueMeter())
+    meters.register_meter("lr", AverageValueListMeter())
+    meters.register_meter("confusion", ConfusionMatrixMeter(C=3))
+    meters.register_meter("scan_dice", UniversalDice(C=3))
+    meters.register_meter("slice_dice", UniversalDice(C=3))
+    return meters
+
+
+def _sync_meters(rank, world_size, init_method, save_dir):
+    import os
+    import torch
+    import torch.distributed as dist
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=world_size)
+    try:
+        meters = _meters()
+        _fill_meters(meters, [_rank_data(rank)])
+        meters.sync()
+        # the meters already hold the global statistics, a second call must not sum them again
+        meters.sync()
+        torch.save({**dict(meters.statistics()), "num_slices": len(meters["slice_dice"].group_names)},
+                   os.path.join(save_dir, f"{rank}.pth"))
+    finally:
+        dist.destroy_process_group()
+
+
+class TestMeterSync(TestCase):
+    def test_gloo(self):
+        import os
+        import tempfile
+        import torch
+        import torch.multiprocessing as mp
+        world_size = 2
+        with tempfile.TemporaryDirectory() as save_dir:
+            init_method = "file://" + os.path.join(save_dir, "rendezvous")
+            mp.spawn(_sync_meters, args=(world_size, init_method, save_dir), nprocs=world_size)
+            results = [torch.load(os.path.join(save_dir, f"{r}.pth")) for r in range(world_size)]
+        meters = _meters()
+        _fill_meters(meters, [_rank_data(r) for r in range(world_size)])
+        expected = dict(meters.statistics())["tra"]
+        assert results[0]["num_slices"] == results[1]["num_slices"] == 2 * 2 + 2 * 3
+        for result in results:
+            for name, summary in expected.items():
+                for key, value in summary.items():
+                    assert abs(result["tra"][name][key] - value) < 1e-6, (name, key)
+
+    def test_single_process(self):
+        # without an initialized process group, `sync` keeps the local statistics.
+        import torch
+        meters = _meters()
+        meters["loss"].add(torch.tensor(2.0))
+        meters.sync()
+        assert meters["loss"].summary()["mean"] == 2.0
+
+    def test_synced_flag(self):
+        import torch
+        meter = _meters()["loss"]
+        meter.add(torch.tensor(2.0))
+        assert not meter._is_synced()
+        meter._mark_synced()
+        assert meter._is_synced()
+        meter.add(torch.tensor(1.0))
+        assert not meter._is_synced()
+        meter._mark_synced()
+        meter.reset()
+        assert not meter._is_synced()
+
+
+class TestCachedSummary(TestCase):
+    def setUp(self) -> None:
+        from deepclustering3.meters.metric import Metric
+
+        class CountingMeter(Metric):
+            def __init__(self):
+                super().__init__()
+                self.num_summaries = 0
+                self.reset()
+
+            def reset(self):
+                self.total = 0
+                self._mark_dirty()
+
+            def _add(self, value):
+                self.total += value
+
+            def _summary(self):
+                self.num_summaries += 1
+                return {"total": self.total, "_hidden": 0}
+
+        self._meter_class = CountingMeter
+
+    def test_dirty_flag(self):
+        meter = self._meter_class()
+        meter.add(2)
+        assert meter.summary()["total"] == 2 and meter.summary()["total"] == 2
+        assert meter.num_summaries == 1
+        del meter.summary()["_hidden"]  # the cache is not exposed to the callers
+        assert "_hidden" in meter.cheap_summary() and meter.num_summaries == 1
+        meter.add(1)
+        assert meter.summary()["total"] == 3 and meter.num_summaries == 2
+        meter.reset()
+        assert meter.summary()["total"] == 0 and meter.num_summaries == 3
+
+    def test_progress_statistics(self):
+        meters = MeterInterface()
+        meters.register_meter("count", self._meter_class())
+        with meters.focus_on("_hidden"):
+            meters.register_meter("count", self._meter_class())
+        view = meters.progress_statistics()
+        for i in range(5):
+            meters["count"].add(1)
+        assert meters["count"].num_summaries == 0
+        assert list(view) == ["tra"]
+        assert view["tra"]["count"]["total"] == 5
+        assert dict(view)["tra"]["count"]["total"] == 5
+        assert meters["count"].num_summaries == 1
+        with self.assertRaises(KeyError):
+            view["_hidden"]  # noqa
+
+    def test_surface_cheap_summary(self):
+        import numpy as np
+        import torch
+        from deepclustering3.meters.surface_meter import SurfaceMeter
+        meter = SurfaceMeter(C=2, report_axises=[1])
+        target = torch.zeros(2, 8, 8, dtype=torch.long)
+        target[:, 2:6, 2:6] = 1
+        pred = target.clone()
+        pred[1] = 0  # undefined distance for the second sample
+        meter.add(pred, target)
+        pred[0, 2:6, 2:7] = 1
+        meter.add(pred, target)
+        assert np.isclose(meter.cheap_summary()["HD1"], meter.summary()["HD1"])
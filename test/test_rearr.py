@@ -0,0 +1,39 @@
+from unittest import TestCase
+
+import torch
+
+from deepclustering3.utils.rearr import sset, one_hot, class2one_hot, validate, validation_mode, \
+    get_validation_mode
+
+
+class TestSset(TestCase):
+    def test_range_check(self):
+        a = torch.randint(0, 4, (2, 16, 16))
+        assert sset(a, range(4)) and sset(a, [0, 1, 2, 3, 4])
+        assert sset(a, [3, 2, 1, 0])
+        assert not sset(torch.tensor([0, 3, 1]), range(3))
+        assert not sset(torch.tensor([0.0, 0.5, 1.0]), [0, 1])
+        assert sset(torch.tensor([0.0, 1.0]), [0, 1])
+        assert sset(torch.tensor([True, False]), [0, 1])
+        assert sset(torch.tensor([1, 3]), [1, 3]) and not sset(torch.tensor([1, 2]), [1, 3])
+        assert one_hot(class2one_hot(a, 4))
+
+
+class TestValidationMode(TestCase):
+    def test_modes(self):
+        calls = []
+
+        def check(x):
+            calls.append(x)
+            return x
+
+        with validation_mode("off"):
+            validate(check, False)
+        assert calls == []
+        with validation_mode("sampled", every=3):
+            for _ in range(6):
+                validate(check, True)
+        assert len(calls) == 2
+        assert get_validation_mode() == "strict"
+        with self.assertRaises(AssertionError):
+            validate(check, False)
@@ -0,0 +1,186 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from deepclustering3.data.sampler import ScanBatchSampler, group_indices_by_scan
+
+
+class TestScanBatchSampler(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self._scan_ids = np.asarray([2, 0, 0, 1, 2, 1, 0])
+
+    def test_group_indices(self):
+        groups = group_indices_by_scan(self._scan_ids)
+        assert [g.tolist() for g in groups] == [[1, 2, 6], [3, 5], [0, 4]]
+
+    def test_scan_batches(self):
+        sampler = ScanBatchSampler(self._scan_ids)
+        assert list(sampler) == [[1, 2, 6], [3, 5], [0, 4]]
+        assert len(sampler) == 3
+
+        sampler = ScanBatchSampler(self._scan_ids, max_batch_size=2)
+        assert list(sampler) == [[1, 2], [6], [3, 5], [0, 4]]
+        assert len(sampler) == 4
+
+        sampler = ScanBatchSampler(self._scan_ids, shuffle=True)
+        assert sorted(list(sampler)) == [[0, 4], [1, 2, 6], [3, 5]]
+
+
+class TestInfiniteRandomSampler(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self._data = list(range(10))
+
+    def test_seeded_stream(self):
+        from itertools import islice
+        from deepclustering3.data.sampler import InfiniteRandomSampler
+        stream1 = list(islice(iter(InfiniteRandomSampler(self._data, seed=1)), 35))
+        stream2 = list(islice(iter(InfiniteRandomSampler(self._data, seed=1)), 35))
+        assert stream1 == stream2
+        for i in range(3):
+            assert sorted(stream1[i * 10:(i + 1) * 10]) == self._data
+
+    def test_next_batch(self):
+        from itertools import islice
+        from deepclustering3.data.sampler import InfiniteRandomSampler
+        stream = list(islice(iter(InfiniteRandomSampler(self._data, seed=1)), 24))
+        iterator = iter(InfiniteRandomSampler(self._data, seed=1))
+        batches = [iterator.next_batch(8).tolist() for _ in range(3)]
+        assert sum(batches, []) == stream
+        assert iterator.num_served == 24
+
+    def test_state_dict(self):
+        from itertools import islice
+        from deepclustering3.data.sampler import InfiniteRandomSampler
+        sampler = InfiniteRandomSampler(self._data, seed=2)
+        iterator = iter(sampler)
+        _ = list(islice(iterator, 13))
+        state = sampler.state_dict()
+        expected = list(islice(iterator, 20))
+
+        resumed = InfiniteRandomSampler(self._data, seed=3)
+        resumed.load_state_dict(state)
+        assert list(islice(iter(resumed), 20)) == expected
+
+        # rewinding across an epoch boundary, as for indices prefetched by a DataLoader
+        state = sampler.state_dict(num_unconsumed=5)
+        sampler.load_state_dict(state)
+        assert list(islice(iterator, 5)) == expected[-5:]
+
+        # rewinding across several epochs, as for many batches prefetched from a small dataset
+        state = sampler.state_dict(num_unconsumed=20)
+        sampler.load_state_dict(state)
+        assert list(islice(iterator, 20)) == expected
+
+    def test_batch_sampler_with_loader(self):
+        from torch.utils.data import DataLoader
+        from deepclustering3.data.loader import loader_state_dict, load_loader_state_dict
+        from deepclustering3.data.sampler import InfiniteRandomSampler, InfiniteBatchSampler
+        loader = DataLoader(self._data, batch_sampler=InfiniteBatchSampler(InfiniteRandomSampler(self._data, seed=4), 4))
+        loader_iter = iter(loader)
+        _ = [next(loader_iter) for _ in range(3)]
+        state = loader_state_dict(loader_iter)
+        expected = [next(loader_iter).tolist() for _ in range(3)]
+
+        loader_iter2 = iter(DataLoader(
+            self._data, batch_sampler=InfiniteBatchSampler(InfiniteRandomSampler(self._data, seed=5), 4)))
+        load_loader_state_dict(loader_iter2, state)
+        assert [next(loader_iter2).tolist() for _ in range(3)] == expected
+
+    def test_resume_before_prefetch(self):
+        from torch.utils.data import DataLoader
+        from deepclustering3.data.loader import DevicePrefetcher, loader_state_dict
+        from deepclustering3.data.sampler import InfiniteRandomSampler
+        # two workers prefetch more indices than the dataset holds
+        loader_iter = iter(DataLoader(self._data, batch_size=4, sampler=InfiniteRandomSampler(self._data, seed=6),
+                                      num_workers=2))
+        _ = [next(loader_iter) for _ in range(2)]
+        state = loader_state_dict(loader_iter)
+        expected = [next(loader_iter).tolist() for _ in range(3)]
+
+        prefetcher = DevicePrefetcher(
+            DataLoader(self._data, batch_size=4, sampler=InfiniteRandomSampler(self._data, seed=7), num_workers=2),
+            device="cpu")
+        prefetcher.load_state_dict(state)
+        assert [next(prefetcher).tolist() for _ in range(3)] == expected
+
+
+def _collect_indices(rank, world_size, init_method, save_dir):
+    from itertools import islice
+    import torch
+    import torch.distributed as dist
+    from deepclustering3.data.sampler import DistributedInfiniteRandomSampler, DistributedWeightedRandomSampler, \
+        DistributedSubsetRandomSampler
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=world_size)
+    try:
+        infinite = list(islice(iter(DistributedInfiniteRandomSampler(range(11), seed=1)), 12))
+        weighted = list(DistributedWeightedRandomSampler([1.0] * 9, num_samples=9, replacement=False, seed=1))
+        subset = list(DistributedSubsetRandomSampler(list(range(100, 110)), seed=1))
+        from torch.utils.data import DataLoader
+        from deepclustering3.data.loader import shard_eval_loader
+        evaluated = [x.tolist() for x in shard_eval_loader(DataLoader(list(range(9)), batch_size=2))]
+        torch.save({"infinite": infinite, "weighted": weighted, "subset": subset, "eval": sum(evaluated, [])},
+                   os.path.join(save_dir, f"{rank}.pth"))
+    finally:
+        dist.destroy_process_group()
+
+
+class TestDistributedSampler(TestCase):
+    def test_shard(self):
+        import torch
+        from deepclustering3.data.sampler import shard_indices
+        indices = torch.arange(5)
+        assert shard_indices(indices, 0, 2).tolist() == [0, 2, 4]
+        assert shard_indices(indices, 1, 2).tolist() == [1, 3, 0]
+        assert shard_indices(indices, 1, 2, drop_last=True).tolist() == [1, 3]
+        assert shard_indices(torch.arange(2), 3, 4).tolist() == [1]
+
+    def test_single_process(self):
+        from itertools import islice
+        from deepclustering3.data.sampler import DistributedInfiniteRandomSampler
+        shards = [list(islice(iter(DistributedInfiniteRandomSampler(range(10), seed=3, rank=r, num_replicas=2)), 5))
+                  for r in range(2)]
+        assert sorted(shards[0] + shards[1]) == list(range(10))
+
+    def test_eval_sampler(self):
+        from torch.utils.data import DataLoader
+        from deepclustering3.data.loader import shard_eval_loader
+        from deepclustering3.data.sampler import DistributedEvalSampler
+        shards = [list(DistributedEvalSampler(range(7), rank=r, num_replicas=3)) for r in range(3)]
+        assert shards == [[0, 3, 6], [1, 4], [2, 5]]
+        assert [len(DistributedEvalSampler(range(7), rank=r, num_replicas=3)) for r in range(3)] == [3, 2, 2]
+        # out of a distributed run, the loader is kept
+        loader = DataLoader(range(7), batch_size=2)
+        assert shard_eval_loader(loader) is loader
+
+    def test_state_dict(self):
+        from itertools import islice
+        from deepclustering3.data.sampler import DistributedInfiniteRandomSampler
+        sampler = DistributedInfiniteRandomSampler(range(10), seed=3, rank=1, num_replicas=3)
+        iterator = iter(sampler)
+        taken = list(islice(iterator, 6))
+        # the last two indices were not consumed, the state crosses back into the second epoch.
+        state = sampler.state_dict(num_unconsumed=2)
+        assert state == {"seed": 3, "epoch": 1, "position": 0}
+        expected = taken[-2:] + list(islice(iterator, 6))
+        resumed = DistributedInfiniteRandomSampler(range(10), seed=3, rank=1, num_replicas=3)
+        resumed.load_state_dict(state)
+        assert list(islice(iter(resumed), 8)) == expected
+
+    def test_gloo(self):
+        import torch
+        import torch.multiprocessing as mp
+        world_size = 2
+        with tempfile.TemporaryDirectory() as save_dir:
+            init_method = "file://" + os.path.join(save_dir, "rendezvous")
+            mp.spawn(_collect_indices, args=(world_size, init_method, save_dir), nprocs=world_size)
+            results = [torch.load(os.path.join(save_dir, f"{r}.pth")) for r in range(world_size)]
+        first_epoch = results[0]["infinite"][:6] + results[1]["infinite"][:6]
+        assert set(first_epoch) == set(range(11))
+        assert len(results[0]["weighted"]) == len(results[1]["weighted"]) == 5
+        assert set(results[0]["weighted"] + results[1]["weighted"]) == set(range(9))
+        assert sorted(results[0]["subset"] + results[1]["subset"]) == list(range(100, 110))
+        assert sorted(results[0]["eval"] + results[1]["eval"]) == list(range(9))